@@ -1,14 +1,35 @@
-from aiohttp import ClientSession, ClientError, ServerDisconnectedError
+from aiohttp import ClientSession, ClientResponse, ClientError, ServerDisconnectedError
 
+import contextlib
 import traceback
 import platform
 import pathlib
 import asyncio
+import base64
 import pickle
+import hashlib
+import gzip
+import json
 import time
+import urllib.parse
 import yaml
 import os
 
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ModuleNotFoundError: # fall back to checking every file every second
+    Observer = None
+    FileSystemEventHandler = object
+
+try:
+    from compression import zstd # Python 3.14+
+except ModuleNotFoundError:
+    try:
+        import zstandard as zstd
+    except ModuleNotFoundError: # gzip only
+        zstd = None
+
 class Config:
     playing_file = ""
     sync_runs = False
@@ -20,6 +41,11 @@ class Config:
     slice_curses = ""
     steam_id = ""
     user_profile = ""
+    delta_sync = True
+    watch_files = True
+    watch_debounce = 0.1
+    rescan_interval = 30
+    run_batch_size = 50
 
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
@@ -62,8 +88,293 @@ class Config:
             "slice_curses": self.slice_curses,
             "steam_id": self.steam_id,
             "user_profile": self.user_profile,
+            "delta_sync": self.delta_sync,
+            "watch_files": self.watch_files,
+            "watch_debounce": self.watch_debounce,
+            "rescan_interval": self.rescan_interval,
+            "run_batch_size": self.run_batch_size,
         }
 
+def decode_save(content: str) -> dict:
+    """Decode the contents of a .autosave file."""
+    decoded = base64.b64decode(content)
+    key = (b"key" * (len(decoded) // 3 + 1))[:len(decoded)]
+    return json.loads((int.from_bytes(decoded) ^ int.from_bytes(key)).to_bytes(len(decoded)))
+
+def save_delta(old: dict, new: dict) -> dict:
+    """Return the keys which changed between two versions of the savefile."""
+    return {
+        "set": {k: v for k, v in new.items() if k not in old or old[k] != v},
+        "delete": [k for k in old if k not in new],
+    }
+
+class PollWatcher:
+    """Wake up the sync loop on a fixed interval, to check every file."""
+
+    events = False
+
+    def watch(self, path: pathlib.Path, recursive: bool = False):
+        pass
+
+    async def wait(self, timeout: float) -> set[pathlib.Path] | None:
+        await asyncio.sleep(timeout)
+        return None # anything may have changed
+
+class EventWatcher(FileSystemEventHandler):
+    """Wake up the sync loop when a watched file changes.
+
+    The games write some files in several steps, so each path has to stay
+    quiet for a short while before it counts as changed. In case an event
+    gets lost, everything is checked again every now and then."""
+
+    events = True
+
+    def __init__(self, debounce: float, rescan: float):
+        self.debounce = debounce
+        self.rescan = rescan
+        self._loop = asyncio.get_running_loop()
+        self._last_rescan = self._loop.time()
+        self._observer = Observer()
+        self._timers: dict[pathlib.Path, asyncio.TimerHandle] = {}
+        self._changed: set[pathlib.Path] = set()
+        self._wake = asyncio.Event()
+        self._observer.start()
+
+    def watch(self, path: pathlib.Path, recursive: bool = False):
+        if path.is_dir():
+            self._observer.schedule(self, str(path), recursive=recursive)
+
+    def on_any_event(self, event):
+        # this is called from the observer thread
+        if event.is_directory and event.event_type == "modified":
+            return
+        for path in (event.src_path, getattr(event, "dest_path", "")):
+            if path:
+                self._loop.call_soon_threadsafe(self._touch, pathlib.Path(os.fsdecode(path)))
+
+    def _touch(self, path: pathlib.Path):
+        if (handle := self._timers.pop(path, None)) is not None:
+            handle.cancel()
+        self._timers[path] = self._loop.call_later(self.debounce, self._settle, path)
+
+    def _settle(self, path: pathlib.Path):
+        del self._timers[path]
+        self._changed.add(path)
+        self._wake.set()
+
+    async def wait(self, timeout: float) -> set[pathlib.Path] | None:
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+        changed, self._changed = self._changed, set()
+        if self._loop.time() - self._last_rescan >= self.rescan:
+            self._last_rescan = self._loop.time()
+            return None
+        return changed
+
+def content_hash(data: dict[str, str]) -> str:
+    """Return the hash of the data of a sync section, the same way the server does."""
+    text = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+class SyncResult:
+    """What the server answered for one section."""
+
+    def __init__(self, status: int, result=None, error: str | None = None, hash: str | None = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.hash = hash
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+class FileHashes:
+    """Remember the hash of each file as the server last acknowledged it.
+
+    The game often writes its files again without changing them, so the
+    modification time alone isn't enough. The hashes are kept on disk (next
+    to the last_run marker), so that a restart doesn't send everything
+    again."""
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.hashes: dict[str, str] = json.load(f)
+        except (OSError, ValueError):
+            self.hashes = {}
+
+    def changed(self, key: str, content: str) -> str | None:
+        """Return the hash of the content if the server doesn't have it yet, or None if it does."""
+        digest = hashlib.blake2b(content.encode("utf-8", "surrogateescape"), digest_size=16).hexdigest()
+        if self.hashes.get(key) == digest:
+            return None
+        return digest
+
+    def update(self, acked: dict[str, str | None]):
+        """Record what the server acknowledged. None means it doesn't have the file anymore."""
+        for key, digest in acked.items():
+            if digest is None:
+                self.hashes.pop(key, None)
+            else:
+                self.hashes[key] = digest
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump(self.hashes, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+class Uploads:
+    """Compress what we upload with the best encoding the server can decode.
+
+    Every aiohttp server can decode gzip, so that is used until the server
+    lists what else it accepts in the Accept-Encoding header of a response.
+    zstd is used instead if both ends have it. The size of each upload,
+    before and after compression, is counted for each endpoint."""
+
+    def __init__(self):
+        self.accepted = {"gzip"}
+        self.stats: dict[str, list[int]] = {} # endpoint -> [requests, raw bytes, sent bytes]
+
+    @property
+    def encoding(self) -> str:
+        if zstd is not None and "zstd" in self.accepted:
+            return "zstd"
+        return "gzip"
+
+    def negotiate(self, resp: ClientResponse):
+        header = resp.headers.get("Accept-Encoding")
+        if header is not None: # older servers don't say, but still decode gzip
+            self.accepted = {x.partition(";")[0].strip().lower() for x in header.split(",")} | {"gzip"}
+
+    def compress(self, endpoint: str, body: bytes) -> tuple[bytes, str]:
+        encoding = self.encoding
+        if encoding == "zstd":
+            data = zstd.compress(body)
+        else:
+            data = gzip.compress(body, 6)
+        stats = self.stats.setdefault(endpoint, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += len(body)
+        stats[2] += len(data)
+        return data, encoding
+
+    @contextlib.asynccontextmanager
+    async def post(self, session: ClientSession, endpoint: str, body: bytes, content_type: str, params: dict):
+        """POST a compressed body to the server."""
+        data, encoding = self.compress(endpoint, body)
+        headers = {"Content-Type": content_type, "Content-Encoding": encoding}
+        async with session.post(endpoint, data=data, headers=headers, params=params) as resp:
+            self.negotiate(resp)
+            yield resp
+
+    def report(self) -> str:
+        lines = []
+        for endpoint, (count, raw, sent) in sorted(self.stats.items()):
+            lines.append(f"{endpoint}: {count} uploads, {raw/1000:.1f}kB -> {sent/1000:.1f}kB ({sent/max(raw, 1):.0%})")
+        return "\n".join(lines)
+
+uploads = Uploads()
+
+def form_body(fields: dict[str, str]) -> bytes:
+    """Return a form as an urlencoded body, to compress it."""
+    return urllib.parse.urlencode(fields).encode("ascii")
+
+class Syncer:
+    """Send everything which changed during a tick in a single request to /sync.
+
+    Against an older server, which doesn't have it, each section goes to
+    its own endpoint instead, one after the other."""
+
+    # section -> (method, endpoint, fields which go in the query string)
+    endpoints = {
+        "slice": ("POST", "/sync/slice", ()),
+        "playing": ("GET", "/playing", ()),
+        "save": ("POST", "/sync/save", ("has_run", "base")),
+        "save-2": ("POST", "/sync/save-2", ()),
+        "monster": ("POST", "/sync/monster", ()),
+        "monster-2": ("POST", "/sync/monster-2", ()),
+        "profile": ("POST", "/sync/profile", ()),
+    }
+
+    def __init__(self, session: ClientSession):
+        self.session = session
+        self.multiplexed = True # until the server says otherwise
+        self.hashes = FileHashes("last_hashes.json")
+        self.sections: dict[str, dict[str, str]] = {}
+        self.files: dict[str, dict[str, str | None]] = {}
+
+    def add(self, name: str, files: dict[str, str | None] | None = None, **data: str):
+        """Add a section to send. The file hashes are recorded once the server has it."""
+        self.sections[name] = data
+        self.files[name] = files or {}
+
+    def clear(self):
+        self.sections.clear()
+        self.files.clear()
+
+    async def send(self, start: float) -> dict[str, SyncResult]:
+        results = await self._send(start)
+        acked = {}
+        for name, result in results.items():
+            if result.ok:
+                acked.update(self.files[name])
+        if acked:
+            self.hashes.update(acked)
+        self.clear()
+        return results
+
+    async def _send(self, start: float) -> dict[str, SyncResult]:
+        sections = self.sections
+        if not sections:
+            return {}
+
+        if self.multiplexed:
+            envelope = {"sections": {name: {"hash": content_hash(data), "data": data} for name, data in sections.items()}}
+            body = json.dumps(envelope).encode("utf-8")
+            async with uploads.post(self.session, "/sync", body, "application/json", {"key": cfg.secret, "start": start}) as resp:
+                if resp.status != 404:
+                    resp.raise_for_status()
+                    results = (await resp.json())["sections"]
+                    return {name: SyncResult(**results.get(name, {"status": 500, "error": "No answer"})) for name in sections}
+            self.multiplexed = False
+
+        results = {}
+        for name, data in sections.items():
+            method, endpoint, query = self.endpoints[name]
+            params = {"key": cfg.secret, "start": start}
+            form = {}
+            for key, value in data.items():
+                if key in query:
+                    params[key] = value
+                else:
+                    form[key] = value
+            if form:
+                request = uploads.post(self.session, endpoint, form_body(form), "application/x-www-form-urlencoded", params)
+            else:
+                request = self.session.request(method, endpoint, params=params)
+            async with request as resp:
+                if resp.content_type == "application/json":
+                    result = await resp.json()
+                else:
+                    result = await resp.read()
+                results[name] = SyncResult(resp.status, result, resp.reason)
+        return results
+
+def runs_body(runs: list[tuple[pathlib.Path, str, str, str]]) -> bytes:
+    """Return the newline-delimited JSON body to upload many runs at once."""
+    lines = []
+    for path, file, profile, version in runs:
+        with (path / file).open() as f:
+            lines.append(json.dumps({"run": f.read(), "name": file, "profile": profile, "version": version}))
+    return "\n".join(lines).encode("utf-8")
+
+def touched(changed: set[pathlib.Path] | None, folder: pathlib.Path) -> bool:
+    """Return whether anything in this folder may have changed."""
+    return changed is None or any(x.is_relative_to(folder) for x in changed)
+
 async def main():
     print("Client running. Will periodically check for the savefile and send it over!\n")
     has_save = True # whether the server has a save file - we lie at first in case we just restarted and it has an old one
@@ -74,13 +385,14 @@ async def main():
     last_sd = 0
     last_mt = 0
     last_mt2 = 0
-    runs_last = {}
     use_sd = cfg.use_slice
     use_mt = cfg.use_mt
     last_exc = None
     s2_save = True
     last2 = 0
     cur2 = 0
+    save_base = None # the savefile as the server last acknowledged it
+    save_token = None # and the server's token for it
     try:
         with open("last_run") as f:
             last_run = f.read().strip()
@@ -92,7 +404,7 @@ async def main():
     timeout = 1
     if not cfg.server_url or not cfg.secret:
         print("Config is not complete. Please open 'client-config.yml' and edit it with your preferences.")
-        time.sleep(3)
+        await asyncio.sleep(3)
         return
 
     print(f"User profile folder: {cfg.user_profile}\nFetch Slice & Dice Data: {'YES' if use_sd else 'NO'}\nFetch Monster Train Data: {'YES' if use_mt else 'NO'}")
@@ -112,7 +424,26 @@ async def main():
     spire1_saves = cfg.spiredir / "saves"
     spire2_saves = cfg.user_profile / "AppData" / "Roaming" / "SlayTheSpire2" / "steam" / cfg.steam_id
 
+    if cfg.watch_files and Observer is not None:
+        watcher = EventWatcher(cfg.watch_debounce, cfg.rescan_interval)
+        print("\nWatching the game files for changes.")
+    else:
+        watcher = PollWatcher()
+    watcher.watch(spire1_saves)
+    watcher.watch(cfg.spiredir / "preferences")
+    watcher.watch(cfg.spiredir / "runs", recursive=True)
+    watcher.watch(spire2_saves, recursive=True)
+    if use_mt:
+        watcher.watch(mt_file.parent)
+        watcher.watch(mt2_file.parent)
+    if use_sd:
+        watcher.watch(sd_file.parent)
+    changed = None # everything needs to be checked at first
+    new_runs = True
+    bulk_runs = True # whether the server has /sync/runs
+
     async with ClientSession(cfg.server_url) as session:
+        syncer = Syncer(session)
         # Check if the app is registered, prompt it if not
         try:
             async with session.post("/twitch/check-token", params={"key": cfg.secret}) as resp:
@@ -138,10 +469,16 @@ async def main():
 
         while True:
             try:
-                time.sleep(timeout)
+                if changed is not None: # otherwise, the last check didn't finish
+                    changed = await watcher.wait(timeout)
                 start = time.time()
                 timeout = 1
-                if possible is None:
+                syncer.clear() # if the last pass failed halfway
+                if watcher.events and (possible is not None or poss_2 is not None):
+                    # nothing to poll for during a run; the watcher wakes us up
+                    timeout = cfg.rescan_interval
+                new_runs = new_runs or touched(changed, cfg.spiredir / "runs") or touched(changed, spire2_saves)
+                if possible is None and touched(changed, spire1_saves):
                     for file in (cfg.spiredir / "saves").iterdir():
                         if file.name.endswith(".autosave"):
                             if possible is None:
@@ -157,7 +494,7 @@ async def main():
                     except OSError:
                         possible = None
 
-                if poss_2 is None: # TODO: carry over profiles, more save stuff
+                if poss_2 is None and touched(changed, spire2_saves): # TODO: carry over profiles, more save stuff
                     potential: list[pathlib.Path] = []
                     for file in spire2_saves.iterdir():
                         if file.name.startswith("profile"):
@@ -182,22 +519,15 @@ async def main():
                         if cur_sd != last_sd:
                             with sd_file.open() as f:
                                 sd_data = f.read()
-                            sd_data = sd_data.encode("utf-8", "xmlcharrefreplace")
-                            async with session.post("/sync/slice", data={"data": sd_data}, params={"key": cfg.secret}) as resp:
-                                if resp.ok:
-                                    last_sd = cur_sd
-                                    curses = await resp.read()
-                                    if curses and cfg.slice_curses:
-                                        decoded: list[str] = pickle.loads(curses)
-                                        try:
-                                            with open(cfg.slice_curses, "w") as f:
-                                                f.write("\n".join(decoded))
-                                        except OSError:
-                                            pass
+                            if (digest := syncer.hashes.changed("slice", sd_data)) is not None:
+                                syncer.add("slice", {"slice": digest}, data=sd_data)
+                            else: # written again, but the same
+                                last_sd = cur_sd
 
                 to_send: list[tuple[pathlib.Path, list[str], str, str]] = []
                 files = []
-                if possible is None and poss_2 is None and cfg.sync_runs: # don't check run files during a run
+                if possible is None and poss_2 is None and cfg.sync_runs and new_runs: # don't check run files during a run
+                    new_runs = False
                     # Spire 1
                     for path, folders, _f in (cfg.spiredir / "runs").walk():
                         for folder in folders:
@@ -225,56 +555,54 @@ async def main():
 
                 try:
                     if possible is None and poss_2 is None:
-                        async with session.get("/playing", params={"key": cfg.secret}) as resp:
-                            if resp.ok:
-                                j = await resp.json()
-                                if j and j.get("item"):
-                                    track = j['item']['name']
-                                    artists = ", ".join(x['name'] for x in j['item']['artists'])
-                                    album = j['item']['album']['name']
-                                    text = f"{track}\n{artists}\n{album}"
-                                    if playing != text:
-                                        try:
-                                            with open(cfg.playing_file, "w") as f:
-                                                f.write(text)
-                                            playing = text
-                                        except OSError:
-                                            pass
-
-                                else:
-                                    playing = None
-                                    try:
-                                        with open(cfg.playing_file, "w") as f:
-                                            pass # make it an empty file
-                                    except OSError:
-                                        pass
+                        syncer.add("playing")
 
                     all_sent = True
-                    if to_send: # send runs first so savefile can seamlessly transfer its cache
+                    if to_send and bulk_runs: # send runs first so savefile can seamlessly transfer its cache
+                        # oldest first, so that we can pick up after the last one the server stored
+                        to_send.sort(key=lambda x: x[1])
+                        for i in range(0, len(to_send), cfg.run_batch_size):
+                            body = runs_body(to_send[i:i+cfg.run_batch_size])
+                            async with uploads.post(session, "/sync/runs", body, "application/x-ndjson", {"key": cfg.secret, "start": start}) as resp:
+                                if resp.status == 404: # older server; send them one by one
+                                    bulk_runs = False
+                                    break
+                                j = None
+                                if resp.content_type == "application/json":
+                                    j = await resp.json()
+                                if j and j["acked"] and j["acked"] > last_run:
+                                    last_run = j["acked"]
+                                    with open("last_run", "w") as f:
+                                        f.write(last_run)
+                                if not resp.ok:
+                                    print(f"Error: Runs were not all sent: {j['error'] if j else resp.reason}")
+                                    all_sent = False
+                                    new_runs = True # try again from there next time
+                                    break
+
+                    if to_send and not bulk_runs:
                         for path, file, profile, version in to_send:
                             if file:
                                 path /= file
                             with path.open() as f:
                                 content = f.read()
-                            content = content.encode("utf-8", "xmlcharrefreplace")
-                            async with session.post("/sync/run", data={"run": content, "name": file, "profile": profile, "version": version}, params={"key": cfg.secret, "start": start}) as resp:
+                            body = form_body({"run": content, "name": file, "profile": profile, "version": version})
+                            async with uploads.post(session, "/sync/run", body, "application/x-www-form-urlencoded", {"key": cfg.secret, "start": start}) as resp:
                                 if not resp.ok:
                                     all_sent = False
+                                    new_runs = True
                         if all_sent:
                             last_run = max(files)
                             with open("last_run", "w") as f:
                                 f.write(last_run)
 
-                    # XXX: consolidate into one endpoint
+                    # everything else goes in a single request, at the end
+                    save_sent = save2_sent = mt_sent = mt2_sent = None
                     if possible is None and has_save: # server has a save, but we don't (anymore)
-                        async with session.post("/sync/save", data={"savefile": b"", "character": b""}, params={"key": cfg.secret, "has_run": str(all_sent).lower(), "start": start}) as resp:
-                            if resp.ok:
-                                has_save = False
+                        syncer.add("save", {"save": None}, savefile="", character="", has_run=str(all_sent).lower())
 
                     if poss_2 is None and s2_save: # server has a save, but we don't (anymore)
-                        async with session.post("/sync/save-2", data={"savefile": b"", "character": b""}, params={"key": cfg.secret, "has_run": str(all_sent).lower(), "start": start}) as resp:
-                            if resp.ok:
-                                s2_save = False
+                        syncer.add("save-2", {"save-2": None}, savefile="")
 
                     if use_mt:
                         ## MT1
@@ -284,31 +612,14 @@ async def main():
                             traceback.print_exc()
                         else:
                             if cur_mt != last_mt:
+                                # the run history databases could exceed the data limit, so only send the save
                                 with open(mt_file, "rb") as f:
-                                    mt_data = f.read()
-                                mt_runs = {"save": mt_data}
-                                mt_runs_last = {}
-                                for file in os.listdir(os.path.join(mt_folder, "run-history")):
-                                    break # otherwise, it might exceed the data limit. let's not.
-                                    if not file.endswith(".db"):
-                                        continue
-                                    if file == "runHistory.db": # main one
-                                        key = "main"
-                                    elif file.startswith("runHistoryData"): # something like runHistoryData00.db
-                                        key = file[14:16]
-                                    else:
-                                        key = file # just in case
-                                    last = os.path.getmtime(os.path.join(mt_folder, "run-history", file))
-                                    if runs_last.get(key) != last:
-                                        with open(os.path.join(mt_folder, "run-history", file), "rb") as f:
-                                            mt_runs[key] = f.read()
-                                            mt_runs_last[key] = last
-                                async with session.post("/sync/monster", data=mt_runs, params={"key": cfg.secret}) as resp:
-                                    if resp.ok:
-                                        last_mt = cur_mt
-                                        runs_last.update(mt_runs_last)
-                                    else:
-                                        print(f"ERROR: Monster Train data not properly sent:\n{resp.reason}")
+                                    mt_data = f.read().decode("utf-8", "xmlcharrefreplace")
+                                if (digest := syncer.hashes.changed("monster", mt_data)) is not None:
+                                    syncer.add("monster", {"monster": digest}, save=mt_data)
+                                    mt_sent = cur_mt
+                                else:
+                                    last_mt = cur_mt
 
                         ## MT2
 
@@ -319,47 +630,27 @@ async def main():
                         else:
                             if cur_mt2 != last_mt2:
                                 with open(mt2_file, "rb") as f:
-                                    mt2_data = f.read()
-                                mt2_runs = {"save": mt2_data}
-                                mt2_runs_last = {}
-                                for file in os.listdir(os.path.join(mt2_folder, "run-history")):
-                                    break # otherwise, it might exceed the data limit. let's not.
-                                    if not file.endswith(".db"):
-                                        continue
-                                    if file == "runHistory.db": # main one
-                                        key = "main"
-                                    elif file.startswith("runHistoryData"): # something like runHistoryData00.db
-                                        key = file[14:16]
-                                    else:
-                                        key = file # just in case
-                                    last = os.path.getmtime(os.path.join(mt_folder, "run-history", file))
-                                    if runs_last.get(key) != last:
-                                        with open(os.path.join(mt_folder, "run-history", file), "rb") as f:
-                                            mt_runs[key] = f.read()
-                                            mt_runs_last[key] = last
-                                async with session.post("/sync/monster-2", data=mt2_runs, params={"key": cfg.secret}) as resp:
-                                    if resp.ok:
-                                        last_mt2 = cur_mt2
-                                        runs_last.update(mt2_runs_last)
-                                    else:
-                                        print(f"ERROR: Monster Train 2 data not properly sent:\n{resp.reason}")
+                                    mt_data = f.read().decode("utf-8", "xmlcharrefreplace")
+                                if (digest := syncer.hashes.changed("monster-2", mt_data)) is not None:
+                                    syncer.add("monster-2", {"monster-2": digest}, save=mt_data)
+                                    mt2_sent = cur_mt2
+                                else:
+                                    last_mt2 = cur_mt2
 
                     # update all profiles
-                    data = {
-                        "slots": b"",
-                        "0": b"",
-                        "1": b"",
-                        "2": b"",
-                        "11": b"",
-                        "12": b"",
-                        "13": b"",
-                    }
+                    profiles = {}
+                    profile_files = {}
+
+                    def add_profile(key: str, content: str):
+                        if (digest := syncer.hashes.changed(f"profile-{key}", content)) is not None:
+                            profiles[key] = content
+                            profile_files[f"profile-{key}"] = digest
 
                     # always send the save slots; it's possible it changed, even during a run (e.g. wall card)
                     cur_slots = (cfg.spiredir / "preferences" / "STSSaveSlots").stat().st_mtime
                     if cur_slots != last_slots:
                         with (cfg.spiredir / "preferences" / "STSSaveSlots").open() as f:
-                            data["slots"] = f.read().encode("utf-8", "xmlcharrefreplace")
+                            add_profile("slots", f.read())
                     tobe_lasp = [0, 0, 0]
                     for i in range(3):
                         name = "STSPlayer"
@@ -371,7 +662,7 @@ async def main():
                             if m == lasp[i]:
                                 continue # unchanged, don't bother
                             with fname.open() as f:
-                                data[str(i)] = f.read().encode("utf-8", "xmlcharrefreplace")
+                                add_profile(str(i), f.read())
                         except OSError:
                             continue
 
@@ -385,18 +676,16 @@ async def main():
                             if m == lasp2[i]:
                                 continue # unchanged
                             with fname.open() as f:
-                                data[str(i+10)] = f.read().encode("utf-8", "xmlcharrefreplace")
+                                add_profile(str(i+10), f.read())
                         except OSError:
                             continue
 
-                    if any(data.values()):
-                        async with session.post("/sync/profile", data=data, params={"key": cfg.secret, "start": start}) as resp:
-                            if resp.ok:
-                                lasp = tobe_lasp
-                                lasp2 = tobe_lasp2
-                                last_slots = cur_slots
-                            else:
-                                print("Warning: Profiles were not successfully updated. Desyncs may occur.")
+                    if profiles:
+                        syncer.add("profile", profile_files, **profiles)
+                    else: # nothing changed, even if some files were written again
+                        lasp = tobe_lasp
+                        lasp2 = tobe_lasp2
+                        last_slots = cur_slots
 
                     if possible is not None and cur != last:
                         content = ""
@@ -406,12 +695,23 @@ async def main():
                         except OSError:
                             possible = None
                         else:
-                            content = content.encode("utf-8", "xmlcharrefreplace")
-                            char = possible.name[:-9].encode("utf-8", "xmlcharrefreplace")
-                            async with session.post("/sync/save", data={"savefile": content, "character": char}, params={"key": cfg.secret, "has_run": "false", "start": start}) as resp:
-                                if resp.ok:
-                                    last = cur
-                                    has_save = True
+                            if (digest := syncer.hashes.changed("save", content)) is None: # written again, but the same
+                                last = cur
+                            else:
+                                char = possible.name[:-9]
+                                decoded = None
+                                if cfg.delta_sync:
+                                    try:
+                                        decoded = decode_save(content)
+                                    except ValueError: # the game was probably still writing it
+                                        pass
+
+                                if decoded is not None and save_token is not None:
+                                    # only send what changed since the last savefile the server acknowledged
+                                    syncer.add("save", {"save": digest}, delta=json.dumps(save_delta(save_base, decoded)), character=char, has_run="false", base=save_token)
+                                else:
+                                    syncer.add("save", {"save": digest}, savefile=content, character=char, has_run="false")
+                                save_sent = (cur, decoded)
 
                     if poss_2 is not None and cur2 != last2:
                         content = ""
@@ -421,17 +721,101 @@ async def main():
                         except OSError:
                             poss_2 = None
                         else:
-                            content = content.encode("utf-8", "xmlcharrefreplace")
-                            async with session.post("/sync/save-2", data={"savefile": content}, params={"key": cfg.secret, "start": start}) as resp:
-                                if resp.ok:
-                                    last2 = cur2
-                                    s2_save = True
+                            if (digest := syncer.hashes.changed("save-2", content)) is None:
+                                last2 = cur2
+                            else:
+                                syncer.add("save-2", {"save-2": digest}, savefile=content)
+                                save2_sent = cur2
+
+                    results = await syncer.send(start)
+
+                    if (r := results.get("slice")) and r.ok:
+                        last_sd = cur_sd
+                        curses = r.result
+                        if isinstance(curses, bytes): # from /sync/slice
+                            curses = pickle.loads(curses) if curses else None
+                        if curses and cfg.slice_curses:
+                            try:
+                                with open(cfg.slice_curses, "w") as f:
+                                    f.write("\n".join(curses))
+                            except OSError:
+                                pass
+
+                    if (r := results.get("playing")) and r.ok:
+                        j = r.result
+                        if j and j.get("item"):
+                            track = j['item']['name']
+                            artists = ", ".join(x['name'] for x in j['item']['artists'])
+                            album = j['item']['album']['name']
+                            text = f"{track}\n{artists}\n{album}"
+                            if playing != text:
+                                try:
+                                    with open(cfg.playing_file, "w") as f:
+                                        f.write(text)
+                                    playing = text
+                                except OSError:
+                                    pass
+
+                        else:
+                            playing = None
+                            try:
+                                with open(cfg.playing_file, "w") as f:
+                                    pass # make it an empty file
+                            except OSError:
+                                pass
+
+                    if (r := results.get("monster")):
+                        if r.ok:
+                            last_mt = mt_sent
+                        else:
+                            print(f"ERROR: Monster Train data not properly sent:\n{r.error}")
+
+                    if (r := results.get("monster-2")):
+                        if r.ok:
+                            last_mt2 = mt2_sent
+                        else:
+                            print(f"ERROR: Monster Train 2 data not properly sent:\n{r.error}")
+
+                    if (r := results.get("profile")):
+                        if r.ok:
+                            lasp = tobe_lasp
+                            lasp2 = tobe_lasp2
+                            last_slots = cur_slots
+                        else:
+                            print("Warning: Profiles were not successfully updated. Desyncs may occur.")
+
+                    if (r := results.get("save")):
+                        if save_sent is None: # the server's copy is cleared
+                            if r.ok:
+                                has_save = False
+                                save_base = save_token = None
+                        elif r.ok:
+                            last, save_base = save_sent
+                            has_save = True
+                            save_token = None
+                            if save_base is not None and isinstance(r.result, dict): # older servers don't send it
+                                save_token = r.result["revision"]
+                        elif save_token is not None: # out of sync (e.g. the server restarted); send it all right away
+                            save_token = None
+                            timeout = 0
+
+                    if (r := results.get("save-2")) and r.ok:
+                        s2_save = save2_sent is not None
+                        if save2_sent is not None:
+                            last2 = save2_sent
 
                 except (ClientError, ServerDisconnectedError):
                     timeout = 10 # give it a bit of time
                     print("Error: Server is offline! Retrying in 10s")
+                    await asyncio.sleep(timeout)
+                    changed = None
+                    new_runs = True
                     continue
+                changed = set()
             except Exception as e:
+                changed = None
+                new_runs = True
+                await asyncio.sleep(timeout)
                 # since the loop is every second, don't spam the report feature
                 if type(e) is type(last_exc) and e.args == last_exc.args: # exceptions are never equal, so check args
                     continue
@@ -453,4 +837,8 @@ if __name__ == "__main__":
         cfg = Config()
         with open("client-config.yml", "w") as f:
             yaml.safe_dump(cfg.export(), f)
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    finally:
+        if uploads.stats:
+            print(f"\nUploaded this session:\n{uploads.report()}")
@@ -18,7 +18,8 @@ from src.webpage import webpage
 from src.logger import logger
 from src.config import config, __version__
 
-from src import server, events
+from src import server, events, persist
+from src.cache import run_summary
 
 if config.server.debug:
     logging.basicConfig(
@@ -105,6 +106,9 @@ async def main():
     except (web.GracefulExit, KeyboardInterrupt, asyncio.exceptions.CancelledError):
         print("Shutting down. Please stand by . . .")
     finally:
+        print("Writing data files . . .")
+        await persist.flush_all()
+        run_summary.close_store()
         print("Closing sockets . . .")
         if config.twitch.enabled:
             await server.Twitch_cleanup()
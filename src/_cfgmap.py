@@ -266,7 +266,7 @@ class Bot(_ConfigMapping):
         self.spire_mods = spire_mods
 
 class Server(_ConfigMapping):
-    def __init__(self, debug: bool, secret: str, url: str, host: str, port: int, json_indent: int, business_email: str, websocket_client: dict, webhook: dict, steam_id: str):
+    def __init__(self, debug: bool, secret: str, url: str, host: str, port: int, json_indent: int, business_email: str, websocket_client: dict, webhook: dict, steam_id: str, ingest_workers: int, graph_workers: int, prerender_graphs: list, persist_interval: float, cache: dict):
         """Hold server-related configuration.
 
         :param debug: Whether we are in debug mode.
@@ -289,6 +289,16 @@ class Server(_ConfigMapping):
         :type webhook: dict
         :param steam_id: The Steam ID of the streamer.
         :type steam_id: str
+        :param ingest_workers: How many processes parse run files in bulk. 0 means one per core.
+        :type ingest_workers: int
+        :param graph_workers: How many processes render graphs. 0 means a thread in the server process.
+        :type graph_workers: int
+        :param prerender_graphs: The graph views to render as soon as a run ends.
+        :type prerender_graphs: list
+        :param persist_interval: How long to wait for more changes before writing the data files, in seconds.
+        :type persist_interval: float
+        :param cache: The in-memory cache limits.
+        :type cache: dict
         """
 
         self.debug = debug
@@ -303,9 +313,14 @@ class Server(_ConfigMapping):
         self.json_indent = json_indent
         self.business_email = business_email
         self.steam_id = steam_id
+        self.ingest_workers = ingest_workers
+        self.graph_workers = graph_workers
+        self.prerender_graphs = prerender_graphs
+        self.persist_interval = persist_interval
 
         self.websocket_client = _WebsocketClient(**websocket_client)
         self.webhook = _Webhook(**webhook)
+        self.cache = _Cache(**cache)
 
 class _WebsocketClient(_ConfigMapping):
     def __init__(self, id: str, secret: str):
@@ -330,6 +345,28 @@ class _Webhook(_ConfigMapping):
 
         self.secret = secret
 
+class _Cache(_ConfigMapping):
+    def __init__(self, loaded_runs: int, loaded_megabytes: int, graph_megabytes: int, graph_disk_megabytes: int, page_megabytes: int):
+        """Hold the in-memory cache limits.
+
+        :param loaded_runs: How many runs keep their full data in memory. 0 means no limit.
+        :type loaded_runs: int
+        :param loaded_megabytes: Total size of the run files kept in memory, in megabytes. 0 means no limit.
+        :type loaded_megabytes: int
+        :param graph_megabytes: Total size of the rendered graphs kept in memory, in megabytes. 0 means no limit.
+        :type graph_megabytes: int
+        :param graph_disk_megabytes: Total size of the graphs of finished runs kept on disk, in megabytes. 0 means no limit.
+        :type graph_disk_megabytes: int
+        :param page_megabytes: Total size of the rendered run pages kept in memory, in megabytes. 0 means no limit.
+        :type page_megabytes: int
+        """
+
+        self.loaded_runs = loaded_runs
+        self.loaded_megabytes = loaded_megabytes
+        self.graph_megabytes = graph_megabytes
+        self.graph_disk_megabytes = graph_disk_megabytes
+        self.page_megabytes = page_megabytes
+
 class Spotify(_ConfigMapping):
     def __init__(self, enabled: bool, id: str, secret: str, code: str):
         """Hold information for the Spotify "Now Playing" feature.
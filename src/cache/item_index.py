@@ -0,0 +1,126 @@
+"""Inverted index from cards and relics to the runs which ended with them.
+
+Every card and relic held at the end of a run gets a postings list: the
+sorted epochs of those runs, stored as a compact integer array, along with
+how many of them were won. There is one index per game and profile, filled
+from the run summaries of the runs added to the cache (in bulk, the next
+time it is used), so no run file needs to be read. Counts and win rates are
+constant time, and the runs themselves are found back through the matching
+:class:`ProfileIndex`.
+
+"""
+
+from __future__ import annotations
+
+from array import array
+from typing import TYPE_CHECKING
+
+import bisect
+
+from src.cache.run_index import get_index
+
+if TYPE_CHECKING:
+    from src.runs import RunParser, Run2Parser
+
+__all__ = ["Postings", "ItemIndex", "get_item_index"]
+
+class Postings:
+    """Hold the sorted epochs of the runs which ended with one item."""
+
+    def __init__(self):
+        self.epochs = array("q")
+        self.wins = 0
+
+    def __len__(self) -> int:
+        return len(self.epochs)
+
+    def add(self, epoch: int, won: bool):
+        epochs = self.epochs
+        if not epochs or epoch > epochs[-1]: # the common case, runs arrive in order
+            epochs.append(epoch)
+        else:
+            i = bisect.bisect_left(epochs, epoch)
+            if i < len(epochs) and epochs[i] == epoch:
+                return # already in there
+            epochs.insert(i, epoch)
+        self.wins += won
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / len(self.epochs) if self.epochs else 0.0
+
+class ItemIndex:
+    """Map the cards and relics of one profile to the runs which ended with them."""
+
+    def __init__(self, game: int, profile: int):
+        self.game = game
+        self.profile = profile
+        self.cards: dict[str, Postings] = {}
+        self.relics: dict[str, Postings] = {}
+        self._pending: list[RunParser | Run2Parser] = []
+
+    def add(self, run: RunParser | Run2Parser):
+        """Queue a run to have its final cards and relics added."""
+        self._pending.append(run)
+
+    def flush(self):
+        """Add all the queued runs."""
+        if not self._pending:
+            return
+        # oldest first, so that the postings are (almost always) appended to
+        pending = sorted(self._pending, key=lambda x: x.epoch)
+        self._pending = []
+        for run in pending:
+            summary = run.summary
+            for items, names in ((self.cards, {x.partition("+")[0] for x in summary.master_deck}), (self.relics, set(summary.relics))):
+                for name in names:
+                    if name not in items:
+                        items[name] = Postings()
+                    items[name].add(summary.epoch, summary.won)
+
+    def get(self, item: str) -> Postings | None:
+        """Return the postings for a card or relic, by internal ID."""
+        self.flush()
+        return self.cards.get(item) or self.relics.get(item)
+
+    def runs_with(self, item: str, start: int | float = 0, end: int | float | None = None) -> list[RunParser | Run2Parser]:
+        """Return the runs which ended with this card or relic, oldest first.
+
+        :param item: The internal ID of the card or relic.
+        :type item: str
+        :param start: The earliest run end time, in seconds since the epoch.
+        :type start: int | float
+        :param end: The latest run end time, in seconds since the epoch, if any.
+        :type end: int | float | None
+        :return: The matching runs.
+        :rtype: list[RunParser | Run2Parser]
+        """
+        postings = self.get(item)
+        if postings is None:
+            return []
+        epochs = postings.epochs
+        lo = bisect.bisect_left(epochs, start)
+        hi = len(epochs) if end is None else bisect.bisect_right(epochs, end)
+        index = get_index(self.game, self.profile)
+        return [run for x in epochs[lo:hi] if (run := index.at(x)) is not None]
+
+    def last_with(self, item: str) -> RunParser | Run2Parser | None:
+        """Return the newest run which ended with this card or relic, if any."""
+        postings = self.get(item)
+        if not postings:
+            return None
+        index = get_index(self.game, self.profile)
+        # the newest one may not be linked (anymore), so go back until one is
+        for epoch in reversed(postings.epochs):
+            if (run := index.at(epoch)) is not None:
+                return run
+        return None
+
+_indexes: dict[tuple[int, int], ItemIndex] = {}
+
+def get_item_index(game: int, profile: int) -> ItemIndex:
+    """Return the item index for a given game and profile, creating it if needed."""
+    key = (game, profile)
+    if key not in _indexes:
+        _indexes[key] = ItemIndex(game, profile)
+    return _indexes[key]
@@ -0,0 +1,72 @@
+"""Keep the full data of recently-used runs in memory, and unload the rest.
+
+Run parsers always keep their summary, but the full run data (and everything
+built from it, such as the path and the graphs) is only kept for the most
+recently used runs. The budget is set in the ``server.cache`` config section,
+both as a number of runs and as the total size of their files on disk.
+
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from src.config import config
+
+if TYPE_CHECKING:
+    from src.runs import RunParser, Run2Parser
+
+__all__ = ["LoadedRuns", "get_loaded_runs"]
+
+class LoadedRuns:
+    """Track which runs have their data loaded, in least-recently used order."""
+
+    def __init__(self):
+        self._runs: OrderedDict[RunParser | Run2Parser, int] = OrderedDict()
+        self.size = 0 #: Total file size of the loaded runs, in bytes.
+        self.hits = 0 #: How many times a run's data was already loaded.
+        self.misses = 0 #: How many times a run's data had to be read from disk.
+        self.evictions = 0 #: How many runs were unloaded to stay within budget.
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def __str__(self) -> str:
+        return f"{len(self)} runs ({self.size} bytes) loaded, {self.hits} hits, {self.misses} misses, {self.evictions} evictions"
+
+    def hit(self, run: RunParser | Run2Parser):
+        """Mark a loaded run as the most recently used.
+
+        Runs which aren't tracked, such as those built from data which isn't on
+        disk, can't be read back, so they are never unloaded."""
+        self.hits += 1
+        if run in self._runs:
+            self._runs.move_to_end(run)
+
+    def add(self, run: RunParser | Run2Parser, size: int):
+        """Add a newly loaded run, unloading the coldest ones if over budget."""
+        self.discard(run)
+        self._runs[run] = size
+        self.size += size
+
+        max_runs = config.server.cache.loaded_runs
+        max_size = config.server.cache.loaded_megabytes * 1_000_000
+        # the run we just loaded always stays, no matter its size
+        while len(self._runs) > 1 and ((max_runs and len(self._runs) > max_runs) or (max_size and self.size > max_size)):
+            cold, size = self._runs.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            cold.unload()
+
+    def discard(self, run: RunParser | Run2Parser):
+        """Stop tracking a run, if it was loaded."""
+        size = self._runs.pop(run, None)
+        if size is not None:
+            self.size -= size
+
+_loaded = LoadedRuns()
+
+def get_loaded_runs() -> LoadedRuns:
+    """Return the tracker for loaded runs."""
+    return _loaded
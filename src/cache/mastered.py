@@ -9,26 +9,31 @@ from src.nameinternal import get
 from src.sts_profile import get_profile
 
 if TYPE_CHECKING:
-    from src.runs import RunParser
+    from src.runs import RunParser, Run2Parser
     from src.save import Savefile
 
 _mastery_stats = MasteryStats()
 
 __all__ = ["update_mastery_stats", "get_mastered", "get_current_masteries"]
 
-def update_mastery_stats():
+def update_mastery_stats(new: list[RunParser | Run2Parser] | None = None):
+    """Add the runs linked since the last update, oldest first, to the masteries.
+
+    If they aren't given, only the newest run is looked at."""
     profile = get_profile(0, 1)
     if profile is None:
-        runs = []
-    else:
-        runs = list(profile.runs)
+        return
+    runs = profile.run_index.runs # oldest first
 
     if _mastery_stats.last_run_timestamp is None:
-        for run in runs:
+        for run in reversed(runs):
             _update_mastery_stats_from_run(run)
-    else:
-        if runs and _mastery_stats.last_run_timestamp != runs[0].timestamp:
-            _update_mastery_stats_from_run(runs[0])
+    elif new is not None:
+        for run in new:
+            if profile.run_index.has(run):
+                _update_mastery_stats_from_run(run)
+    elif runs and _mastery_stats.last_run_timestamp != runs[-1].timestamp:
+        _update_mastery_stats_from_run(runs[-1])
 
 def _update_mastery_stats_from_run(run: RunParser):
     if run.timestamp.year < 2023:
@@ -39,7 +44,7 @@ def _update_mastery_stats_from_run(run: RunParser):
         return
 
     _mastery_stats.last_run_timestamp = run.timestamp
-    for relic in run.relics:
+    for relic in run.relics_bare:
         if relic.name not in _mastery_stats.mastered_relics:
             _mastery_stats.mastered_relics[relic.name] = run
 
@@ -0,0 +1,195 @@
+"""Keep the rendered HTML of pages which (almost) never change.
+
+Finished runs don't change, but rendering their page goes through the whole
+deck, every node description and every relic each time. The page is instead
+rendered once, compressed ahead of time with gzip (and brotli, if it is
+installed), and served from memory with a strong ETag, so that browsers
+which already have it get a 304.
+
+Each page is stored along with a state, which holds whatever can still
+change on it (such as the VOD link, or the links to the next run); a page
+whose state differs is rendered again. Pages rendered by a different
+version of the bot or of the templates never match, as both are part of
+the ETag.
+
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+import hashlib
+import asyncio
+import gzip
+import os
+
+from aiohttp.web import Request, Response
+
+try:
+    import brotli
+except ModuleNotFoundError:
+    brotli = None
+
+from src.config import config, __version__
+
+__all__ = ["CachedPage", "PageCache", "get_page_cache"]
+
+class CachedPage:
+    """One rendered page, in all of its encodings."""
+
+    def __init__(self, state: Hashable, etag: str, bodies: dict[str, bytes]):
+        self.state = state
+        self.etag = etag #: The ETag of the uncompressed page, without the quotes.
+        self.bodies = bodies #: Content-Encoding -> body. The uncompressed page is under 'identity'.
+        self.size = sum(len(x) for x in bodies.values())
+
+    def etag_for(self, encoding: str) -> str:
+        # strong ETags must differ between encodings
+        if encoding == "identity":
+            return f'"{self.etag}"'
+        return f'"{self.etag}-{encoding}"'
+
+def _compress(body: bytes) -> dict[str, bytes]:
+    bodies = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(body, mode=brotli.MODE_TEXT)
+    return bodies
+
+def _accepted(req: Request) -> list[str]:
+    """Return the encodings the client accepts, in the order we prefer them."""
+    accepted = set()
+    for value in req.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = value.partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return [x for x in ("br", "gzip") if x in accepted] + ["identity"]
+
+def _matches(req: Request, etag: str) -> bool:
+    value = req.headers.get("If-None-Match")
+    if value is None:
+        return False
+    tags = [x.strip() for x in value.split(",")]
+    # the comparison for If-None-Match is weak, so W/"x" matches "x"
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+class PageCache:
+    """Hold rendered pages, in least-recently used order, up to a total size."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size #: Total size of the pages to keep (in all encodings), in bytes. 0 means no limit.
+        self.size = 0
+        self.hits = 0 #: How many requests were served a page which was already rendered.
+        self.not_modified = 0 #: How many of the hits were answered with a 304.
+        self.renders = 0
+        self._pages: OrderedDict[Hashable, CachedPage] = OrderedDict()
+        self._pending: dict[Hashable, tuple[Hashable, asyncio.Future]] = {}
+        self._version: str | None = None
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def __str__(self) -> str:
+        return f"{len(self)} pages ({self.size} bytes) cached, {self.hits} hits ({self.not_modified} not modified), {self.renders} renders"
+
+    @property
+    def version(self) -> str:
+        """A hash of the bot version and of all of the templates."""
+        if self._version is None:
+            h = hashlib.blake2b(__version__.encode("utf-8"), digest_size=8)
+            for root, dirs, files in os.walk("templates"):
+                dirs.sort()
+                for file in sorted(files):
+                    h.update(file.encode("utf-8"))
+                    with open(os.path.join(root, file), "rb") as f:
+                        h.update(f.read())
+            self._version = h.hexdigest()
+        return self._version
+
+    def discard(self, key: Hashable):
+        if (page := self._pages.pop(key, None)) is not None:
+            self.size -= page.size
+
+    def clear(self):
+        self._pages.clear()
+        self.size = 0
+        self._version = None
+
+    def _put(self, key: Hashable, page: CachedPage):
+        self.discard(key)
+        self._pages[key] = page
+        self.size += page.size
+        while self.max_size and self.size > self.max_size and len(self._pages) > 1:
+            _, old = self._pages.popitem(last=False)
+            self.size -= old.size
+
+    async def _get(self, key: Hashable, state: Hashable, render: Callable[[], str]) -> CachedPage:
+        page = self._pages.get(key)
+        if page is not None and page.state == state:
+            self.hits += 1
+            self._pages.move_to_end(key)
+            return page
+        if (pending := self._pending.get(key)) is not None and pending[0] == state:
+            self.hits += 1
+            return await asyncio.shield(pending[1])
+
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[key] = (state, fut)
+        try:
+            self.renders += 1
+            body = render().encode("utf-8")
+            etag = f"{self.version}-{hashlib.blake2b(body, digest_size=12).hexdigest()}"
+            # compressing can take a while, especially with brotli
+            page = CachedPage(state, etag, await asyncio.to_thread(_compress, body))
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception() # the waiters (if any) get it; don't warn if there are none
+            raise
+        else:
+            self._put(key, page)
+            fut.set_result(page)
+            return page
+        finally:
+            if self._pending.get(key, (None, None))[1] is fut:
+                del self._pending[key]
+
+    async def respond(self, req: Request, key: Hashable, state: Hashable, render: Callable[[], str]) -> Response:
+        """Return the page for this request, rendering it if needed.
+
+        :param req: The request to answer.
+        :type req: aiohttp.web.Request
+        :param key: What identifies the page, e.g. the run name.
+        :type key: Hashable
+        :param state: Whatever can still change on the page. It's rendered again if this doesn't match.
+        :type state: Hashable
+        :param render: A function which returns the page's HTML.
+        :type render: Callable[[], str]
+        :return: The response, which may be a 304.
+        :rtype: aiohttp.web.Response
+        """
+
+        page = await self._get(key, state, render)
+        encoding = next(x for x in _accepted(req) if x in page.bodies)
+        etag = page.etag_for(encoding)
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+            # the page can still change (e.g. a VOD link is added), so check every time
+            "Cache-Control": "no-cache",
+        }
+        if _matches(req, etag):
+            self.not_modified += 1
+            return Response(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(body=page.bodies[encoding], content_type="text/html", charset="utf-8", headers=headers)
+
+_cache: PageCache | None = None
+
+def get_page_cache() -> PageCache:
+    """Return the shared page cache."""
+    global _cache
+    if _cache is None:
+        _cache = PageCache(config.server.cache.page_megabytes * 1_000_000)
+    return _cache
@@ -0,0 +1,404 @@
+"""Running aggregates of card and relic choices over the whole run history.
+
+For every profile, and for each character in it, this keeps how often each
+card was offered and picked, how many runs ended with each card or relic
+(and how many of those were won), which floors they were obtained on, and
+what the runs were killed by.
+
+Runs are queued as they are added to the cache, and counted the next time
+the aggregates are used, or in a worker thread before they are saved.
+Counting a run reads its file once; the aggregates are saved to disk along
+with the list of runs they include, so only new runs are ever read again.
+When there is no saved copy, every run has to be counted, which is done in
+a worker thread at startup.
+
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from typing import Any, TYPE_CHECKING
+
+import asyncio
+import json
+import os
+
+from src.persist import persister
+from src.logger import logger
+from src.config import config
+
+if TYPE_CHECKING:
+    from src.runs import RunParser, Run2Parser
+
+__all__ = ["ItemStats", "CharacterStats", "RunAnalytics", "get_analytics", "save_analytics", "count_analytics"]
+
+_VERSION = 1
+_PATH = os.path.join("data", "run-analytics.json")
+
+# floor of the boss chest after each act; these aren't in relics_obtained
+_BOSS_CHEST_FLOORS = (17, 34)
+
+class ItemStats:
+    """Aggregate stats for one card or relic."""
+
+    def __init__(self):
+        self.offered = 0 #: How many times it was offered as a card reward.
+        self.picked = 0 #: How many times it was picked from a card reward.
+        self.runs = 0 #: How many runs ended with it in the deck or relics.
+        self.wins = 0 #: How many of those runs were won.
+        self.floors: Counter[int] = Counter() #: How many times it was obtained on each floor.
+
+    def __iadd__(self, other: ItemStats) -> ItemStats:
+        self.offered += other.offered
+        self.picked += other.picked
+        self.runs += other.runs
+        self.wins += other.wins
+        self.floors += other.floors
+        return self
+
+    @property
+    def pick_rate(self) -> float:
+        return self.picked / self.offered if self.offered else 0.0
+
+    @property
+    def win_rate(self) -> float:
+        """Win rate of the runs which ended with this item."""
+        return self.wins / self.runs if self.runs else 0.0
+
+    @property
+    def common_floor(self) -> int | None:
+        """The floor this item was most often obtained on, if known."""
+        if not self.floors:
+            return None
+        return self.floors.most_common(1)[0][0]
+
+    def as_dict(self, total_wins: int) -> dict[str, Any]:
+        """Return the stats as a dict, for the JSON endpoints."""
+        return {
+            "offered": self.offered,
+            "picked": self.picked,
+            "pick_rate": self.pick_rate,
+            "runs": self.runs,
+            "wins": self.wins,
+            "win_rate": self.win_rate,
+            # how many of the winning decks had it
+            "win_presence": self.wins / total_wins if total_wins else 0.0,
+            "floors": dict(sorted(self.floors.items())),
+        }
+
+    def to_json(self) -> list:
+        return [self.offered, self.picked, self.runs, self.wins, self.floors]
+
+    @classmethod
+    def from_json(cls, value: list) -> ItemStats:
+        self = cls()
+        self.offered, self.picked, self.runs, self.wins, floors = value
+        self.floors = Counter({int(k): v for k, v in floors.items()})
+        return self
+
+class CharacterStats:
+    """Aggregate stats for all the runs of one character (or of all of them)."""
+
+    def __init__(self):
+        self.runs = 0
+        self.wins = 0
+        self.killed_by: Counter[str] = Counter()
+        self.cards: dict[str, ItemStats] = {}
+        self.relics: dict[str, ItemStats] = {}
+
+    def __iadd__(self, other: CharacterStats) -> CharacterStats:
+        self.runs += other.runs
+        self.wins += other.wins
+        self.killed_by += other.killed_by
+        for mine, theirs in ((self.cards, other.cards), (self.relics, other.relics)):
+            for item, stats in theirs.items():
+                mine.setdefault(item, ItemStats())
+                mine[item] += stats
+        return self
+
+    def card(self, card: str) -> ItemStats:
+        """Return the stats for a card, by internal ID."""
+        return self.cards.get(card) or ItemStats()
+
+    def relic(self, relic: str) -> ItemStats:
+        """Return the stats for a relic, by internal ID."""
+        return self.relics.get(relic) or ItemStats()
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "wins": self.wins,
+            "killed_by": self.killed_by,
+            "cards": {k: v.to_json() for k, v in self.cards.items()},
+            "relics": {k: v.to_json() for k, v in self.relics.items()},
+        }
+
+    @classmethod
+    def from_json(cls, value: dict[str, Any]) -> CharacterStats:
+        self = cls()
+        self.runs = value["runs"]
+        self.wins = value["wins"]
+        self.killed_by = Counter(value["killed_by"])
+        self.cards = {k: ItemStats.from_json(v) for k, v in value["cards"].items()}
+        self.relics = {k: ItemStats.from_json(v) for k, v in value["relics"].items()}
+        return self
+
+def _item(items: dict[str, ItemStats], name: str) -> ItemStats:
+    if name not in items:
+        items[name] = ItemStats()
+    return items[name]
+
+def _acquired_1(data: dict[str, Any]) -> tuple[list[tuple[int, str, bool]], list[tuple[int, str]], list[tuple[int, str]]]:
+    """Return (card choices, card floors, relic floors) for a Spire 1 run."""
+    choices = []
+    cards = []
+    relics = []
+    for d in data["card_choices"]:
+        floor = int(d["floor"])
+        if (c := d["picked"]) not in ("SKIP", "Singing Bowl"):
+            c = c.partition("+")[0]
+            choices.append((floor, c, True))
+            cards.append((floor, c))
+        for c in d["not_picked"]:
+            choices.append((floor, c.partition("+")[0], False))
+
+    for d in data["relics_obtained"]:
+        relics.append((int(d["floor"]), d["key"]))
+    for floor, d in zip(_BOSS_CHEST_FLOORS, data.get("boss_relics", ())):
+        if "picked" in d:
+            relics.append((floor, d["picked"]))
+    for d in data.get("event_choices", ()):
+        floor = int(d["floor"])
+        relics.extend((floor, x) for x in d.get("relics_obtained", ()))
+        cards.extend((floor, x.partition("+")[0]) for x in d.get("cards_obtained", ()))
+
+    # the shop doesn't say what kind of item was bought; this misses cards which were removed later
+    owned = set(data["relics"])
+    deck = {x.partition("+")[0] for x in data["master_deck"]}
+    for key, floor in zip(data.get("items_purchased", ()), data.get("item_purchase_floors", ())):
+        if key in owned:
+            relics.append((int(floor), key))
+        elif (key := key.partition("+")[0]) in deck:
+            cards.append((int(floor), key))
+
+    return choices, cards, relics
+
+def _acquired_2(data: dict[str, Any]) -> tuple[list[tuple[int, str, bool]], list[tuple[int, str]], list[tuple[int, str]]]:
+    """Return (card choices, card floors, relic floors) for a Spire 2 run.
+
+    Card rewards aren't parsed for Spire 2 yet, so there are no choices."""
+    # same as Run2Parser.get_main_player(), without going through the parser
+    players = data["players"]
+    player = players[0]
+    if len(players) > 1 and config.server.steam_id:
+        for x in players:
+            if x.get("id", x.get("net_id")) == int(config.server.steam_id):
+                player = x
+                break
+    cards = []
+    relics = []
+    for lst, items in ((cards, player["deck"]), (relics, player["relics"])):
+        for d in items:
+            if (floor := d.get("floor_added_to_deck")) is not None:
+                lst.append((int(floor), d["id"].partition(".")[2]))
+    return [], cards, relics
+
+def _count(game: int, characters: dict[str, CharacterStats], run: RunParser | Run2Parser, data: dict[str, Any]):
+    summary = run.summary
+    if game == 1:
+        choices, card_floors, relic_floors = _acquired_1(data)
+    else:
+        choices, card_floors, relic_floors = _acquired_2(data)
+
+    # everything is computed first, so a broken file doesn't count halfway
+    stats = characters.setdefault(summary.character, CharacterStats())
+    stats.runs += 1
+    stats.wins += summary.won
+    if not summary.won and summary.killed_by:
+        stats.killed_by[summary.killed_by] += 1
+
+    for floor, card, picked in choices:
+        item = _item(stats.cards, card)
+        item.offered += 1
+        item.picked += picked
+    for floor, card in card_floors:
+        _item(stats.cards, card).floors[floor] += 1
+    for floor, relic in relic_floors:
+        _item(stats.relics, relic).floors[floor] += 1
+
+    for items, owned in ((stats.cards, summary.master_deck), (stats.relics, summary.relics)):
+        for name in {x.partition("+")[0] for x in owned}:
+            item = _item(items, name)
+            item.runs += 1
+            item.wins += summary.won
+
+def _count_runs(game: int, runs: list[RunParser | Run2Parser]) -> tuple[dict[str, CharacterStats], set[str]]:
+    """Count runs into new aggregates, and return them with the files counted.
+
+    This doesn't touch any shared state, so it can run in a worker thread."""
+    characters: dict[str, CharacterStats] = {}
+    files: set[str] = set()
+    for run in runs:
+        if run.filename in files:
+            continue
+        try:
+            _count(game, characters, run, run.read_data())
+        except (KeyError, TypeError, ValueError, OSError):
+            logger.exception(f"Could not add run {run.filename} to the analytics")
+        files.add(run.filename)
+    return characters, files
+
+class RunAnalytics:
+    """Hold the aggregate stats of one profile, per character."""
+
+    def __init__(self, game: int, profile: int):
+        self.game = game
+        self.profile = profile
+        self.characters: dict[str, CharacterStats] = {}
+        self.dirty = False
+        self._all: CharacterStats | None = None
+        self._files: set[str] = set()
+        self._pending: list[RunParser | Run2Parser] = []
+        self._counting: list[RunParser | Run2Parser] = [] # being counted in a worker thread
+        self._lock: asyncio.Lock | None = None
+
+    def __len__(self) -> int:
+        self.flush()
+        return len(self._files)
+
+    def add(self, run: RunParser | Run2Parser):
+        """Queue a run to be counted."""
+        if run.filename not in self._files:
+            self._pending.append(run)
+
+    def _take_pending(self) -> list[RunParser | Run2Parser]:
+        pending, self._pending = self._pending, []
+        return [x for x in pending if x.filename not in self._files]
+
+    def _merge(self, characters: dict[str, CharacterStats], files: set[str]):
+        for character, stats in characters.items():
+            self.characters.setdefault(character, CharacterStats())
+            self.characters[character] += stats
+        self._files |= files
+        self.dirty = True
+        self._all = None
+
+    def flush(self):
+        """Count all the queued runs, including those a worker thread is still counting."""
+        if self._pending or self._counting:
+            runs = self._counting + self._take_pending()
+            self._counting = [] # the worker's result gets dropped
+            self._merge(*_count_runs(self.game, runs))
+
+    async def flush_async(self):
+        """Count all the queued runs in a worker thread, for when there are many of them.
+
+        The counts are merged all at once when the thread is done. If they are
+        needed before that, :meth:`flush` counts these runs on its own."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return
+            runs = self._counting = self._take_pending()
+            result = await asyncio.to_thread(_count_runs, self.game, runs)
+            if self._counting is runs:
+                self._counting = []
+                self._merge(*result)
+
+    def get(self, character: str | None = None) -> CharacterStats:
+        """Return the stats for one character, or for all of them if None."""
+        self.flush()
+        if character is not None:
+            return self.characters.get(character) or CharacterStats()
+        if self._all is None:
+            self._all = CharacterStats()
+            for stats in self.characters.values():
+                self._all += stats
+        return self._all
+
+    def to_json(self) -> dict[str, Any]:
+        """Return the aggregates of the runs counted so far. This doesn't count queued runs."""
+        return {
+            "files": sorted(self._files),
+            "characters": {k: v.to_json() for k, v in self.characters.items()},
+        }
+
+    @classmethod
+    def from_json(cls, game: int, profile: int, value: dict[str, Any]) -> RunAnalytics:
+        self = cls(game, profile)
+        self._files = set(value["files"])
+        self.characters = {k: CharacterStats.from_json(v) for k, v in value["characters"].items()}
+        return self
+
+_analytics: dict[tuple[int, int], RunAnalytics] | None = None
+
+def _load() -> dict[tuple[int, int], RunAnalytics]:
+    global _analytics
+    if _analytics is None:
+        _analytics = {}
+        try:
+            with open(_PATH) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return _analytics
+        except (OSError, ValueError):
+            logger.exception("Could not load the run analytics, rebuilding them")
+            return _analytics
+        if data.get("version") != _VERSION:
+            return _analytics
+        for key, value in data["profiles"].items():
+            game, _, profile = key.partition(":")
+            _analytics[int(game), int(profile)] = RunAnalytics.from_json(int(game), int(profile), value)
+    return _analytics
+
+def get_analytics(game: int, profile: int) -> RunAnalytics:
+    """Return the aggregate stats of a profile."""
+    analytics = _load()
+    if (game, profile) not in analytics:
+        analytics[game, profile] = RunAnalytics(game, profile)
+    return analytics[game, profile]
+
+def _to_json() -> dict[str, Any]:
+    analytics = _load()
+    data = {
+        "version": _VERSION,
+        "profiles": {f"{game}:{profile}": x.to_json() for (game, profile), x in analytics.items()},
+    }
+    for value in analytics.values():
+        value.dirty = False
+    return data
+
+_file = persister("run-analytics.json", _to_json)
+_saving: asyncio.Task | None = None
+
+def save_analytics():
+    """Save the aggregates to disk in the background if they changed.
+
+    Queued runs are counted in a worker thread first."""
+    global _saving
+    analytics = _load()
+    if not any(x._pending for x in analytics.values()):
+        if any(x.dirty for x in analytics.values()):
+            _file.mark()
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError: # called from synchronous code, e.g. a migration
+        for value in analytics.values():
+            value.flush()
+        _file.mark()
+        return
+    if _saving is None or _saving.done():
+        _saving = loop.create_task(count_analytics())
+
+async def count_analytics():
+    """Count all the queued runs in a worker thread, and save the aggregates.
+
+    This is used at startup, when every run may need to be read."""
+    # runs can be queued while we wait for the thread
+    while pending := [x for x in _load().values() if x._pending]:
+        for value in pending:
+            await value.flush_async()
+    if any(x.dirty for x in _load().values()):
+        _file.mark()
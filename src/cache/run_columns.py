@@ -0,0 +1,215 @@
+"""Columnar view of the run history, for filtering every run at once.
+
+The summary of every run is laid out as NumPy arrays (one per field), and
+the relics and cards held at the end of each run as one bitset per item,
+with one bit per run. Any combination of filters is then a handful of
+vectorized mask operations, no matter how many runs there are.
+
+New runs are queued when added, and laid out in bulk the next time the
+columns are used.
+
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Any, TYPE_CHECKING
+
+import math
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+if TYPE_CHECKING:
+    from src.runs import RunParser, Run2Parser
+
+__all__ = ["RunColumns", "get_columns"]
+
+class RunColumns:
+    """Hold the summary fields of every run as NumPy arrays.
+
+    Row order is the order in which runs were added, not their timestamp."""
+
+    _fields = {
+        "epoch": "int64",
+        "won": "bool",
+        "character": "int16",
+        "ascension": "int16",
+        "floor": "int16",
+        "score": "int32", # -1 if the game has no score
+        "game": "int8",
+    }
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError("numpy is not installed, run columns cannot be used")
+        self.runs: list[RunParser | Run2Parser] = [] # row -> run
+        self.characters: list[str] = [] # code -> character
+        self._codes: dict[str, int] = {}
+        self._files: set[str] = set()
+        self._pending: list[RunParser | Run2Parser] = []
+        self._capacity = 0
+        self._newest_first = np.zeros(0, np.int64) # rows, sorted by epoch
+        for name, dtype in self._fields.items():
+            setattr(self, name, np.zeros(0, dtype))
+        # item -> packed bits, one per row (row 0 is the highest bit of byte 0)
+        self.relics: dict[str, np.ndarray] = {}
+        self.cards: dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        self.flush()
+        return len(self.runs)
+
+    def add(self, run: RunParser | Run2Parser):
+        """Queue a run to be added to the columns."""
+        self._pending.append(run)
+
+    def flush(self):
+        """Lay out all the queued runs."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        new = []
+        for run in pending:
+            if run.filename not in self._files:
+                self._files.add(run.filename)
+                new.append(run)
+        if not new:
+            return
+
+        start = len(self.runs)
+        end = start + len(new)
+        self._reserve(end)
+
+        summaries = [run.summary for run in new]
+        self.epoch[start:end] = [x.epoch for x in summaries]
+        self.won[start:end] = [x.won for x in summaries]
+        self.character[start:end] = [self._code(x.character) for x in summaries]
+        self.ascension[start:end] = [x.ascension for x in summaries]
+        self.floor[start:end] = [x.floor_reached for x in summaries]
+        self.score[start:end] = [-1 if x.score is None else x.score for x in summaries]
+        self.game[start:end] = [run.game_version for run in new]
+
+        relics = defaultdict(list)
+        cards = defaultdict(list)
+        for row, summary in enumerate(summaries, start):
+            for relic in set(summary.relics):
+                relics[relic].append(row)
+            for card in {x.partition("+")[0] for x in summary.master_deck}:
+                cards[card].append(row)
+        self._set_bits(self.relics, relics)
+        self._set_bits(self.cards, cards)
+
+        self.runs.extend(new)
+        self._newest_first = np.argsort(self.epoch[:end], kind="stable")[::-1]
+
+    def _code(self, character: str) -> int:
+        if character not in self._codes:
+            self._codes[character] = len(self.characters)
+            self.characters.append(character)
+        return self._codes[character]
+
+    def _reserve(self, size: int):
+        if size <= self._capacity:
+            return
+        capacity = max(size, self._capacity * 2, 1024)
+        capacity += -capacity % 8 # keep the bitsets byte-aligned
+        for name in self._fields:
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        for bitsets in (self.relics, self.cards):
+            for item, bits in bitsets.items():
+                new = np.zeros(capacity // 8, np.uint8)
+                new[:len(bits)] = bits
+                bitsets[item] = new
+        self._capacity = capacity
+
+    def _set_bits(self, bitsets: dict[str, np.ndarray], rows: dict[str, list[int]]):
+        for item, lst in rows.items():
+            if item not in bitsets:
+                bitsets[item] = np.zeros(self._capacity // 8, np.uint8)
+            arr = np.array(lst, np.int64)
+            np.bitwise_or.at(bitsets[item], arr >> 3, (0x80 >> (arr & 7)).astype(np.uint8))
+
+    def has(self, bitsets: dict[str, np.ndarray], item: str) -> np.ndarray:
+        """Return a boolean mask of the runs holding this relic or card at the end."""
+        self.flush()
+        n = len(self.runs)
+        bits = bitsets.get(item)
+        if bits is None:
+            return np.zeros(n, bool)
+        return np.unpackbits(bits, count=n).view(bool)
+
+    def select(self, *, start: int | float = 0, end: int | float = math.inf, min_score: int = 0,
+               characters: list[str] = (), won: bool | None = None, relics: list[str] = (), cards: list[str] = ()) -> np.ndarray:
+        """Return the rows matching all of the filters, newest first.
+
+        :param start: The earliest run end time, in seconds since the epoch.
+        :type start: int | float
+        :param end: The latest run end time, in seconds since the epoch.
+        :type end: int | float
+        :param min_score: The minimum score, for Spire 1 runs. Spire 2 runs are excluded if this is set.
+        :type min_score: int
+        :param characters: Only include these characters, if any are given.
+        :type characters: list[str]
+        :param won: Only include wins (True) or losses (False), or both if None.
+        :type won: bool | None
+        :param relics: Only include runs which held all of these relics at the end.
+        :type relics: list[str]
+        :param cards: Only include runs which held all of these cards at the end.
+        :type cards: list[str]
+        :return: An array of row indexes.
+        :rtype: numpy.ndarray
+        """
+
+        self.flush()
+        n = len(self.runs)
+        epoch = self.epoch[:n]
+        mask = (epoch >= start) & (epoch <= end)
+        if min_score:
+            mask &= self.score[:n] >= min_score
+        if characters:
+            codes = [self._codes[x] for x in characters if x in self._codes]
+            mask &= np.isin(self.character[:n], codes)
+        if won is not None:
+            mask &= self.won[:n] == won
+        for relic in relics:
+            mask &= self.has(self.relics, relic)
+        for card in cards:
+            mask &= self.has(self.cards, card)
+
+        return self._newest_first[mask[self._newest_first]]
+
+    def describe(self, rows: np.ndarray) -> dict[str, Any]:
+        """Return aggregate stats over the given rows."""
+        won = self.won[rows]
+        floors = self.floor[rows]
+        scores = self.score[rows]
+        scores = scores[scores >= 0]
+        wins = int(won.sum())
+        counts = np.bincount(self.character[rows], minlength=len(self.characters))
+        char_wins = np.bincount(self.character[rows], weights=won, minlength=len(self.characters))
+
+        return {
+            "count": len(rows),
+            "wins": wins,
+            "losses": len(rows) - wins,
+            "winrate": wins / len(rows) if len(rows) else 0.0,
+            "average_floor": float(floors.mean()) if len(floors) else 0.0,
+            "average_score": float(scores.mean()) if len(scores) else 0.0,
+            # (character, runs, wins)
+            "characters": [(c, int(n), int(w)) for c, n, w in zip(self.characters, counts, char_wins) if n],
+        }
+
+_columns: RunColumns | None = None
+
+def get_columns() -> RunColumns | None:
+    """Return the run columns, or None if numpy is not installed."""
+    global _columns
+    if _columns is None and np is not None:
+        _columns = RunColumns()
+    return _columns
@@ -0,0 +1,256 @@
+"""Keep track of the run history folders, and link runs as they arrive.
+
+Each run history folder (one per game and profile) gets a :class:`ProfileIndex`.
+The index remembers the folder mtime and which files it has already linked, so
+checking for new runs costs one ``stat`` call when nothing changed. New runs are
+appended to the tail of the linked lists; a full relink of that folder is only
+needed if a run shows up which is older than the current tail. The newest run
+for every character and outcome is kept as well, so looking up e.g. the last
+Watcher win doesn't need to walk the list.
+
+Win streaks are stamped on the runs as they get linked. Each run in a streak
+holds the shared :class:`StreakBlock` and its position in it, so adding a run
+only ever updates the streak at the tail.
+
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, TYPE_CHECKING
+
+import bisect
+import time
+import os
+
+from src.cache.cache_helpers import RunLinkedListNode
+
+if TYPE_CHECKING:
+    from src.runs import RunParser, Run2Parser
+
+__all__ = ["ProfileIndex", "StreakBlock", "get_index", "get_indexes", "get_newest_index"]
+
+# directory mtimes this recent may still change within the same tick
+# on filesystems with a coarse resolution, so we don't trust them yet
+_MTIME_GRACE = 2_000_000_000 # 2 seconds, in ns
+
+_folders = {1: "runs", 2: "runs2"}
+
+_indexes: dict[tuple[int, int], ProfileIndex] = {}
+
+class StreakBlock:
+    """Hold the length of a win streak, shared by all the runs in it."""
+
+    def __init__(self):
+        self.streak = 0
+        self.is_ongoing = True
+
+    def __repr__(self):
+        return f"StreakBlock<{self.streak}{' ongoing' if self.is_ongoing else ''}>"
+
+def _unique(runs: Iterable[RunParser | Run2Parser], linked: Iterable[str]) -> list[RunParser | Run2Parser]:
+    # linking the same run twice would make it its own neighbour
+    seen = set(linked)
+    ret = []
+    for run in runs:
+        if run.filename not in seen:
+            seen.add(run.filename)
+            ret.append(run)
+    return ret
+
+class ProfileIndex:
+    """Hold the linked runs and high-water mark for one run history folder."""
+
+    def __init__(self, game: int, profile: int):
+        self.game = game
+        self.profile = profile
+        self.path = os.path.join("data", _folders[game], str(profile))
+        self.mtime: int = -1 # folder mtime at the last scan, in ns
+        self.newest: str = "" # filename of the newest linked run
+        self.files: set[str] = set()
+        self.incoming: set[str] = set() # files being written, which scans must not pick up yet
+        self.runs: list[RunParser | Run2Parser] = [] # oldest first
+        self.epochs: list[int] = [] # matches self.runs, for range lookups
+
+        self.last: RunParser | Run2Parser | None = None
+        self.last_char: dict[str, RunParser | Run2Parser] = {}
+        self.last_win: RunParser | Run2Parser | None = None
+        self.last_loss: RunParser | Run2Parser | None = None
+        # newest run for each (character, won) pair
+        self.last_outcome: dict[tuple[str, bool], RunParser | Run2Parser] = {}
+        # the win streak at the tail, if the last (character's) run was a win
+        self.char_streaks: dict[str, StreakBlock] = {}
+        self.rotating_streak: StreakBlock | None = None
+
+    def __repr__(self):
+        return f"ProfileIndex<{self.path}: {len(self.runs)} runs>"
+
+    @property
+    def epoch(self) -> int:
+        """The epoch of the newest run, or -1 if there are none."""
+        if self.last is None:
+            return -1
+        return self.last.epoch
+
+    def latest(self, character: str | None, victory: bool | None) -> RunParser | Run2Parser | None:
+        """Return the newest run matching the character and outcome, if any.
+
+        A value of None for either means any character or outcome."""
+        if character is not None:
+            if victory is None:
+                return self.last_char.get(character)
+            return self.last_outcome.get((character, victory))
+        if victory is None:
+            return self.last
+        if victory:
+            return self.last_win
+        return self.last_loss
+
+    def between(self, start: int | float, end: int | float) -> list[RunParser | Run2Parser]:
+        """Return the runs with an epoch in the [start, end] range, oldest first."""
+        lo = bisect.bisect_left(self.epochs, start)
+        hi = bisect.bisect_right(self.epochs, end)
+        return self.runs[lo:hi]
+
+    def at(self, epoch: int) -> RunParser | Run2Parser | None:
+        """Return the run with this exact epoch, if any."""
+        i = bisect.bisect_left(self.epochs, epoch)
+        if i < len(self.epochs) and self.epochs[i] == epoch:
+            return self.runs[i]
+        return None
+
+    def has(self, run: RunParser | Run2Parser) -> bool:
+        """Return True if this run is linked in this index."""
+        return self.at(run.epoch) is run
+
+    def is_stale(self) -> bool:
+        """Return True if the folder changed since the last scan."""
+        try:
+            return os.stat(self.path).st_mtime_ns != self.mtime
+        except OSError:
+            return False
+
+    def scan(self) -> list[str]:
+        """Return the files present on disk which are not linked yet."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            files = [x.name for x in os.scandir(self.path) if x.is_file()]
+        except OSError:
+            return []
+
+        if time.time_ns() - mtime > _MTIME_GRACE:
+            self.mtime = mtime
+        return [x for x in files if x not in self.files and x not in self.incoming and not x.endswith(".tmp")]
+
+    def extend(self, runs: Iterable[RunParser | Run2Parser]):
+        """Link new runs into this index.
+
+        If all the runs are newer than the current tail, they are simply
+        appended. Otherwise, the whole folder gets relinked in order. Runs
+        which are already linked are skipped."""
+
+        runs = sorted(_unique(runs, self.files), key=lambda x: x.epoch)
+        if not runs:
+            return
+
+        if runs[0].epoch <= self.epoch:
+            self.relink(self.runs + runs)
+            return
+
+        for run in runs:
+            self._append(run)
+
+    def relink(self, runs: Iterable[RunParser | Run2Parser]):
+        """Drop all existing links, and link all of the runs from scratch."""
+        self.files.clear()
+        self.runs = []
+        self.epochs = []
+        self.newest = ""
+        self.last = self.last_win = self.last_loss = None
+        self.last_char.clear()
+        self.last_outcome.clear()
+        self.char_streaks.clear()
+        self.rotating_streak = None
+
+        for run in sorted(_unique(runs, ()), key=lambda x: x.epoch):
+            run.matched = RunLinkedListNode()
+            self._append(run)
+
+    def _append(self, cur: RunParser | Run2Parser):
+        self._add_streak(cur)
+        if (prev := self.last) is not None:
+            prev.matched.next = cur
+            cur.matched.prev = prev
+        if (c := self.last_char.get(cur.character)) is not None:
+            c.matched.next_char = cur
+            cur.matched.prev_char = c
+        self.last_char[cur.character] = cur
+        self.last_outcome[cur.character, cur.won] = cur
+        if cur.won:
+            if self.last_win is not None:
+                self.last_win.matched.next_win = cur
+                cur.matched.prev_win = self.last_win
+            self.last_win = cur
+        else:
+            if self.last_loss is not None:
+                self.last_loss.matched.next_loss = cur
+                cur.matched.prev_loss = self.last_loss
+            self.last_loss = cur
+
+        self.last = cur
+        self.runs.append(cur)
+        self.epochs.append(cur.epoch)
+        self.files.add(cur.filename)
+        if cur.filename > self.newest:
+            self.newest = cur.filename
+
+    def _add_streak(self, cur: RunParser | Run2Parser):
+        # this must be called before cur becomes the tail
+        if not cur.won:
+            if (block := self.char_streaks.pop(cur.character, None)) is not None:
+                block.is_ongoing = False
+            if self.rotating_streak is not None:
+                self.rotating_streak.is_ongoing = False
+                self.rotating_streak = None
+            cur._character_streak = cur._rotating_streak = None
+            return
+
+        if (block := self.char_streaks.get(cur.character)) is None:
+            block = self.char_streaks[cur.character] = StreakBlock()
+        block.streak += 1
+        cur._character_streak = (block, block.streak)
+
+        # the rotating streak only goes up when the character changes
+        if (block := self.rotating_streak) is None:
+            block = self.rotating_streak = StreakBlock()
+            block.streak = 1
+        elif self.last.character != cur.character:
+            block.streak += 1
+        cur._rotating_streak = (block, block.streak)
+
+def get_index(game: int, profile: int) -> ProfileIndex:
+    """Return the index for a given game and profile folder, creating it if needed."""
+    key = (game, profile)
+    if key not in _indexes:
+        _indexes[key] = ProfileIndex(game, profile)
+    return _indexes[key]
+
+def get_indexes() -> list[ProfileIndex]:
+    """Return the indexes for every run history folder present on disk."""
+    for game, folder in _folders.items():
+        try:
+            entries = list(os.scandir(os.path.join("data", folder)))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir() and entry.name.isdigit():
+                get_index(game, int(entry.name))
+
+    return list(_indexes.values())
+
+def get_newest_index() -> ProfileIndex | None:
+    """Return the index which holds the newest run of all, if there are any runs."""
+    newest = None
+    for index in _indexes.values():
+        if index.last is not None and (newest is None or index.epoch > newest.epoch):
+            newest = index
+    return newest
@@ -1,4 +1,8 @@
+from __future__ import annotations
+
 from datetime import datetime
+from typing import TYPE_CHECKING
+
 import json
 import os
 from src.cache.cache_helpers import Character, RunStats, RunStatsByDate
@@ -6,6 +10,9 @@ from src.sts_profile import get_profile
 from src.logger import logger
 from src.utils import parse_date_range, _parse_dates_with_optional_month_day
 
+if TYPE_CHECKING:
+    from src.runs import RunParser, Run2Parser
+
 class _RangeCache():
     def __init__(self) -> None:
         # Because nulls are a valid state (all-time), we need a distinction between the file saying the dates are null or 
@@ -28,9 +35,12 @@ __all__ = [
     "Character",
 ]
 
-def update_all_run_stats():
-    _update_run_stats(_all_run_stats)
-    _update_run_stats(_run_stats_by_date)
+def update_all_run_stats(new: list[RunParser | Run2Parser] | None = None):
+    """Add the runs linked since the last update, oldest first, to the stats.
+
+    If they aren't given, only the newest run is looked at."""
+    _update_run_stats(_all_run_stats, new=new)
+    _update_run_stats(_run_stats_by_date, new=new)
 
 def _write_range_to_file(start_date: datetime | None, end_date: datetime | None):
     _range.dateDict["start_date"] = start_date.strftime("%Y/%m/%d") if start_date is not None else None
@@ -83,12 +93,14 @@ def get_run_stats_by_date(start_date: datetime | None = None, end_date: datetime
     _update_run_stats(run_stats_by_date, run_stats_by_date.start_date, run_stats_by_date.end_date)
     return run_stats_by_date
 
-def _update_run_stats(run_stats: RunStats, start_date: datetime | None = None, end_date: datetime | None = None):
-    # we should only have to load this one time this way, after that we can just use the most recent run to update values
+def _update_run_stats(run_stats: RunStats, start_date: datetime | None = None, end_date: datetime | None = None, new: list[RunParser | Run2Parser] | None = None):
+    # we should only have to load this one time this way, after that we can just add the new runs
     # XXX: this is only the main profile of Spire 1
+    # this is the index's own list (oldest first), so don't modify it
     try:
-        #runs = list(get_profile(0, 1).runs) # BaalorA20 profile
-        runs = list(get_profile(1, 2).runs) # Spire 2 A10
+        #index = get_profile(0, 1).run_index # BaalorA20 profile
+        index = get_profile(1, 2).run_index # Spire 2 A10
+        runs = index.runs
     except:
         runs = []
 
@@ -96,7 +108,7 @@ def _update_run_stats(run_stats: RunStats, start_date: datetime | None = None, e
         if not run_stats.is_loaded:
             run_stats.is_loaded =  True
             run_stats.streaks.all_character_count = 0
-            for run in runs[1:]:
+            for run in reversed(runs[:-1]): # newest first, except the latest one
                 if run.modded or run.modifiers:
                     logger.info(f"Found modded or custom run in stats: {run.name}")
                 elif run.ascension_level < 20:
@@ -117,25 +129,37 @@ def _update_run_stats(run_stats: RunStats, start_date: datetime | None = None, e
                 character = Character(run.character)
                 if run_stats.streaks.character_counts[character] is None:
                     run_stats.streaks.character_counts[character] = run.character_streak.streak
+            new = None # everything else is in already
 
-        # set the stats from most recent run's rotating streak and character streak
-        last_run = runs[0]
-        if start_date is not None and last_run.timestamp < start_date:
-            return
-        if end_date is not None and last_run.timestamp > end_date:
-            return
-        if run_stats.last_timestamp != last_run.timestamp and not last_run.modded:
-            run_stats.last_timestamp = last_run.timestamp # if this happens to get called multiple times between runs, we want to make sure we don't continually increment
-            run_stats.check_pb(last_run)
-            if last_run.won:
-                run_stats.add_win(last_run.character, last_run.timestamp)
-            else:
-                run_stats.add_loss(last_run.character, last_run.timestamp)
-            run_stats.streaks.all_character_count = last_run.rotating_streak.streak
-            last_run_char = Character(last_run.character)
-            run_stats.streaks.character_counts[last_run_char] = last_run.character_streak.streak
+        if new is None:
+            new = [runs[-1]]
+        for run in new:
+            if index.has(run):
+                _add_run(run_stats, run, run is runs[-1], start_date, end_date)
     else:
         run_stats.streaks.character_counts = {char: 0 for char in Character}
 
+def _add_run(run_stats: RunStats, run: RunParser | Run2Parser, newest: bool, start_date: datetime | None, end_date: datetime | None):
+    # if this happens to get called multiple times between runs, we want to make sure we don't
+    # continually increment. this also skips runs which were already there when the stats got loaded
+    if run_stats.last_timestamp is not None and run.timestamp <= run_stats.last_timestamp:
+        return
+    run_stats.last_timestamp = run.timestamp
+    if start_date is not None and run.timestamp < start_date:
+        return
+    if end_date is not None and run.timestamp > end_date:
+        return
+    if run.modded:
+        return
+
+    run_stats.check_pb(run)
+    if run.won:
+        run_stats.add_win(run.character, run.timestamp)
+    else:
+        run_stats.add_loss(run.character, run.timestamp)
+    if newest: # set the stats from most recent run's rotating streak and character streak
+        run_stats.streaks.all_character_count = run.rotating_streak.streak
+        run_stats.streaks.character_counts[Character(run.character)] = run.character_streak.streak
+
 def get_all_run_stats():
     return _all_run_stats
@@ -0,0 +1,137 @@
+"""Persistent summaries of run files, for a fast cold start.
+
+The run history pages, streaks and stats only need a handful of fields from
+each run. These are stored in a small SQLite database next to the run files,
+keyed by the file path and validated with the file size and mtime. A run
+parser can be built from a summary alone, and will load the full JSON file
+the first time something else is needed.
+
+"""
+
+from __future__ import annotations
+
+from typing import Any, NamedTuple
+
+import sqlite3
+import json
+import os
+
+from src.logger import logger
+
+__all__ = ["RunSummary", "SummaryStore", "get_store", "close_store"]
+
+_SCHEMA_VERSION = 3
+
+class RunSummary(NamedTuple):
+    """Contain the fields of a run which stay in memory at all times."""
+    epoch: int
+    character: str
+    won: bool
+    ascension: int
+    floor_reached: int
+    score: int | None
+    killed_by: str | None
+    seed: str
+    playtime: int
+    modifiers: tuple[Any, ...]
+    relics: tuple[str, ...]
+    master_deck: tuple[str, ...]
+    floor_values: bytes | None = None # see src.floor_series.PackedSeries
+
+# these are stored as JSON text, everything else gets its own column
+_sequences = {"modifiers", "relics", "master_deck"}
+
+def _to_row(summary: RunSummary) -> list:
+    return [json.dumps(value) if name in _sequences else value for name, value in zip(RunSummary._fields, summary)]
+
+def _from_row(row: list) -> RunSummary:
+    summary = RunSummary(*row)
+    return summary._replace(
+        won=bool(summary.won),
+        **{name: tuple(json.loads(getattr(summary, name))) for name in _sequences},
+    )
+
+class SummaryStore:
+    """Hold the on-disk run summaries.
+
+    All rows are read in one query the first time the store is used.
+    Writes are batched until :meth:`commit` is called."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._rows: dict[str, tuple[int, int, RunSummary]] = {}
+        self._dirty = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != _SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS summaries")
+                columns = ", ".join(RunSummary._fields)
+                self._conn.execute(f"CREATE TABLE summaries (path TEXT PRIMARY KEY, size, mtime, {columns})")
+                self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+                self._conn.commit()
+
+            for path, size, mtime, *fields in self._conn.execute("SELECT * FROM summaries"):
+                self._rows[path] = (size, mtime, _from_row(fields))
+
+        return self._conn
+
+    def get(self, path: str, st: os.stat_result) -> RunSummary | None:
+        """Return the summary for a file, or None if it's missing or out of date."""
+        try:
+            self._connect()
+        except sqlite3.Error:
+            logger.exception("Could not open the run summary index")
+            return None
+        row = self._rows.get(path)
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            return None
+        return row[2]
+
+    def put(self, path: str, st: os.stat_result, summary: RunSummary):
+        """Store the summary for a file. This is not saved until :meth:`commit` is called."""
+        row = self._rows.get(path)
+        if row is not None and row == (st.st_size, st.st_mtime_ns, summary):
+            return
+        try:
+            conn = self._connect()
+            marks = ", ".join("?" * (len(RunSummary._fields) + 3))
+            conn.execute(
+                f"INSERT OR REPLACE INTO summaries VALUES ({marks})",
+                (path, st.st_size, st.st_mtime_ns, *_to_row(summary)),
+            )
+        except sqlite3.Error:
+            logger.exception(f"Could not store the summary for {path}")
+            return
+        self._rows[path] = (st.st_size, st.st_mtime_ns, summary)
+        self._dirty = True
+
+    def commit(self):
+        """Save all pending summaries to disk."""
+        if self._dirty and self._conn is not None:
+            self._conn.commit()
+            self._dirty = False
+
+    def close(self):
+        """Save all pending summaries, and close the database. It is opened again if needed."""
+        if self._conn is not None:
+            self.commit()
+            self._conn.close()
+            self._conn = None
+
+_store: SummaryStore | None = None
+
+def get_store() -> SummaryStore:
+    """Return the summary store for the run history folders."""
+    global _store
+    if _store is None:
+        _store = SummaryStore(os.path.join("data", "run-index.sqlite3"))
+    return _store
+
+def close_store():
+    """Close the summary store, if it was opened."""
+    if _store is not None:
+        _store.close()
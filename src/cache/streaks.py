@@ -2,35 +2,45 @@ from __future__ import annotations
 
 from datetime import datetime, UTC
 from typing import TYPE_CHECKING
+
+import math
 from src.logger import logger
 
 from src.cache.cache_helpers import StreakCache, StreakContainer
 from src.sts_profile import get_profile
 
+if TYPE_CHECKING:
+    from src.runs import RunParser, Run2Parser
+
 
 # TODO(olivia): Hard-coded to be the start of the Grandmastery challenge.  Move
 # to config file?
 _streak_collections = StreakCache(datetime(2023, 10, 24, tzinfo=UTC))
 
-def update_streak_collections():
+def update_streak_collections(new: list[RunParser | Run2Parser] | None = None):
     # First we grab all the runs from the BaalorA20 profile.
     profile = get_profile(0, 1)
-    if profile is None or not profile.runs:
+    if profile is None or not profile.run_index.runs:
         logger.info(f"No runs found to group into streak")
         return
-    all_runs = list(profile.runs)
-    all_runs.reverse()
 
+    since = _streak_collections.since.timestamp()
+    # The groups only change if one of the new runs counts for them. A run which
+    # arrives can join a group from long ago (the previous run of its character),
+    # so the grouping itself is done again from scratch.
+    if new is not None and _streak_collections.containers:
+        if not any(run.epoch > since and profile.run_index.has(run) for run in new):
+            return
 
     # We build a list of all runs that have happened the cutoff date, sorted with the earliest runs
     # first in the list
-    runs = [x for x in all_runs if x.timestamp > _streak_collections.since]
+    runs = [x for x in profile.run_index.between(since, math.inf) if x.epoch > since]
 
     logger.info(f"Grouping streaks of %s runs", len(runs))
 
     from pprint import pprint
     groups = []
-    seen = []
+    seen = set()
     # Here, we make groups of runs based on if they are in a streak
     for x, run in enumerate(runs):
         # If we've already processed the run in a previous chain, we can skip it since it's already
@@ -44,7 +54,7 @@ def update_streak_collections():
             # add it to the group and recursively do the same again.
             cur = run
             while cur and cur.won:
-                seen.append(cur.name)
+                seen.add(cur.name)
                 group.append(cur)
                 cur = cur.matched.next_char
             groups.append(group)
@@ -52,7 +62,7 @@ def update_streak_collections():
             # Same as above, but for runs that have lost
             cur = run
             while cur and not cur.won:
-                seen.append(cur.name)
+                seen.add(cur.name)
                 group.append(cur)
                 cur = cur.matched.next_char
             groups.append(group)
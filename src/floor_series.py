@@ -0,0 +1,117 @@
+"""Per-floor values of a run, as NumPy arrays.
+
+The map nodes know the HP, gold, deck size and so on after every floor, but
+reading them means going through every node object each time. This reads
+them all once, into one array per value (with Neow as the first entry), so
+that the graphs, the score bonuses and the run comparisons can work on
+whole runs at once.
+
+"""
+
+from __future__ import annotations
+
+from operator import attrgetter
+from typing import Iterable, TYPE_CHECKING
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+if TYPE_CHECKING:
+    from src.gamedata import FileParser
+
+__all__ = ["FloorSeries", "PackedSeries", "average"]
+
+class _Series:
+    columns: tuple[str, ...]
+    floor: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.floor)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self.columns:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def per_floor(self, name: str, length: int) -> np.ndarray:
+        """Return the values with one entry per floor number, from Neow up to length-1.
+
+        Floors without a node, or past the end of the run, are NaN."""
+        ret = np.full(length, np.nan)
+        mask = self.floor < length
+        ret[self.floor[mask]] = self[name][mask]
+        return ret
+
+class FloorSeries(_Series):
+    """Hold the per-floor values of one run, built from its path.
+
+    Every array has one entry per floor with a map node, in order, starting
+    with Neow (floor 0). Floors without a node are skipped, so the floor
+    number of each entry is in :attr:`floor`."""
+
+    #: The values which are kept, in the same order as the arrays.
+    columns = ("current_hp", "max_hp", "gold", "floor_time", "card_count", "relic_count", "potion_count", "fights_count", "turns_count")
+
+    _get_values = attrgetter(*columns)
+
+    def __init__(self, parser: FileParser):
+        if np is None:
+            raise RuntimeError("numpy is not installed, floor series cannot be used")
+        path = parser.path
+        self.path = path # to know when the path changes, for the savefile
+
+        neow = parser.neow_bonus
+        rows = [tuple(getattr(neow, name, 0) for name in self.columns)]
+        for node in path:
+            try:
+                rows.append(self._get_values(node))
+            except AttributeError: # e.g. the HP of the current floor of the savefile isn't known yet
+                rows.append(tuple(getattr(node, name, 0) for name in self.columns))
+        values = np.array(rows, np.int32).reshape(-1, len(self.columns))
+
+        self.floor = np.array([0] + [node.floor for node in path], np.int16)
+        for i, name in enumerate(self.columns):
+            setattr(self, name, values[:, i])
+        #: The floors at which an act ends.
+        self.act_ends = np.array([node.floor for node in path if node.end_of_act], np.int16)
+        #: Whether each floor is a boss fight.
+        self.boss = np.array([False] + [node.room_type == "Boss" for node in path], bool)
+        self.bosses = int(self.boss.sum()) #: How many bosses were fought.
+
+    def hp_lost(self) -> np.ndarray:
+        """The HP lost (or gained, if negative) on each floor, starting with floor 1."""
+        return -np.diff(self.current_hp)
+
+    def pack(self) -> bytes:
+        """Return the values needed to compare runs, to keep in the run summary."""
+        return np.stack([self.floor] + [self[name] for name in PackedSeries.columns]).astype(np.int32).tobytes()
+
+class PackedSeries(_Series):
+    """Hold the per-floor values of a run which are kept in its summary.
+
+    These are enough to compare runs without loading their files."""
+
+    columns = ("current_hp", "max_hp", "gold")
+
+    def __init__(self, data: bytes):
+        if np is None:
+            raise RuntimeError("numpy is not installed, floor series cannot be used")
+        values = np.frombuffer(data, np.int32).reshape(len(self.columns) + 1, -1)
+        self.floor = values[0]
+        for i, name in enumerate(self.columns, 1):
+            setattr(self, name, values[i])
+
+def average(series: Iterable[FloorSeries | PackedSeries], name: str) -> list[float | None]:
+    """Return the average of a value on every floor, over multiple runs.
+
+    Floors which none of the runs reached are None."""
+    series = list(series)
+    if not series:
+        return []
+    length = max(int(x.floor[-1]) for x in series) + 1
+    stacked = np.vstack([x.per_floor(name, length) for x in series])
+    counts = np.count_nonzero(~np.isnan(stacked), axis=0)
+    totals = np.nansum(stacked, axis=0)
+    return [round(float(t / c), 1) if c else None for t, c in zip(totals, counts)]
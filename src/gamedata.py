@@ -4,9 +4,9 @@ from typing import Any, Generator, Iterable, NamedTuple, Optional, TYPE_CHECKING
 
 import urllib.parse
 import collections
+import os
 import datetime
 import math
-import io
 
 from abc import ABC, abstractmethod
 
@@ -15,19 +15,12 @@ from aiohttp.web import Request, Response, HTTPForbidden, HTTPNotImplemented, HT
 from src.typehints import *
 from src.utils import format_for_slaytabase
 
-try:
-    from matplotlib import pyplot as plt
-except ModuleNotFoundError:
-    plt = None
-
-try:
-    from mpld3 import fig_to_html
-except ModuleNotFoundError:
-    fig_to_html = None
-
 from src.nameinternal import get_event, get_relic_stats, get_run_mod, get, get_card, Card, SingleCard, Relic, Potion
 from src.sts_profile import Profile
 from src.logger import logger
+from src.events import add_listener
+from src.floor_series import FloorSeries
+from src import graphs
 
 from src.config import config
 
@@ -110,6 +103,11 @@ class BaseNode(ABC):
 
     """
 
+    __slots__ = (
+        "parser", "floor_time", "current_hp", "max_hp", "gold", "floor",
+        "card_count", "relic_count", "potion_count", "fights_count", "turns_count",
+    )
+
     game_version: int = 1       #: Which game version this mapping is for.
 
     room_type: str = ""         #: The display name of map nodes.
@@ -935,6 +933,11 @@ class ShopContents:
         self.potions.append(get(potion))
 
 
+@add_listener("setup_init")
+async def _setup_graphs():
+    graphs.configure(config.server.graph_workers, config.server.cache.graph_megabytes,
+                     os.path.join("data", "graph-cache"), config.server.cache.graph_disk_megabytes)
+
 class FileParser(ABC):
     _variables_map = {
         "current_hp": "Current HP",
@@ -967,7 +970,7 @@ class FileParser(ABC):
         self.neow_bonus = NeowBonus(self)
         self._cache: dict[str, Any] = {"self": self} # this lets us do on-the-fly debugging
         self._character: str | None = None
-        self._graph_cache: dict[tuple[str, str, tuple, str | None, str | None], str | bytes] = {}
+        self._revision = 0 # bumped when the data changes, to invalidate the graphs
 
     def __str__(self):
         return f"{self.__class__.__name__}<{self.timestamp}>"
@@ -981,7 +984,11 @@ class FileParser(ABC):
         except StopIteration:
             return self._data[self.prefix + "boss_relics"][-1]
 
-    def graph(self, req: Request) -> Response:
+    def _graph_key(self, graph_type: str, display_type: str, items: Iterable[str], label: str | None, title: str | None) -> tuple:
+        """Return the key for a graph in the shared graph cache."""
+        return (str(self), self._revision, graph_type, display_type, tuple(items), label, title)
+
+    async def graph(self, req: Request) -> Response:
         if "view" not in req.query or "type" not in req.query:
             raise HTTPForbidden(reason="Needs 'view' and 'type' params")
         if req.query["type"] not in self._graph_types:
@@ -993,29 +1000,41 @@ class FileParser(ABC):
         label = req.query.get("label")
         title = req.query.get("title")
 
-        to_cache = (graph_type, display_type, tuple(items), label, title)
-
-        if to_cache not in self._graph_cache:
-            try:
-                self._graph_cache[to_cache] = self._generate_graph(graph_type, display_type, items, label, title, allow_private=False)
-            except ValueError as e:
-                raise HTTPForbidden(reason=e.args[0])
-            except TypeError:
-                raise HTTPNotFound()
-
-        return Response(body=self._graph_cache[to_cache], content_type=self._graph_types[display_type])
+        key = self._graph_key(graph_type, display_type, items, label, title)
+        try:
+            value = await graphs.get_graph(key, lambda: self._graph_args(graph_type, display_type, items, label, title, allow_private=False), persist=self.done)
+        except ValueError as e:
+            raise HTTPForbidden(reason=e.args[0])
+        except TypeError:
+            raise HTTPNotFound()
+
+        return Response(body=value, content_type=self._graph_types[display_type])
+
+    async def prerender_graphs(self, views: Iterable[str]):
+        """Render the given graph views ahead of time, as the run page would request them.
+
+        Each view is a comma-separated list of variables, same as the 'view' param."""
+        for view in views:
+            items = view.split(",")
+            for display_type in self._graph_types:
+                key = self._graph_key("plot", display_type, items, None, None)
+                try:
+                    await graphs.get_graph(key, lambda d=display_type: self._graph_args("plot", d, items, None, None, allow_private=False), persist=self.done)
+                except (ValueError, TypeError) as e: # e.g. mpld3 isn't installed
+                    logger.debug(f"Could not pre-render graph {view!r} ({display_type}) for {self}: {e}")
 
-    def bar(self, dtype: str, items: Iterable[str], label: str | None = None, title: str | None = None, *, allow_private: bool = False) -> str | bytes:
+    async def bar(self, dtype: str, items: Iterable[str], label: str | None = None, title: str | None = None, *, allow_private: bool = False) -> str | bytes:
         if dtype not in self._graph_types:
             raise ValueError(f"Display type {dtype} is undefined")
-        to_cache = ("bar", dtype, tuple(items), label, title)
-        if to_cache not in self._graph_cache:
-            self._graph_cache[to_cache] = self._generate_graph("bar", dtype, items, label, title, allow_private=allow_private)
-        return self._graph_cache[to_cache]
+        key = self._graph_key("bar", dtype, items, label, title)
+        return await graphs.get_graph(key, lambda: self._graph_args("bar", dtype, items, label, title, allow_private=allow_private), persist=self.done)
 
-    def _generate_graph(self, graph_type: str, display_type: str, items: Iterable[str], ylabel: str | None, title: str | None, *, allow_private: bool) -> str | bytes:
-        if plt is None:
+    def _graph_args(self, graph_type: str, display_type: str, items: Iterable[str], ylabel: str | None, title: str | None, *, allow_private: bool) -> tuple:
+        """Gather the data to plot, and return the arguments for :func:`src.graphs.render`."""
+        if graphs.plt is None:
             raise ValueError("matplotlib is not installed, graphs cannot be used")
+        if graph_type not in graphs.GRAPH_TYPES:
+            raise TypeError(f"Could not understand graph type {graph_type}")
 
         totals: dict[str, list[int]] = {}
         ends = []
@@ -1027,76 +1046,44 @@ class FileParser(ABC):
             if arg not in self._variables_map:
                 logger.warning(f"Graph parameter {arg!r} may not be properly handled.")
 
-        for name, d in totals.items():
-            val = getattr(self.neow_bonus, name, None)
-            if val is not None:
-                if not floors:
-                    floors.append(0)
-                d.append(val)
-
-        for node in self.path:
-            floors.append(node.floor)
-            if node.end_of_act:
-                ends.append(node.floor)
+        if (series := self.floor_series) is not None and all(name in series.columns for name in totals):
+            # the common case, where everything was already read from the path
+            floors = series.floor.tolist()
+            ends = series.act_ends.tolist()
+            for name in totals:
+                totals[name] = series[name].tolist()
+        else:
             for name, d in totals.items():
-                val = getattr(node, name, 0)
-                if callable(val):
-                    try:
-                        val = val()
-                    except TypeError:
-                        raise ValueError(f"Cannot call function {name!r} that requires parameters.")
-                try:
-                    val + 0
-                except TypeError:
-                    raise ValueError(f"Cannot use non-integer {name!r} for graphs.")
-                else:
+                val = getattr(self.neow_bonus, name, None)
+                if val is not None:
+                    if not floors:
+                        floors.append(0)
                     d.append(val)
 
-        fig, ax = plt.subplots()
-        match graph_type:
-            case "plot":
-                func = ax.plot
-            case "scatter":
-                func = ax.scatter
-            case "bar":
-                func = ax.bar
-            case "stem":
-                func = ax.stem
-            case a:
-                raise TypeError(f"Could not understand graph type {a}")
-
-        if display_type != "embed":
-            for num in ends:
-                plt.axvline(num, color="black", linestyle="dashed")
-
-        for name, d in totals.items():
-            func(floors, d, label=self._variables_map.get(name, name))
-        ax.legend()
+            for node in self.path:
+                floors.append(node.floor)
+                if node.end_of_act:
+                    ends.append(node.floor)
+                for name, d in totals.items():
+                    val = getattr(node, name, 0)
+                    if callable(val):
+                        try:
+                            val = val()
+                        except TypeError:
+                            raise ValueError(f"Cannot call function {name!r} that requires parameters.")
+                    try:
+                        val + 0
+                    except TypeError:
+                        raise ValueError(f"Cannot use non-integer {name!r} for graphs.")
+                    else:
+                        d.append(val)
 
-        plt.xlabel("Floor")
-        if ylabel is not None:
-            plt.ylabel(ylabel)
-        elif len(totals) == 1:
+        if ylabel is None and len(totals) == 1:
             label = tuple(totals)[0]
-            plt.ylabel(self._variables_map.get(label, label))
-        plt.xlim(left=0)
-        plt.ylim(bottom=0)
-        if title is not None: # doesn't appear to work with mpld3
-            plt.suptitle(title)
-
-        match display_type:
-            case "embed":
-                if fig_to_html is None:
-                    raise ValueError("mpld3 isn't installed, cannot embed graphs. Use 'image' display type")
-                value: str = fig_to_html(fig)
-                plt.close(fig)
-                return value
-
-            case "image":
-                with io.BytesIO() as file:
-                    plt.savefig(file, format="png", transparent=True)
-                    plt.close(fig)
-                    return file.getvalue()
+            ylabel = self._variables_map.get(label, label)
+        series = [(self._variables_map.get(name, name), d) for name, d in totals.items()]
+
+        return (graph_type, display_type, floors, ends, series, ylabel, title)
 
     def get_char_portrait(self):
         c = self.character.lower()
@@ -1199,6 +1186,17 @@ class FileParser(ABC):
         """Whether the run uses a modded character."""
         return self.character not in ("Ironclad", "Silent", "Defect", "Watcher")
 
+    @property
+    def floor_series(self) -> FloorSeries | None:
+        """The per-floor values of the run as arrays, or None if numpy is not installed."""
+        series: FloorSeries | None = self._cache.get("floor_series")
+        if series is None or series.path is not self.path: # the savefile's path changes during the run
+            try:
+                series = self._cache["floor_series"] = FloorSeries(self)
+            except RuntimeError:
+                return None
+        return series
+
     @property
     def current_hp_counts(self) -> list[int]:
         """The current HP in all the floors, including Neow."""
@@ -1516,10 +1514,10 @@ class FileParser(ABC):
         return self._data["chose_seed"]
 
     @property
-    def path(self) -> list[NodeData]: # note: caching may not be needed
-        """The run's path, cached."""
+    def path(self) -> tuple[NodeData, ...]:
+        """The run's path, cached. This is shared, so it's a tuple."""
         if "path" not in self._cache:
-            self._cache["path"] = []
+            path = []
             floor_time: tuple[int, ...]
             if "basemod:mod_saves" in self._data:
                 floor_time = self._data["basemod:mod_saves"].get("FloorExitPlaytimeLog", ())
@@ -1531,7 +1529,8 @@ class FileParser(ABC):
             potion_count = self.neow_bonus.potion_delta()
             fights_count = self.neow_bonus.fights_delta()
             turns_count = self.neow_bonus.turns_delta()
-            for node, cached in _get_nodes(self, self._cache.pop("old_path", None)):
+            old_path = self._cache.pop("old_path", None)
+            for node, cached in _get_nodes(self, old_path and list(old_path)):
                 try:
                     t = floor_time[node.floor - 1]
                 except IndexError:
@@ -1555,9 +1554,10 @@ class FileParser(ABC):
                     node.turns_count = turns_count
                     node.floor_time = t - prev
                 prev = t
-                self._cache["path"].append(node)
+                path.append(node)
+            self._cache["path"] = tuple(path)
 
-        return list(self._cache["path"])
+        return self._cache["path"]
 
     @property
     def modifiers(self) -> list[str]:
@@ -1583,7 +1583,11 @@ class FileParser(ABC):
     def get_floor(self, floor: int) -> BaseNode | None:
         if floor == 0:
             return self.neow_bonus
-        for node in self.path:
+        path = self.path
+        # floors are rarely skipped, so this is almost always the right node
+        if 0 < floor <= len(path) and path[floor-1].floor == floor:
+            return path[floor-1]
+        for node in path:
             if node.floor == floor:
                 return node
         return None
@@ -1689,6 +1693,12 @@ def _get_nodes(parser: FileParser, maybe_cached: list[NodeData] | None) -> Gener
 class KeysObtained:
     """Contain information about the obtained keys."""
 
+    __slots__ = (
+        "ruby_key_obtained", "ruby_key_floor",
+        "emerald_key_obtained", "emerald_key_floor",
+        "sapphire_key_obtained", "sapphire_key_floor",
+    )
+
     def __init__(self):
         self.ruby_key_obtained = False
         self.ruby_key_floor = 0
@@ -1707,6 +1717,8 @@ class KeysObtained:
 class RelicData:
     """Contain information for Spire relics."""
 
+    __slots__ = ("parser", "relic", "_description")
+
     def __init__(self, parser: FileParser, relic: str):
         self.parser = parser
         self.relic: Relic = get(relic)
@@ -1830,6 +1842,8 @@ class RelicData:
         return self.relic.name
 
 class CardData: # TODO: metadata + scaling cards (for savefile)
+    __slots__ = ("orig", "_cards_list", "single", "card", "meta", "upgrades")
+
     def __init__(self, card: str | SingleCard, cards_list: Iterable[str], meta: int = 0):
         self.orig = card
         if isinstance(card, str):
@@ -1904,6 +1918,10 @@ class NodeData(BaseNode):
 
     """
 
+    # _damage and _event belong to EncounterBase and Event, but EventFight
+    # inherits from both, so they need to live on a common base class
+    __slots__ = ("_description", "_damage", "_event")
+
     map_icon = "" #: The map icon as present under the static/icons/ folder
 
     def __init__(self, parser: FileParser, floor: int, *extra): # TODO: Keep track of the deck per node
@@ -1919,7 +1937,7 @@ class NodeData(BaseNode):
             # if this assignment fails too, just let it
             self._set_hp_gold(floor - 1)
 
-        self._cache = {}
+        self._description: str | None = None
 
     def _set_hp_gold(self, floor: int) -> bool:
         """Set the gold as well as current and max HP for this node.
@@ -1941,9 +1959,9 @@ class NodeData(BaseNode):
         return True
 
     def description(self) -> str:
-        if "description" not in self._cache:
-            self._cache["description"] = super().description()
-        return self._cache["description"]
+        if self._description is None:
+            self._description = super().description()
+        return self._description
 
     def get_description(self, to_append: dict[int, list[str]]):
         if self.potions:
@@ -1989,6 +2007,8 @@ class NodeData(BaseNode):
 class EncounterBase(NodeData):
     """A base data class for Spire node encounters."""
 
+    __slots__ = ()
+
     def __init__(self, parser: FileParser, floor: int, *extra):
         super().__init__(parser, floor, *extra)
         for damage in parser._data[parser.prefix + "damage_taken"]: #PRIV#
@@ -2027,14 +2047,17 @@ class EncounterBase(NodeData):
         return int(self._damage["damage"])
 
 class NormalEncounter(EncounterBase):
+    __slots__ = ()
     room_type = "Enemy"
     map_icon = "fight_normal.png"
 
 class EventEncounter(EncounterBase):
+    __slots__ = ()
     room_type = "Unknown (Enemy)"
     map_icon = "event_fight.png"
 
 class Treasure(NodeData):
+    __slots__ = ("key_relic", "blue_key")
     room_type = "Treasure"
     map_icon = "treasure_chest.png"
 
@@ -2060,10 +2083,12 @@ class Treasure(NodeData):
             to_append[6].append(f"Skipped {self.key_relic} for the Sapphire key")
 
 class EventTreasure(Treasure):
+    __slots__ = ()
     room_type = "Unknown (Treasure)"
     map_icon = "event_chest.png"
 
 class EliteEncounter(EncounterBase):
+    __slots__ = ("has_key",)
     room_type = "Elite"
     map_icon = "fight_elite.png"
 
@@ -2080,6 +2105,7 @@ class EliteEncounter(EncounterBase):
             to_append[6].append("Got the Emerald Key")
 
 class EventElite(EliteEncounter):
+    __slots__ = ()
     room_type = "Unknown (Elite)"
     map_icon = "event.png"
 
@@ -2106,6 +2132,7 @@ def event_node(parser: FileParser, floor: int, *extra) -> BaseNode:
 event_node.end_of_act = False
 
 class EmptyEvent(NodeData):
+    __slots__ = ()
     room_type = "Unknown (Bugged)"
     map_icon = "event.png"
 
@@ -2118,6 +2145,7 @@ class EmptyEvent(NodeData):
         )
 
 class AmbiguousEvent(NodeData):
+    __slots__ = ("_events",)
     room_type = "Unknown (Ambiguous)"
     map_icon = "event.png"
 
@@ -2133,6 +2161,7 @@ class AmbiguousEvent(NodeData):
         )
 
 class Event(NodeData):
+    __slots__ = ()
     room_type = "Unknown"
     map_icon = "event.png"
 
@@ -2259,7 +2288,11 @@ class EventFight(Event, EncounterBase):
 
     """
 
+    __slots__ = ()
+
 class Colosseum(Event):
+    __slots__ = ("_damages",)
+
     def __init__(self, parser: FileParser, floor: int, events: list[dict[str, Any]], *extra):
         event = {
             "damage_healed": 0,
@@ -2298,6 +2331,7 @@ class Colosseum(Event):
         return sum(d["turns"] for d in self._damages)
 
 class Merchant(NodeData):
+    __slots__ = ("contents", "bought", "purged")
     room_type = "Merchant"
     map_icon = "shop.png"
 
@@ -2347,10 +2381,12 @@ class Merchant(NodeData):
         return super().card_delta() - len(self.purged)
 
 class EventMerchant(Merchant):
+    __slots__ = ()
     room_type = "Unknown (Merchant)"
     map_icon = "event_shop.png"
 
 class Courier(NodeData):
+    __slots__ = ()
     room_type = "Courier (Spire with Friends)"
     map_icon = "event.png"
 
@@ -2358,6 +2394,7 @@ class Courier(NodeData):
         to_append[99].append("This is a Courier node. I don't know how to deal with it.")
 
 class Empty(NodeData):
+    __slots__ = ()
     room_type = "Empty (Spire with Friends)"
     map_icon = "event.png"
 
@@ -2365,6 +2402,7 @@ class Empty(NodeData):
         to_append[99].append("This is an empty node. Nothing happened here.")
 
 class SWF(NodeData):
+    __slots__ = ()
     room_type = "Unknown Node (Spire with Friends)"
     map_icon = "event.png"
 
@@ -2372,6 +2410,7 @@ class SWF(NodeData):
         to_append[99].append("This is some Spire with Friends stuff. I don't know how to deal with it.")
 
 class Campfire(NodeData):
+    __slots__ = ("_key", "_data")
     room_type = "Rest Site"
     map_icon = "rest.png"
 
@@ -2407,10 +2446,12 @@ class Campfire(NodeData):
                 return f"Did {a!r} with {self._data!r}, but I'm not sure what this means"
 
 class Boss(EncounterBase):
+    __slots__ = ()
     room_type = "Boss"
     map_icon = "boss_node.png"
 
 class BossChest(NodeData):
+    __slots__ = ("_picked", "_skipped")
     room_type = "Boss Chest"
     map_icon = "boss_chest.png"
     end_of_act = True
@@ -2439,11 +2480,13 @@ class BossChest(NodeData):
         return self._skipped
 
 class Act4Transition(NodeData):
+    __slots__ = ()
     room_type = "Transition into Act 4"
     map_icon = "event.png"
     end_of_act = True
 
 class Victory(NodeData):
+    __slots__ = ("_score", "_data")
     room_type = "Victory!"
     map_icon = "event.png"
 
@@ -0,0 +1,322 @@
+"""Render run graphs outside of the event loop, and cache the results.
+
+The parsers gather the numbers to plot (which is fast, and needs the run
+data), and the actual matplotlib work happens here, in a separate process.
+Rendered graphs go in a single size-bounded LRU cache, keyed on the run,
+the graph parameters and the data revision, and concurrent requests for
+the same graph share a single render. Graphs of finished runs never change,
+so they are also written to disk, and survive restarts.
+
+This module must not import anything from the rest of the bot, as the
+worker processes import it on their own.
+
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Hashable
+
+import multiprocessing
+import hashlib
+import asyncio
+import os
+import io
+
+try:
+    import matplotlib
+    matplotlib.use("Agg") # the server has no display, and this must be set before pyplot is imported
+    from matplotlib import pyplot as plt
+except ModuleNotFoundError:
+    plt = None
+
+try:
+    from mpld3 import fig_to_html
+except ModuleNotFoundError:
+    fig_to_html = None
+
+__all__ = ["GRAPH_TYPES", "render", "GraphCache", "get_graph_cache", "get_graph"]
+
+GRAPH_TYPES = ("plot", "scatter", "bar", "stem")
+
+_DISK_VERSION = 1 # bump this if the rendering changes, to ignore the graphs already on disk
+
+def render(graph_type: str, display_type: str, floors: list[int], ends: list[int], series: list[tuple[str, list[int | float]]],
+           ylabel: str | None, title: str | None) -> str | bytes:
+    """Draw a graph and return it as HTML or PNG data.
+
+    :param graph_type: One of :data:`GRAPH_TYPES`.
+    :type graph_type: str
+    :param display_type: Either 'embed' (HTML) or 'image' (PNG).
+    :type display_type: str
+    :param floors: The x values.
+    :type floors: list[int]
+    :param ends: The floors at which an act ends.
+    :type ends: list[int]
+    :param series: The label and y values of every line.
+    :type series: list[tuple[str, list[int | float]]]
+    :param ylabel: The label of the y axis, if any.
+    :type ylabel: str | None
+    :param title: The title of the graph, if any.
+    :type title: str | None
+    :return: The HTML for 'embed', or the PNG data for 'image'.
+    :rtype: str | bytes
+    """
+
+    if plt is None:
+        raise ValueError("matplotlib is not installed, graphs cannot be used")
+
+    fig, ax = plt.subplots()
+    match graph_type:
+        case "plot":
+            func = ax.plot
+        case "scatter":
+            func = ax.scatter
+        case "bar":
+            func = ax.bar
+        case "stem":
+            func = ax.stem
+        case a:
+            raise TypeError(f"Could not understand graph type {a}")
+
+    if display_type != "embed":
+        for num in ends:
+            plt.axvline(num, color="black", linestyle="dashed")
+
+    for label, d in series:
+        func(floors, d, label=label)
+    ax.legend()
+
+    plt.xlabel("Floor")
+    if ylabel is not None:
+        plt.ylabel(ylabel)
+    plt.xlim(left=0)
+    plt.ylim(bottom=0)
+    if title is not None: # doesn't appear to work with mpld3
+        plt.suptitle(title)
+
+    match display_type:
+        case "embed":
+            if fig_to_html is None:
+                plt.close(fig)
+                raise ValueError("mpld3 isn't installed, cannot embed graphs. Use 'image' display type")
+            value: str = fig_to_html(fig)
+            plt.close(fig)
+            return value
+
+        case "image":
+            with io.BytesIO() as file:
+                plt.savefig(file, format="png", transparent=True)
+                plt.close(fig)
+                return file.getvalue()
+
+class GraphCache:
+    """Hold rendered graphs, in least-recently used order, up to a total size."""
+
+    def __init__(self, max_size: int, path: str | None = None, max_disk_size: int = 0):
+        self.max_size = max_size #: Total size of the graphs to keep, in bytes. 0 means no limit.
+        self.size = 0
+        self.path = path #: Where to keep the persistent graphs, if anywhere.
+        self.max_disk_size = max_disk_size #: Total size of the graphs to keep on disk, in bytes. 0 means no limit.
+        self.disk_size = 0
+        self.hits = 0
+        self.disk_hits = 0 #: How many of the hits were read from disk.
+        self.misses = 0
+        self.renders = 0 #: How many graphs were actually rendered (misses minus coalesced requests).
+        self._graphs: OrderedDict[Hashable, str | bytes] = OrderedDict()
+        self._pending: dict[Hashable, asyncio.Task] = {}
+        self._disk: OrderedDict[str, tuple[str, int]] = OrderedDict() # digest -> (filename, size), oldest first
+
+    def __len__(self) -> int:
+        return len(self._graphs)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._graphs
+
+    def __str__(self) -> str:
+        return (f"{len(self)} graphs ({self.size} bytes) cached, {len(self._disk)} on disk ({self.disk_size} bytes), "
+                f"{self.hits} hits ({self.disk_hits} from disk), {self.misses} misses, {self.renders} renders")
+
+    def get(self, key: Hashable) -> str | bytes | None:
+        value = self._graphs.get(key)
+        if value is not None:
+            self._graphs.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: str | bytes):
+        if (old := self._graphs.pop(key, None)) is not None:
+            self.size -= len(old)
+        self._graphs[key] = value
+        self.size += len(value)
+        while self.max_size and self.size > self.max_size and len(self._graphs) > 1:
+            _, old = self._graphs.popitem(last=False)
+            self.size -= len(old)
+
+    def load_disk(self):
+        """Find the graphs already on disk, and remove the oldest ones if there are too many."""
+        self._disk.clear()
+        self.disk_size = 0
+        if self.path is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.path):
+            digest, ext = os.path.splitext(entry.name)
+            if ext in (".html", ".png") and entry.is_file():
+                st = entry.stat()
+                files.append((st.st_mtime, digest, entry.name, st.st_size))
+            elif ext == ".tmp": # left over from a crash
+                os.remove(entry.path)
+        for _, digest, name, size in sorted(files):
+            self._disk[digest] = (name, size)
+            self.disk_size += size
+        self._prune_disk()
+
+    def _prune_disk(self):
+        while self.max_disk_size and self.disk_size > self.max_disk_size and self._disk:
+            _, (name, size) = self._disk.popitem(last=False)
+            self.disk_size -= size
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _digest(key: Hashable) -> str:
+        # the key is made of strings, numbers and tuples of them, so its repr is stable across restarts
+        return hashlib.blake2b(repr((_DISK_VERSION, key)).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _read(self, name: str) -> str | bytes:
+        with open(os.path.join(self.path, name), "rb") as f:
+            value = f.read()
+        if name.endswith(".html"):
+            return value.decode("utf-8")
+        return value
+
+    def _write(self, name: str, value: str | bytes):
+        path = os.path.join(self.path, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(value.encode("utf-8") if isinstance(value, str) else value)
+        os.replace(path + ".tmp", path)
+
+    async def _get_disk(self, key: Hashable) -> str | bytes | None:
+        if self.path is None or (entry := self._disk.get(digest := self._digest(key))) is None:
+            return None
+        try:
+            value = await asyncio.to_thread(self._read, entry[0])
+        except OSError:
+            self._disk.pop(digest, None)
+            self.disk_size -= entry[1]
+            return None
+        self._disk.move_to_end(digest)
+        return value
+
+    async def _put_disk(self, key: Hashable, value: str | bytes):
+        if self.path is None:
+            return
+        digest = self._digest(key)
+        name = digest + (".html" if isinstance(value, str) else ".png")
+        try:
+            await asyncio.to_thread(self._write, name, value)
+        except OSError:
+            return
+        if (old := self._disk.pop(digest, None)) is not None:
+            self.disk_size -= old[1]
+        self._disk[digest] = (name, len(value))
+        self.disk_size += len(value)
+        self._prune_disk()
+
+    async def fetch(self, key: Hashable, func: Callable[..., str | bytes], get_args: Callable[[], tuple], *, persist: bool = False) -> str | bytes:
+        """Return the cached graph, or render it with func(*get_args()) off the event loop.
+
+        get_args is only called if the graph needs to be rendered. If the
+        same graph is already being rendered, wait for that instead. The
+        render goes on even if the caller which started it is cancelled, so
+        the others still get it. If persist is True, the graph is also kept
+        on disk; this must only be used for data which never changes."""
+        if (value := self.get(key)) is not None:
+            self.hits += 1
+            return value
+        if (task := self._pending.get(key)) is not None:
+            self.misses += 1
+        else:
+            task = self._pending[key] = asyncio.get_running_loop().create_task(self._fetch(key, func, get_args, persist))
+            # the waiters (if any) get the exception; don't warn if there are none
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: Hashable, func: Callable[..., str | bytes], get_args: Callable[[], tuple], persist: bool) -> str | bytes:
+        try:
+            if persist and (value := await self._get_disk(key)) is not None:
+                self.hits += 1
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                args = get_args()
+                self.renders += 1
+                value = await _run(func, *args)
+                if persist:
+                    await self._put_disk(key, value)
+            self.put(key, value)
+            return value
+        finally:
+            del self._pending[key]
+
+_pool: Executor | None = None
+
+def _start_pool(workers: int) -> Executor:
+    if workers <= 0 or "fork" not in multiprocessing.get_all_start_methods():
+        # pyplot isn't thread-safe, so only ever use one thread
+        return ThreadPoolExecutor(1, thread_name_prefix="graphs")
+    # starting the workers with spawn would re-run the main script in each
+    # of them, so fork them now, while the server is still starting up
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+    pool.submit(int) # this starts all of the workers
+    return pool
+
+def configure(workers: int, max_megabytes: int, path: str | None = None, max_disk_megabytes: int = 0):
+    """Start the graph workers and set how big the cache is.
+
+    With 0 workers, or if processes can't be forked, graphs are rendered in
+    a single background thread instead. If a path is given, the graphs of
+    finished runs are kept there."""
+    global _pool
+    _cache.max_size = max_megabytes * 1_000_000
+    _cache.path = path
+    _cache.max_disk_size = max_disk_megabytes * 1_000_000
+    _cache.load_disk()
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+    _pool = _start_pool(workers)
+
+async def _run(func: Callable[..., str | bytes], *args: Any) -> str | bytes:
+    global _pool
+    if _pool is None: # not configured yet
+        _pool = ThreadPoolExecutor(1, thread_name_prefix="graphs")
+    pool = _pool
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # a worker died (e.g. it ran out of memory), and the pool can't be used
+        # anymore. forking a new one from the running server could deadlock it
+        # (see above), so render in the background thread from now on. this
+        # graph isn't tried again, as it may be what killed the worker
+        if _pool is pool:
+            pool.shutdown(wait=False)
+            _pool = _start_pool(0)
+        raise
+
+_cache = GraphCache(0)
+
+def get_graph_cache() -> GraphCache:
+    """Return the shared graph cache."""
+    return _cache
+
+async def get_graph(key: Hashable, get_args: Callable[[], tuple], *, persist: bool = False) -> str | bytes:
+    """Return a graph, rendering it in the worker pool if it's not cached.
+
+    get_args returns the arguments for :func:`render`, and is only called on
+    a cache miss. Graphs of finished runs should be persisted to disk."""
+    return await _cache.fetch(key, render, get_args, persist=persist)
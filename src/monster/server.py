@@ -8,6 +8,7 @@ from aiohttp.web import Request, Response, HTTPServiceUnavailable, FileField
 from src.monster.static import get, get_safe, Challenge, Mutator, Artifact, Character
 from src.webpage import router
 from src.utils import get_req_data
+from src.sync import sync_section
 
 from src.typehints import ContextType
 
@@ -85,14 +86,18 @@ async def get_savefile(ctx: ContextType | None = None) -> MonsterSave:
         await ctx.reply("Not in a run.")
 
 
-@router.post("/sync/monster")
-async def get_data(req: Request):
-    save = (await get_req_data(req, "save"))[0]
+@sync_section("monster")
+async def update_save(save: str):
     data = json.loads(save)
     _savefile.update_data(data)
     with open(os.path.join("data", "monster-train-save.json"), "w") as f:
         json.dump(data, f, indent=config.server.json_indent)
 
+@router.post("/sync/monster")
+async def get_data(req: Request):
+    save = (await get_req_data(req, "save"))[0]
+    await update_save(save)
+
     # handle database stuff
     post = await req.post()
 
@@ -109,14 +114,18 @@ async def get_data(req: Request):
 
     return Response()
 
-@router.post("/sync/monster-2")
-async def get_data(req: Request):
-    save = (await get_req_data(req, "save"))[0]
+@sync_section("monster-2")
+async def update_save2(save: str):
     data = json.loads(save)
     _save2.update_data(data)
     with open(os.path.join("data", "monster-train-2-save.json"), "w") as f:
         json.dump(data, f, indent=config.server.json_indent)
 
+@router.post("/sync/monster-2")
+async def get_data(req: Request):
+    save = (await get_req_data(req, "save"))[0]
+    await update_save2(save)
+
     # handle database stuff
     post = await req.post()
 
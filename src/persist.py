@@ -0,0 +1,136 @@
+"""Write the JSON files in the data folder in the background.
+
+Some of these files are rewritten far more often than they need to be; the
+live savefile is written every time the game saves, and data.json every time
+a command is used. Each file gets a :class:`Persister` instead: callers mark
+it as changed, and it is written at most once every few seconds, off the
+event loop, and once more at shutdown. The data is only gathered when the
+file is written, so many changes in a row result in a single write.
+
+The file is first written next to the old one and then renamed over it, so
+that a crash (or a full disk) never leaves a half-written file behind.
+
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable
+
+import asyncio
+import json
+import os
+
+from src.logger import logger
+from src.config import config
+
+__all__ = ["Persister", "persister", "flush_all"]
+
+def _write(path: str, text: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class Persister:
+    """Keep one JSON file up to date with some data, writing it behind."""
+
+    def __init__(self, path: str, get_data: Callable[[], Any], interval: float | None = None):
+        """Create a new persister. Nothing is written until :meth:`mark` is called.
+
+        :param path: The file to write.
+        :type path: str
+        :param get_data: A function which returns what to write in the file. It is called on the event loop.
+        :type get_data: Callable[[], Any]
+        :param interval: How long to wait for more changes before writing, in seconds. Defaults to the config value.
+        :type interval: float | None
+        """
+
+        self.path = path
+        self.get_data = get_data
+        self.interval = interval
+        self.marks = 0 #: How many times the data was marked as changed.
+        self.writes = 0 #: How many times the file was actually written.
+        self._dirty = False
+        self._handle: asyncio.TimerHandle | None = None
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def __str__(self) -> str:
+        return f"{self.path}: {self.marks} changes, {self.writes} writes"
+
+    @property
+    def dirty(self) -> bool:
+        """Whether there are changes which aren't written yet."""
+        return self._dirty
+
+    def _dump(self) -> str:
+        return json.dumps(self.get_data(), indent=config.server.json_indent)
+
+    def mark(self):
+        """Mark the data as changed, and schedule a write.
+
+        Without a running event loop, the file is written immediately."""
+        self.marks += 1
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError: # called from synchronous code, e.g. a migration
+            self.write()
+            return
+        if self._handle is None:
+            interval = self.interval
+            if interval is None:
+                interval = config.server.persist_interval
+            self._handle = loop.call_later(interval, self._start)
+
+    def _start(self):
+        self._handle = None
+        self._task = asyncio.get_running_loop().create_task(self.flush())
+
+    def write(self):
+        """Write the file now, blocking. Prefer :meth:`flush` if possible."""
+        self._dirty = False
+        _write(self.path, self._dump())
+        self.writes += 1
+
+    async def flush(self):
+        """Write the file now if it changed, without blocking the event loop."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        async with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            # the data can change as soon as we yield, so serialize it here
+            text = self._dump()
+            try:
+                await asyncio.to_thread(_write, self.path, text)
+            except Exception:
+                logger.exception(f"Could not write {self.path}, trying again on the next change")
+                self._dirty = True
+            else:
+                self.writes += 1
+
+_persisters: dict[str, Persister] = {}
+
+def persister(name: str, get_data: Callable[[], Any]) -> Persister:
+    """Return a persister for a file in the data folder.
+
+    :param name: The file name, relative to the data folder.
+    :type name: str
+    :param get_data: A function which returns what to write in the file.
+    :type get_data: Callable[[], Any]
+    :return: The persister for this file.
+    :rtype: Persister
+    """
+
+    if name not in _persisters:
+        _persisters[name] = Persister(os.path.join("data", name), get_data)
+    return _persisters[name]
+
+async def flush_all():
+    """Write every file which has pending changes. Called at shutdown."""
+    await asyncio.gather(*(p.flush() for p in _persisters.values()))
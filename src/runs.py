@@ -1,7 +1,11 @@
 from __future__ import annotations
 
-from typing import Any, NamedTuple, TYPE_CHECKING
+from typing import Any, AsyncIterable, AsyncIterator, NamedTuple, TYPE_CHECKING
 
+from concurrent.futures import ProcessPoolExecutor
+
+import multiprocessing
+import asyncio
 import datetime
 import json
 import time
@@ -16,57 +20,192 @@ from response_objects.profiles import ProfilesResponse
 
 from src.cache.run_stats import update_all_run_stats
 from src.cache.cache_helpers import RunLinkedListNode
+from src.cache.run_index import ProfileIndex, StreakBlock, get_index, get_indexes, get_newest_index
+from src.cache.run_summary import RunSummary, get_store
+from src.cache.loaded_runs import get_loaded_runs
+from src.cache.run_columns import get_columns
+from src.cache.run_analytics import RunAnalytics, get_analytics, save_analytics, count_analytics
+from src.cache.item_index import ItemIndex, get_item_index
 from src.cache.mastered import update_mastery_stats
+from src.cache.page_cache import get_page_cache
 from src.cache.streaks import update_streak_collections
 from src.sts_profile import get_profile
 from src.gamedata2 import FileParser as FP2
-from src.gamedata import FileParser, KeysObtained, _enemies
+from src.gamedata import FileParser, KeysObtained, NeowBonus, _enemies
+from src.floor_series import FloorSeries, PackedSeries, average
+from src.nameinternal import get, query, Relic
 from src.webpage import router
 from src.logger import logger
 from src.events import add_listener
-from src.utils import convert_class_to_obj, get_req_data
+from src.utils import convert_class_to_obj, check_key, get_req_data
 from src.activemods import ActiveMods, ActiveMod, ACTIVEMODS_KEY
+from src.config import config
 
 if TYPE_CHECKING:
     from src.archive import VOD
 
-__all__ = ["get_latest_run", "get_parser", "RunParser", "StreakInfo"]
+__all__ = ["get_latest_run", "get_run_analytics", "get_run_items", "get_parser", "RunParser", "StreakInfo"]
 
 _cache: dict[str, RunParser | Run2Parser] = {}
 _ts_cache: dict[int, RunParser | Run2Parser] = {}
+_names: dict[str, RunParser | Run2Parser] = {}
+
+# names which were looked up and not found, with the time until which we trust that
+_missing: dict[str, float] = {}
+_MISSING_TTL = 30 # seconds
+_MISSING_MAX = 4096
+
+# below this many files to parse, a process pool isn't worth starting
+_BULK_MIN = 500
+_COMPARE_SHOWN = 50 # how many of the matching runs are listed on the compare page
+_BULK_CHUNK = 250
+
+# runs which were linked, but are not yet in the stats or saved in the summary index
+_uncommitted: list[RunParser | Run2Parser] = []
+_commit_handle: asyncio.TimerHandle | None = None
+_COMMIT_DELAY = 2 # seconds; runs synced within this window are committed together
 
-def get_latest_run(character: str | None, victory: bool | None) -> RunParser:
+def get_latest_run(character: str | None, victory: bool | None) -> RunParser | Run2Parser | None:
+    """Return the latest run matching the character and outcome, if any.
+
+    This only looks at the profile (and game) of the most recent run."""
     _update_cache()
-    if not _ts_cache:
+    index = get_newest_index()
+    if index is None:
         return None
-    latest = _ts_cache[max(_ts_cache)]
-    is_character_specific = False
-    if character is not None:
-        is_character_specific = True
-        while latest.character != character:
-            latest = latest.matched.prev
-
-    if victory is not None:
-        if victory:
-            while not latest.won:
-                latest = latest.matched.get_run(is_prev=True, is_character_specific=is_character_specific)
+    return index.latest(character, victory)
+
+class _StoredRun:
+    """Serve the most common run fields from a summary, and load the file on demand.
+
+    Run parsers may be created from either the parsed data or a stored
+    :class:`RunSummary`. In the latter case, the run file is only read
+    the first time something outside the summary is needed. Only the most
+    recently used runs keep their data; see :mod:`src.cache.loaded_runs`."""
+
+    _folder: str
+
+    def __init__(self, filename: str, profile: int, data: dict[str, Any] | None, summary: RunSummary | None):
+        if data is None and summary is None:
+            raise ValueError("Run parsers need either the run data or a summary")
+        self._raw = data
+        self._summary = summary
+        self._filepath = os.path.join("data", self._folder, str(profile), filename)
+        super().__init__(data)
+
+    @property
+    def _data(self) -> dict[str, Any]:
+        loaded = get_loaded_runs()
+        if self._raw is None:
+            loaded.misses += 1
+            with open(self._filepath) as f:
+                self._raw = json.load(f)
+                loaded.add(self, os.fstat(f.fileno()).st_size)
         else:
-            while latest.won:
-                latest = latest.matched.get_run(is_prev=True, is_character_specific=is_character_specific)
+            loaded.hit(self)
+        return self._raw
+
+    @_data.setter
+    def _data(self, value: dict[str, Any] | None):
+        self._raw = value
+        if value is not None:
+            try:
+                size = os.path.getsize(self._filepath)
+            except OSError: # not on disk, so we can't read it back later
+                return
+            get_loaded_runs().add(self, size)
+
+    def read_data(self) -> dict[str, Any]:
+        """Return the run data, reading the file if it isn't loaded, without keeping it loaded.
+
+        Unlike the data itself, this can be used from a worker thread."""
+        data = self._raw
+        if data is None:
+            with open(self._filepath) as f:
+                data = json.load(f)
+        return data
+
+    def unload(self):
+        """Drop the run data and anything built from it. It will be read again from disk if needed."""
+        self.summary # make sure we have it first
+        self._raw = None
+        get_loaded_runs().discard(self)
+
+    @property
+    def summary(self) -> RunSummary:
+        """The fields of this run which are kept in the run summary index."""
+        if self._summary is None:
+            self._summary = self._summarize()
+        return self._summary
+
+    def _summarize(self) -> RunSummary:
+        raise NotImplementedError
+
+    @property
+    def epoch(self) -> int:
+        """Time in seconds since Jan 1, 1970."""
+        return self.summary.epoch
+
+    @property
+    def character(self) -> str:
+        return self.summary.character
+
+    @property
+    def won(self) -> bool:
+        return self.summary.won
+
+    @property
+    def ascension_level(self) -> int:
+        return self.summary.ascension
+
+    @property
+    def floor_reached(self) -> int:
+        return self.summary.floor_reached
+
+    @property
+    def killed_by(self) -> str | None:
+        return self.summary.killed_by
+
+    @property
+    def seed(self) -> str:
+        return self.summary.seed
 
-    return latest
+    @property
+    def playtime(self) -> int:
+        return self.summary.playtime
+
+    @property
+    def modifiers(self) -> list:
+        return list(self.summary.modifiers)
+
+    @property
+    def character_streak(self) -> StreakInfo:
+        return _streak_info(self._character_streak)
+
+    @property
+    def rotating_streak(self) -> StreakInfo:
+        return _streak_info(self._rotating_streak)
 
-class RunParser(FileParser):
+    @property
+    def run_length(self) -> str:
+        seconds = self.playtime
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        if hours:
+            return f"{hours}:{minutes:>02}:{seconds:>02}"
+        return f"{minutes:>02}:{seconds:>02}"
+
+class RunParser(_StoredRun, FileParser):
     done = True
-    def __init__(self, filename: str, profile: int, data: dict[str, Any]):
+    _folder = "runs"
+    def __init__(self, filename: str, profile: int, data: dict[str, Any] | None = None, *, summary: RunSummary | None = None):
         if filename in _cache:
             raise RuntimeError(f"Created duplicate run parser with name {filename}")
-        super().__init__(data)
+        super().__init__(filename, profile, data, summary)
         self.filename = filename
         self.name, _, ext = filename.partition(".")
         self.matched = RunLinkedListNode()
         self.vod: VOD = None
-        self._character = data["character_chosen"]
         self._profile = profile
         self._character_streak = None
         self._rotating_streak = None
@@ -75,6 +214,12 @@ class RunParser(FileParser):
     def __repr__(self):
         return f"Run<{self.display_name}>"
 
+    def unload(self):
+        super().unload()
+        self.neow_bonus = NeowBonus(self)
+        self._cache = {"self": self}
+        self._activemods = None
+
     @property
     def has_archive_link(self) -> bool:
         """Whether we have a (timestamped or not) link to an archive video."""
@@ -99,10 +244,38 @@ class RunParser(FileParser):
     def profile(self):
         return get_profile(self._profile, 1)
 
-    @property
-    def epoch(self) -> int:
-        """Time in seconds since Jan 1, 1970."""
-        return self._data["timestamp"]
+    def _summarize(self) -> RunSummary:
+        data = self._data
+        self._character = data["character_chosen"]
+        killer = data.get("killed_by")
+        return RunSummary(
+            epoch=data["timestamp"],
+            character=FileParser.character.fget(self),
+            won=data["victory"],
+            ascension=data["ascension_level"],
+            floor_reached=int(data["floor_reached"]),
+            score=int(data["score"]),
+            killed_by=_enemies.get(killer, killer),
+            seed=FileParser.seed.fget(self),
+            playtime=data["playtime"],
+            modifiers=tuple(data.get("daily_mods", ())),
+            relics=tuple(data["relics"]),
+            master_deck=tuple(data["master_deck"]),
+        )
+
+    @property
+    def floor_series(self) -> FloorSeries | None:
+        series = FileParser.floor_series.fget(self)
+        if series is not None and self.summary.floor_values is None:
+            # keep what the compare page needs, so it can use this run without loading it again
+            self._summary = self.summary._replace(floor_values=series.pack())
+            try:
+                st = os.stat(self._filepath)
+            except OSError:
+                pass
+            else:
+                get_store().put(self._filepath, st, self._summary)
+        return series
 
     @property
     def timestamp(self) -> datetime.datetime:
@@ -140,26 +313,17 @@ class RunParser(FileParser):
 
     @property
     def _master_deck(self) -> list[str]:
-        return list(self._data["master_deck"])
+        return list(self.summary.master_deck)
 
     @property
-    def won(self) -> bool:
-        return self._data["victory"]
+    def relics_bare(self) -> list[Relic]:
+        return [get(x) for x in self.summary.relics]
 
     @property
     def verb(self) -> str:
         return "victory" if self.won else "loss"
 
-    @property
-    def killed_by(self) -> str | None:
-        killer = self._data.get("killed_by")
-        return _enemies.get(killer, killer)
-
-    @property
-    def floor_reached(self) -> int:
-        return int(self._data["floor_reached"])
-
-    floor = floor_reached
+    floor = _StoredRun.floor_reached
 
     @property
     def acts_beaten(self) -> int:
@@ -172,70 +336,12 @@ class RunParser(FileParser):
 
     @property
     def score(self) -> int:
-        return int(self._data["score"])
+        return self.summary.score
 
     @property
     def score_breakdown(self) -> list[str]:
         return self._data.get("score_breakdown", [])
 
-    @property
-    def run_length(self) -> str:
-        seconds = self._data["playtime"]
-        minutes, seconds = divmod(seconds, 60)
-        hours, minutes = divmod(minutes, 60)
-        if hours:
-            return f"{hours}:{minutes:>02}:{seconds:>02}"
-        return f"{minutes:>02}:{seconds:>02}"
-
-    @property
-    def character_streak(self) -> StreakInfo:
-        streak = self._character_streak
-        if streak is None:
-            streak = self._get_streak(is_character_streak=True)
-            if not streak.is_ongoing:
-                self._character_streak = streak
-        return streak
-
-    @property
-    def rotating_streak(self) -> StreakInfo:
-        streak = self._rotating_streak
-        if streak is None:
-            streak = self._get_streak(is_character_streak=False)
-            if not streak.is_ongoing:
-                self._rotating_streak = streak
-        return streak
-
-    def _get_streak(self, *, is_character_streak: bool) -> StreakInfo:
-        if self.won:
-            streak_total = 1
-            position_in_streak = 1
-            is_ongoing = True
-
-            def loop_cached_runs(*, is_prev: bool):
-                nonlocal streak_total, position_in_streak, is_ongoing
-                current_run: RunParser = self.matched.get_run(is_prev=is_prev, is_character_specific=is_character_streak)
-                if current_run is not None:
-                    last_char = self.character
-                    while current_run.won:
-                        # If rotating, only iterate if not same char
-                        if is_character_streak or current_run.character != last_char:
-                            streak_total += 1
-                            # only iterate the position if the Win came before the current run
-                            if is_prev:
-                                position_in_streak += 1
-
-                        if (run := current_run.matched.get_run(is_prev=is_prev, is_character_specific=is_character_streak)) is not None:
-                            last_char = current_run.character
-                            current_run = run
-                        else:
-                            break
-                    does_upcoming_loss_exist = not is_prev and not current_run.won
-                    if does_upcoming_loss_exist:
-                        is_ongoing = False
-            loop_cached_runs(is_prev=True)
-            loop_cached_runs(is_prev=False)
-            return StreakInfo(streak_total, position_in_streak, is_ongoing)
-        return StreakInfo(0, 0, False)
 
     @property
     def has_activemods(self) -> bool:
@@ -255,10 +361,11 @@ class RunParser(FileParser):
     def mods(self) -> list[ActiveMod]:
         return self.activemods.all_mods
 
-class Run2Parser(FP2):
+class Run2Parser(_StoredRun, FP2):
     done = True
-    def __init__(self, filename: str, profile: int, data: dict):
-        super().__init__(data)
+    _folder = "runs2"
+    def __init__(self, filename: str, profile: int, data: dict | None = None, *, summary: RunSummary | None = None):
+        super().__init__(filename, profile, data, summary)
         self.matched = RunLinkedListNode()
         self.filename = filename
         self.name, _, ext = filename.partition(".")
@@ -270,22 +377,38 @@ class Run2Parser(FP2):
     def __repr__(self):
         return f"Run2<{self.display_name}>"
 
-    @property
-    def floor_reached(self):
-        return len(self.path)
-
-    @property
-    def killed_by(self) -> str | None:
-        key1: str = self._data["killed_by_encounter"]
-        key2: str = self._data["killed_by_event"]
-        res = None
-        for key in (key1, key2):
+    def _summarize(self) -> RunSummary:
+        data = self._data
+        killed_by = None # could stay None, in which case this shouldn't even get used
+        for key in (data["killed_by_encounter"], data["killed_by_event"]):
             ktype, _, spec = key.partition(".")
             if ktype == "NONE":
                 continue # nothing happened, so who cares
-            res = spec.replace("_", " ").title()
-
-        return res # could be None, in which case this shouldn't even get called
+            killed_by = spec.replace("_", " ").title()
+
+        player = self.get_main_player()
+        deck = []
+        for card in player._data["deck"]:
+            name = card["id"].partition(".")[2]
+            if (upgrades := card.get("current_upgrade_level")):
+                name = f"{name}+{upgrades}"
+            deck.append(name)
+
+        return RunSummary(
+            epoch=data["start_time"] + data["run_time"],
+            character=player.character,
+            won=data["win"],
+            ascension=data["ascension"],
+            # same as len(self.path), without building every node
+            floor_reached=sum(len(x) for x, _ in zip(data.get("map_point_history", ()), data["acts"])),
+            score=None,
+            killed_by=killed_by,
+            seed=FP2.seed.fget(self),
+            playtime=data["run_time"],
+            modifiers=tuple(data["modifiers"]),
+            relics=tuple(x["id"].partition(".")[2] for x in player._data["relics"]),
+            master_deck=tuple(deck),
+        )
 
     @property
     def has_archive_link(self) -> bool:
@@ -303,84 +426,18 @@ class Run2Parser(FP2):
             if run.run is self:
                 return run.get_url()
 
-    @property
-    def run_length(self) -> str:
-        seconds = self._data["run_time"]
-        minutes, seconds = divmod(seconds, 60)
-        hours, minutes = divmod(minutes, 60)
-        if hours:
-            return f"{hours}:{minutes:>02}:{seconds:>02}"
-        return f"{minutes:>02}:{seconds:>02}"
-
     @property
     def profile(self):
         return get_profile(self._profile, 2)
 
-    @property
-    def character(self):
-        return self.get_main_player().character
-
     @property
     def display_name(self) -> str:
         return f"({self.character} {self.verb}) {self.timestamp}"
 
-    @property
-    def won(self) -> bool:
-        return self._data["win"]
-
     @property
     def verb(self) -> str:
         return "victory" if self.won else "loss"
 
-    @property
-    def character_streak(self) -> StreakInfo:
-        streak = self._character_streak
-        if streak is None:
-            streak = self._get_streak(is_character_streak=True)
-            if not streak.is_ongoing:
-                self._character_streak = streak
-        return streak
-
-    @property
-    def rotating_streak(self) -> StreakInfo:
-        streak = self._rotating_streak
-        if streak is None:
-            streak = self._get_streak(is_character_streak=False)
-            if not streak.is_ongoing:
-                self._rotating_streak = streak
-        return streak
-
-    def _get_streak(self, *, is_character_streak: bool) -> StreakInfo:
-        if self.won:
-            streak_total = 1
-            position_in_streak = 1
-            is_ongoing = True
-
-            def loop_cached_runs(*, is_prev: bool):
-                nonlocal streak_total, position_in_streak, is_ongoing
-                current_run: Run2Parser = self.matched.get_run(is_prev=is_prev, is_character_specific=is_character_streak)
-                if current_run is not None:
-                    last_char = self.character
-                    while current_run.won:
-                        # If rotating, only iterate if not same char
-                        if is_character_streak or current_run.character != last_char:
-                            streak_total += 1
-                            # only iterate the position if the Win came before the current run
-                            if is_prev:
-                                position_in_streak += 1
-
-                        if (run := current_run.matched.get_run(is_prev=is_prev, is_character_specific=is_character_streak)) is not None:
-                            last_char = current_run.character
-                            current_run = run
-                        else:
-                            break
-                    does_upcoming_loss_exist = not is_prev and not current_run.won
-                    if does_upcoming_loss_exist:
-                        is_ongoing = False
-            loop_cached_runs(is_prev=True)
-            loop_cached_runs(is_prev=False)
-            return StreakInfo(streak_total, position_in_streak, is_ongoing)
-        return StreakInfo(0, 0, False)
 
 class StreakInfo(NamedTuple):
     """Contain run streak information."""
@@ -388,6 +445,13 @@ class StreakInfo(NamedTuple):
     position: int
     is_ongoing: bool
 
+def _streak_info(value: tuple[StreakBlock, int] | None) -> StreakInfo:
+    # runs get stamped with their streak when they're linked in the run index
+    if value is None:
+        return StreakInfo(0, 0, False)
+    block, position = value
+    return StreakInfo(block.streak, position, block.is_ongoing)
+
 @add_listener("setup_init")
 async def _setup_cache():
     for i in range(3):
@@ -395,68 +459,115 @@ async def _setup_cache():
     for i in range(3):
         os.makedirs(os.path.join("data", "runs2", str(i+1)), exist_ok=True)
     _update_cache()
+    # without a saved copy, every run has to be read for the analytics
+    await count_analytics()
+
+def _add_parser(parser: RunParser | Run2Parser):
+    _cache[parser.filename] = parser
+    _ts_cache[parser.epoch] = parser
+    _names[parser.name] = parser
+    _missing.pop(parser.name, None)
+    if (columns := get_columns()) is not None:
+        columns.add(parser)
+    get_analytics(parser.game_version, parser._profile).add(parser)
+    get_item_index(parser.game_version, parser._profile).add(parser)
+
+def _summarize_files(game: int, profile: int, files: list[str]) -> list[RunSummary]:
+    """Parse run files and return their summaries. This runs in worker processes."""
+    cls = RunParser if game == 1 else Run2Parser
+    ret = []
+    for file in files:
+        with open(os.path.join("data", cls._folder, str(profile), file)) as f:
+            parser = cls(file, profile, json.load(f))
+        parser.unload()
+        ret.append(parser.summary)
+    return ret
+
+def _bulk_summarize(pending: list[tuple[ProfileIndex, str]]) -> list[RunSummary]:
+    """Summarize run files, in a process pool if there are enough of them."""
+    workers = config.server.ingest_workers or os.cpu_count() or 1
+    # workers need our loaded config and caches, so this only works when forking
+    if workers == 1 or len(pending) < _BULK_MIN or "fork" not in multiprocessing.get_all_start_methods():
+        ret = []
+        for index, file in pending:
+            ret.extend(_summarize_files(index.game, index.profile, [file]))
+        return ret
+
+    chunks = []
+    for i in range(0, len(pending), _BULK_CHUNK):
+        chunk = pending[i:i+_BULK_CHUNK]
+        # chunks may straddle folders; split them so each call has one game and profile
+        for index in dict.fromkeys(x[0] for x in chunk):
+            chunks.append((index.game, index.profile, [file for idx, file in chunk if idx is index]))
+
+    logger.info(f"Parsing {len(pending)} run files with {workers} processes")
+    ret = []
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as pool:
+        for summaries in pool.map(_summarize_files, *zip(*chunks)):
+            ret.extend(summaries)
+    return ret
 
 def _update_cache():
     start = time.time()
-    for i in range(2):
-        _pf = "runs"
-        cls = RunParser
-        if i == 1:
-            _pf = "runs2"
-            cls = Run2Parser
-        for path, folders, files in os.walk(os.path.join("data", _pf)):
-            for folder in folders:
-                profile = int(folder)
-                _cur_cache: dict[int, RunParser | Run2Parser] = {}
-                for p1, d1, f1 in os.walk(os.path.join(path, folder)):
-                    for file in f1:
-                        if file in _cache:
-                            parser = _cache[file]
-                        else:
-                            with open(os.path.join(p1, file)) as f:
-                                _cache[file] = parser = cls(file, profile, json.load(f))
-                                _ts_cache[parser.epoch] = parser
-                        _cur_cache[parser.epoch] = parser
-
-                prev = None
-                prev_char: dict[str, RunParser | Run2Parser | None] = {}
-                prev_win = None
-                prev_loss = None
-
-                for t in sorted(_cur_cache):
-                    cur = _cur_cache[t]
-                    if prev is not None:
-                        if cur.matched.prev is None:
-                            prev.matched.next = cur
-                            cur.matched.prev = prev
-                        if cur.character not in prev_char:
-                            prev_char[cur.character] = None
-                        if cur.matched.prev_char is None and (c := prev_char[cur.character]) is not None:
-                            c.matched.next_char = cur
-                            cur.matched.prev_char = c
-                        prev_char[cur.character] = cur
-                        if cur.won:
-                            if cur.matched.prev_win is None and prev_win is not None:
-                                prev_win.matched.next_win = cur
-                                cur.matched.prev_win = prev_win
-                            prev_win = cur
-                        else:
-                            if cur.matched.prev_loss is None and prev_loss is not None:
-                                prev_loss.matched.next_loss = cur
-                                cur.matched.prev_loss = prev_loss
-                            prev_loss = cur
-                    prev = cur
-
-    update_all_run_stats()
-    update_mastery_stats()
-    update_streak_collections()
-
-    # I don't actually know how long this cache updating is going to take...
-    # I think it's as optimized as I could make it while still being safe,
-    # but it's possible it still takes some time. I'm not going to focus on
-    # that for now, but logging the update time everytime, in case it turns
-    # out to be a bottleneck. We only want to actually update new runs.
-    logger.info(f"Updated run parser cache in {time.time() - start}s")
+    store = get_store()
+    new: dict[ProfileIndex, list[RunParser | Run2Parser]] = {}
+    pending: list[tuple[ProfileIndex, str]] = []
+    stats: dict[str, os.stat_result] = {}
+    for index in get_indexes():
+        if not index.is_stale():
+            continue
+        cls = RunParser if index.game == 1 else Run2Parser
+        for file in index.scan():
+            path = os.path.join(index.path, file)
+            try:
+                st = os.stat(path)
+            except OSError: # deleted in the meantime
+                continue
+            parser = _cache.get(file)
+            if parser is None:
+                summary = store.get(path, st)
+                if summary is None: # parse these all at once, below
+                    pending.append((index, file))
+                    stats[path] = st
+                    continue
+                parser = cls(file, index.profile, summary=summary)
+                _add_parser(parser)
+            store.put(path, st, parser.summary)
+            new.setdefault(index, []).append(parser)
+
+    for (index, file), summary in zip(pending, _bulk_summarize(pending)):
+        cls = RunParser if index.game == 1 else Run2Parser
+        parser = cls(file, index.profile, summary=summary)
+        _add_parser(parser)
+        path = os.path.join(index.path, file)
+        store.put(path, stats[path], summary)
+        new.setdefault(index, []).append(parser)
+
+    if new:
+        for index, runs in new.items():
+            index.extend(runs)
+            _uncommitted.extend(runs)
+
+    if _uncommitted:
+        _commit_runs()
+        logger.info(f"Updated run parser cache in {time.time() - start}s")
+
+def _commit_runs():
+    """Save the new summaries and update the stats for all the runs linked since the last commit."""
+    global _uncommitted, _commit_handle
+    if _commit_handle is not None:
+        _commit_handle.cancel()
+        _commit_handle = None
+    if not _uncommitted:
+        return
+    new = sorted(_uncommitted, key=lambda x: x.epoch)
+    _uncommitted = []
+
+    get_store().commit()
+    save_analytics()
+    update_all_run_stats(new)
+    update_mastery_stats(new)
+    update_streak_collections(new)
 
 @router.get("/runs")
 @aiohttp_jinja2.template("runs_profile.jinja2")
@@ -476,15 +587,21 @@ async def pick_profile(req: Request):
     return convert_class_to_obj(ProfilesResponse(profiles))
 
 def get_parser(name) -> RunParser | Run2Parser | None:
-    parser = _cache.get(f"{name}.run") # most common case
+    parser = _names.get(name)
     if parser is None:
-        _update_cache()
-        parser = _cache.get(f"{name}.run") # try again, just in case
-        if parser is None: # okay, iterate through everything
-            for run_parser in _cache.values():
-                if run_parser.name == name:
-                    parser = run_parser
-                    break
+        now = time.time()
+        if _missing.get(name, 0) > now: # looked up recently, don't bother
+            return None
+        _update_cache() # this only rescans folders with new files
+        parser = _names.get(name)
+        if parser is None:
+            if len(_missing) >= _MISSING_MAX:
+                for key, until in list(_missing.items()):
+                    if until <= now:
+                        del _missing[key]
+                if len(_missing) >= _MISSING_MAX: # still too many, start over
+                    _missing.clear()
+            _missing[name] = now + _MISSING_TTL
 
     return parser
 
@@ -498,16 +615,39 @@ def _falsey(x: str | None) -> bool:
         return False
     return True
 
+def _outcome(query) -> bool | None:
+    """Return whether a query asks for only wins (True), only losses (False), or both (None).
+
+    Both are included unless the 'victory' or 'loss' param turns them off."""
+    victory = _falsey(query.get("victory"))
+    loss = _falsey(query.get("loss"))
+    if victory == loss: # turning both off is the same as leaving both on
+        return None
+    return victory
+
+def _page_state(parser: RunParser | Run2Parser) -> tuple:
+    """Return what can still change on the page of a finished run."""
+    matched = parser.matched
+    linked = tuple(x and x.name for x in (matched.prev, matched.next, matched.prev_char, matched.next_char))
+    # the header says how many days ago it was, and where it stands in its streaks
+    streaks = (parser.character_streak, parser.rotating_streak)
+    return (parser.archive_link if parser.has_archive_link else None, linked, parser.timedelta.days, streaks)
+
 @router.get("/runs/{name}")
-@aiohttp_jinja2.template("run_single.jinja2")
 async def run_single(req: Request):
     parser = get_parser(req.match_info["name"])
     if parser is None:
         raise HTTPNotFound()
     redirect = _truthy(req.query.get("redirect"))
 
-    response = RunResponse(parser, parser.matched, autorefresh=False, redirect=redirect)
-    return convert_class_to_obj(response)
+    def render() -> str:
+        response = RunResponse(parser, parser.matched, autorefresh=False, redirect=redirect)
+        return aiohttp_jinja2.render_string("run_single.jinja2", req, convert_class_to_obj(response))
+
+    if config.server.debug: # so that template changes show up right away
+        return Response(text=render(), content_type="text/html")
+
+    return await get_page_cache().respond(req, (parser.name, redirect), _page_state(parser), render)
 
 @router.get("/runs/{name}/raw")
 async def run_raw_json(req: Request) -> Response:
@@ -523,12 +663,26 @@ async def run_chart(req: Request) -> Response:
     if parser is None:
         raise HTTPNotFound()
 
-    return parser.graph(req)
+    return await parser.graph(req)
 
-#@router.get("/compare/view")
+def _resolve_items(names: list[str], known: dict) -> list[str]:
+    ret = []
+    for name in names:
+        if name not in known: # not an internal ID; try to figure out what they meant
+            item = query(name)
+            if item is not None:
+                name = item.internal
+        ret.append(name)
+    return ret
+
+@router.get("/compare/view")
 @aiohttp_jinja2.template("compare_single.jinja2")
 async def compare_runs(req: Request):
-    context = {}
+    columns = get_columns()
+    if columns is None:
+        raise HTTPNotImplemented(reason="numpy is not installed, runs cannot be compared")
+    _update_cache()
+    columns.flush() # so that the items of the newest runs can be looked up
     try:
         start = int(req.query.get("start", 0))
         end = int(req.query.get("end", time.time()))
@@ -537,35 +691,215 @@ async def compare_runs(req: Request):
         raise HTTPForbidden(reason="'start', 'end', 'score' params must be integers if present")
 
     chars = req.query.getall("character", [])
-    victory = _truthy(req.query.get("victory"))
-    loss = _falsey(req.query.get("loss"))
-    relics = req.query.getall("relic", [])
-    cards = req.query.getall("card", [])
+    relics = _resolve_items(req.query.getall("relic", []), columns.relics)
+    cards = _resolve_items(req.query.getall("card", []), columns.cards)
+
+    rows = columns.select(
+        start=start,
+        end=end,
+        min_score=score,
+        characters=chars,
+        won=_outcome(req.query),
+        relics=relics,
+        cards=cards,
+    )
+
+    shown = [columns.runs[i] for i in rows[:_COMPARE_SHOWN]]
+    series = []
+    for run in shown:
+        if not isinstance(run, RunParser):
+            continue
+        # building the path of a run takes a while, so only use the runs
+        # which already have it; their values are kept once they do
+        if run.summary.floor_values is None and "path" in run._cache:
+            run.floor_series
+        if run.summary.floor_values is not None:
+            series.append(PackedSeries(run.summary.floor_values))
+    floor_averages = {}
+    if series:
+        floor_averages = {name: average(series, name) for name in ("current_hp", "max_hp", "gold")}
+
+    return {
+        **columns.describe(rows),
+        "relics": relics,
+        "cards": cards,
+        "runs": shown,
+        "floor_averages": floor_averages,
+    }
+
+def get_run_analytics(game: int | None = None, profile: int | None = None) -> RunAnalytics | None:
+    """Return the card and relic stats of a profile, by default the one of the most recent run."""
+    _update_cache()
+    if game is None or profile is None:
+        index = get_newest_index()
+        if index is None:
+            return None
+        game, profile = index.game, index.profile
+    return get_analytics(game, profile)
+
+def get_run_items(game: int | None = None, profile: int | None = None) -> ItemIndex | None:
+    """Return the card and relic index of a profile, by default the one of the most recent run."""
+    _update_cache()
+    if game is None or profile is None:
+        index = get_newest_index()
+        if index is None:
+            return None
+        game, profile = index.game, index.profile
+    return get_item_index(game, profile)
+
+def _analytics_from_request(req: Request) -> tuple[RunAnalytics, str | None]:
+    try:
+        game = req.query.get("game")
+        profile = req.query.get("profile")
+        analytics = get_run_analytics(int(game) if game else None, int(profile) if profile else None)
+    except ValueError:
+        raise HTTPForbidden(reason="'game' and 'profile' params must be integers if present")
+    if analytics is None:
+        raise HTTPNotFound()
+    return analytics, req.query.get("character")
+
+@router.get("/analytics/{kind}")
+async def analytics_json(req: Request) -> Response:
+    analytics, character = _analytics_from_request(req)
+    stats = analytics.get(character)
+    match req.match_info["kind"]:
+        case "cards":
+            items = {k: v.as_dict(stats.wins) for k, v in stats.cards.items()}
+        case "relics":
+            items = {k: v.as_dict(stats.wins) for k, v in stats.relics.items()}
+        case "killed-by":
+            items = dict(stats.killed_by.most_common())
+        case _:
+            raise HTTPNotFound()
+
+    value = {"game": analytics.game, "profile": analytics.profile, "character": character, "runs": stats.runs, "wins": stats.wins, "items": items}
+    return Response(text=json.dumps(value, indent=4), content_type="application/json")
+
+@router.get("/analytics/{kind}/{name}")
+async def analytics_item_json(req: Request) -> Response:
+    analytics, character = _analytics_from_request(req)
+    stats = analytics.get(character)
+    match req.match_info["kind"]:
+        case "cards":
+            items = stats.cards
+        case "relics":
+            items = stats.relics
+        case _:
+            raise HTTPNotFound()
+    name = _resolve_items([req.match_info["name"]], items)[0]
+    if name not in items:
+        raise HTTPNotFound()
 
-    return context
+    value = {"game": analytics.game, "profile": analytics.profile, "character": character, "name": name, **items[name].as_dict(stats.wins)}
+    return Response(text=json.dumps(value, indent=4), content_type="application/json")
+
+def _write_run(path: str, content: str) -> tuple[dict[str, Any], os.stat_result]:
+    data = json.loads(content)
+    # so that a scan never reads a half-written file
+    with open(path + ".tmp", "w") as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
+    return data, os.stat(path)
+
+async def _store_run(content: str, name: str, profile: str, version: str) -> RunParser | Run2Parser | None:
+    """Write a received run file, and link it if it's new. Return its parser if it is."""
+    cls = RunParser if version == "1" else Run2Parser
+    path = os.path.join("data", cls._folder, profile, name)
+    index = get_index(int(version), int(profile))
+    index.incoming.add(name)
+    try:
+        data, st = await asyncio.to_thread(_write_run, path, content)
+    finally:
+        index.incoming.discard(name)
+    if name in _cache:
+        return None
+    parser = cls(name, int(profile), data)
+    _add_parser(parser)
+    get_store().put(path, st, parser.summary)
+    return parser
 
 @router.post("/sync/run")
 async def receive_run(req: Request) -> Response:
+    global _commit_handle
     content, name, profile, version = await get_req_data(req, "run", "name", "profile", "version")
 
-    if version == "1":
-        with open(os.path.join("data", "runs", profile, name), "w") as f:
-            f.write(content)
-        data = json.loads(content)
-        if name not in _cache:
-            _cache[name] = parser = RunParser(name, int(profile), data)
-            _ts_cache[parser.epoch] = parser
-            _update_cache()
-
-    elif version == "2":
-        with open(os.path.join("data", "runs2", profile, name), "w") as f:
-            f.write(content)
-        data = json.loads(content)
-        if name not in _cache:
-            _cache[name] = parser = Run2Parser(name, int(profile), data)
-            _ts_cache[parser.epoch] = parser
-            _update_cache()
+    if version in ("1", "2"):
+        if (parser := await _store_run(content, name, profile, version)) is not None:
+            # link it right away, but only update the stats once the burst of uploads is over
+            get_index(int(version), int(profile)).extend([parser])
+            _uncommitted.append(parser)
+            if _commit_handle is None:
+                _commit_handle = asyncio.get_running_loop().call_later(_COMMIT_DELAY, _commit_runs)
 
     logger.debug(f"Received run history file. Updated data. Transaction time: {time.time() - float(req.query['start'])}s")
 
     return Response()
+
+async def _ndjson_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Split a stream into its non-empty lines. Unlike readline(), lines can be of any length."""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+@router.post("/sync/runs")
+async def receive_runs(req: Request) -> Response:
+    """Receive many run files in one request, and update the stats once for all of them.
+
+    The body is newline-delimited JSON, with the 'run' (the file contents),
+    'name', 'profile' and 'version' of one run per line, in the order the
+    client wants them acknowledged. It may be compressed with any encoding
+    aiohttp can decode (gzip, and zstd if it's installed). The response has
+    the name of the last run which was stored, so that the client can
+    resume from there if something went wrong."""
+
+    check_key(req)
+
+    added = 0
+    acked = None
+    count = 0
+    error = None
+    try:
+        async for line in _ndjson_lines(req.content.iter_any()):
+            try:
+                entry = json.loads(line)
+                content, name, profile, version = entry["run"], entry["name"], str(entry["profile"]), str(entry["version"])
+                if version not in ("1", "2"):
+                    raise ValueError(f"Unknown game version {version!r}")
+                parser = await _store_run(content, name, profile, version)
+            except (ValueError, KeyError, TypeError) as e:
+                error = f"Could not store run #{count + 1}: {e!r}"
+                break
+            if parser is not None:
+                # link it right away, like receive_run does, so that a lookup
+                # while we wait for the next line doesn't link it a second time
+                get_index(int(version), int(profile)).extend([parser])
+                _uncommitted.append(parser)
+                added += 1
+            acked = name
+            count += 1
+    finally:
+        # whatever was stored is kept, even if the client went away
+        if added:
+            _commit_runs()
+
+    logger.debug(f"Received {count} run history files ({added} new). Transaction time: {time.time() - float(req.query['start'])}s")
+
+    return Response(text=json.dumps({"acked": acked, "count": count, "error": error}), content_type="application/json", status=400 if error else 200)
+
+_prerender_tasks: set[asyncio.Task] = set()
+
+@add_listener("run_end")
+async def _prerender_graphs(run: RunParser | None):
+    """Render the default graphs of a run that just ended, in the background."""
+    if run is None or not config.server.prerender_graphs:
+        return
+    # don't hold up the other listeners while this renders
+    task = asyncio.create_task(run.prerender_graphs(config.server.prerender_graphs))
+    _prerender_tasks.add(task)
+    task.add_done_callback(_prerender_tasks.discard)
@@ -1,13 +1,14 @@
-from typing import Any
+from typing import Any, Iterable
 
 import datetime
+import secrets
 import base64
 import json
 import time
 import math
 import os
 
-from aiohttp.web import Request, HTTPNotFound, HTTPFound, HTTPNotImplemented, Response
+from aiohttp.web import Request, HTTPNotFound, HTTPFound, HTTPNotImplemented, HTTPConflict, Response
 
 import aiohttp_jinja2
 
@@ -19,18 +20,77 @@ from src.gamedata import FileParser, BottleRelic, KeysObtained, _enemies
 from src.webpage import router
 from src.logger import logger
 from src.events import invoke
+from src.persist import persister
+from src.sync import sync_section
 from src.utils import convert_class_to_obj, get_req_data
 from src.runs import get_latest_run, StreakInfo
 from src.activemods import ActiveMods, ActiveMod, ACTIVEMODS_KEY
 
 import src.score as _s
 
-from src.config import config
-
 __all__ = ["get_savefile"]
 
 _savefile = None
 
+# which part of the savefile each key belongs to, so that only what depends
+# on a part that changed gets computed again. keys not listed here are in
+# 'path' if they're metrics (as that's what the path is built from), and in
+# 'other' otherwise
+_SECTIONS = {
+    "cards": ("cards", "bottled_flame", "bottled_flame_upgrade", "bottled_lightning",
+              "bottled_lightning_upgrade", "bottled_tornado", "bottled_tornado_upgrade"),
+    "relics": ("relics", "relic_counters", "blights", "blight_counters"),
+    "path": ("basemod:mod_saves", "floor_num", "act_num", "current_room", "path_x", "path_y", "room_x", "room_y"),
+    "stats": ("current_health", "max_health", "gold", "purgeCost", "potion_chance", "card_random_seed_randomizer",
+              "ascension_level", "potions", "potion_slots"),
+    "pools": ("common_relics", "uncommon_relics", "rare_relics", "shop_relics", "boss_relics", "boss", "event_chances"),
+}
+_ALL_SECTIONS = (*_SECTIONS, "other")
+
+# the sync tokens include this, so a client never sends a delta against what a previous process had
+_SYNC_EPOCH = secrets.token_hex(4)
+_KEY_SECTIONS = {key: section for section, keys in _SECTIONS.items() for key in keys}
+
+def _section(key: str) -> str:
+    if (section := _KEY_SECTIONS.get(key)) is not None:
+        return section
+    if key.startswith("metric_"):
+        return "path"
+    return "other"
+
+def _changed_sections(old: dict[str, Any], new: dict[str, Any]) -> set[str]:
+    """Return which sections differ between two versions of the savefile."""
+    changed = set()
+    missing = object()
+    for key in old.keys() | new.keys():
+        section = _section(key)
+        if section not in changed and old.get(key, missing) != new.get(key, missing):
+            changed.add(section)
+            if len(changed) == len(_ALL_SECTIONS):
+                break
+    return changed
+
+class _depends:
+    """A property which is only computed again when a savefile section it uses changes."""
+
+    def __init__(self, *sections: str):
+        self.sections = sections
+
+    def __call__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+        self.__name__ = func.__name__
+        return self
+
+    def __get__(self, instance: "Savefile", owner: type):
+        if instance is None:
+            return self
+        key = tuple(instance._sections[x] for x in self.sections)
+        cached = instance._derived.get(self.__name__)
+        if cached is None or cached[0] != key:
+            cached = instance._derived[self.__name__] = (key, self.func(instance))
+        return cached[1]
+
 class Savefile(FileParser):
     """Hold data related to the ongoing run.
 
@@ -65,11 +125,14 @@ class Savefile(FileParser):
         self._last = time.time()
         self._matches = False
         self._activemods = None
+        #: How many times each section changed; the revision only goes up when one does.
+        self._sections: dict[str, int] = dict.fromkeys(_ALL_SECTIONS, 0)
+        self._derived: dict[str, tuple[tuple[int, ...], Any]] = {}
         
     def __str__(self):
         return "SAVEFILE"
 
-    def update_data(self, data: dict[str, Any] | None, character: str, has_run: str):
+    def update_data(self, data: dict[str, Any] | None, character: str, has_run: str, changed_keys: Iterable[str] | None = None):
         """Update all the data for the current run.
 
         This updates the instance in-place, and handles automatic page redirect.
@@ -80,6 +143,8 @@ class Savefile(FileParser):
         :type character: str
         :param has_run: Whether we have a finished run matching previous data
         :type has_run: str
+        :param changed_keys: Which keys changed since the previous data, if known
+        :type changed_keys: Iterable[str] | None
         """
         if character.startswith(("1_", "2_")):
             character = character[2:]
@@ -88,19 +153,66 @@ class Savefile(FileParser):
             if maybe_run is not None and "path" in self._cache and maybe_run._data["seed_played"] == self._data["metric_seed_played"]:
                 self._matches = True
 
+        old = self._data
         self._data = data
-        self._graph_cache.clear()
         if not character:
             self._last = time.time()
             self._character = None
             self._cache.clear()
             self._cache["self"] = self
+            changed = set(_ALL_SECTIONS)
         else:
             self._matches = False
+            if old and data and character == self._character:
+                if changed_keys is not None:
+                    changed = {_section(key) for key in changed_keys}
+                else:
+                    changed = _changed_sections(old, data)
+            else:
+                changed = set(_ALL_SECTIONS)
             self._character = character
-            if "path" in self._cache:
+            if "path" in changed and "path" in self._cache:
                 self._cache["old_path"] = self._cache.pop("path")
-            self._cache.pop("relics", None) # because N'loth and Boss relic starter upgrade, we need to regen it everytime
+            if changed & {"relics", "path"}: # the relic descriptions use the path
+                self._cache.pop("relics", None)
+            if "other" in changed:
+                self._activemods = None
+
+        if changed:
+            self._revision += 1
+            for section in changed:
+                self._sections[section] += 1
+
+    @property
+    def revision(self) -> int:
+        """A number which goes up whenever the savefile changes."""
+        return self._revision
+
+    @property
+    def sync_token(self) -> str:
+        """What identifies the current data, for clients sending deltas. This is unique across restarts."""
+        return f"{_SYNC_EPOCH}-{self._revision}"
+
+    def apply_delta(self, delta: dict[str, Any], character: str, base: str | None):
+        """Update the data from only the keys which changed.
+
+        :param delta: A dict with the keys to 'set' (a dict) and to 'delete' (a list).
+        :type delta: dict[str, Any]
+        :param character: The on-disk name of the savefile
+        :type character: str
+        :param base: The sync token the client computed the delta against.
+        :type base: str | None
+        :raises ValueError: The delta was not made against the current data; the whole savefile is needed.
+        """
+        if character.startswith(("1_", "2_")):
+            character = character[2:]
+        if not self._data or base != self.sync_token or character != self._character:
+            raise ValueError("the delta does not apply to the current savefile")
+        data = dict(self._data)
+        data.update(delta["set"])
+        for key in delta["delete"]:
+            data.pop(key, None)
+        self.update_data(data, character, "false", changed_keys=[*delta["set"], *delta["delete"]])
 
     @property
     def in_game(self) -> bool:
@@ -201,7 +313,7 @@ class Savefile(FileParser):
     def current_gold(self) -> int:
         return self._data["gold"]
 
-    @property
+    @_depends("relics", "stats")
     def current_purge(self) -> int:
         base = self._data["purgeCost"]
         membership = False
@@ -220,7 +332,7 @@ class Savefile(FileParser):
     def purge_totals(self) -> int:
         return self._data["metric_purchased_purges"]
 
-    @property
+    @_depends("relics", "stats")
     def shop_prices(self) -> tuple[tuple[range, range, range], tuple[range, range], tuple[range, range, range], tuple[range, range, range]]:
         m = 1.0
         if self.ascension_level >= 16:
@@ -253,7 +365,7 @@ class Savefile(FileParser):
 
     floor = current_floor
 
-    @property
+    @_depends("relics", "stats")
     def potion_chance(self) -> int:
         for relic in self.relics:
             if relic.name == "White Beast Statue":
@@ -262,7 +374,7 @@ class Savefile(FileParser):
                 return 0
         return self._data["potion_chance"] + 40
 
-    @property
+    @_depends("relics", "stats")
     def rare_chance(self) -> tuple[float, float, float]:
         base = self._data["card_random_seed_randomizer"]
         regular = 3
@@ -290,7 +402,7 @@ class Savefile(FileParser):
     def rare_chance_as_str(self) -> tuple[str, str, str]:
         return tuple(f"{x:.2%}" for x in self.rare_chance)
 
-    @property
+    @_depends("pools", "relics", "path")
     def _available_rare_relics(self) -> list[str]:
         floor = self.current_floor
         ret = []
@@ -326,7 +438,7 @@ class Savefile(FileParser):
         boss = self._data["boss"]
         return _enemies.get(boss, boss)
 
-    @property
+    @_depends("cards")
     def bottles(self) -> list[BottleRelic]:
         bottles = []
         if self._data.get("bottled_flame"):
@@ -351,11 +463,11 @@ class Savefile(FileParser):
         except AttributeError: # no character played like this; likely a mod
             return StreakInfo(0, 0, True)
 
-    @property
+    @_depends(*_ALL_SECTIONS)
     def score(self) -> int:
         return sum(bonus.score_bonus for bonus in self._get_score_bonuses())
 
-    @property
+    @_depends(*_ALL_SECTIONS)
     def score_breakdown(self) -> list[str]:
         return [bonus.full_display for bonus in self._get_score_bonuses() 
                         if bonus.should_show or bonus.score_bonus != 0]
@@ -450,6 +562,8 @@ class Savefile(FileParser):
         return self.activemods.all_mods
 
 _savefile = Savefile()
+# the game saves often, so only write our copy every few seconds
+_save_file = persister("spire-save.json", lambda: _savefile._data or {})
 
 class Save2(FP2):
     """Slay the Spire 2 Savefile.
@@ -544,48 +658,64 @@ async def save_chart(req: Request) -> Response:
     if _savefile.character is None:
         raise HTTPNotFound()
 
-    return _savefile.graph(req)
+    return await _savefile.graph(req)
 
 @router.get("/current-2/raw")
 async def current2_raw(req: Request):
     return Response(text=json.dumps(_save2._data, indent=4), content_type="application/json")
 
-@router.post("/sync/save")
-async def receive_save(req: Request):
-    content, name = await get_req_data(req, "savefile", "character")
-
-    j = None
-    if content:
-        decoded = base64.b64decode(content)
-        arr = bytearray()
-        for i, char in enumerate(decoded):
-            arr.append(char ^ b"key"[i % 3])
-        j = json.loads(arr)
-        if "basemod:mod_saves" not in j: # make sure this key exists
-            j["basemod:mod_saves"] = {}
-
+def _decode_savefile(content: str) -> dict[str, Any]:
+    """Decode the contents of a .autosave file."""
+    decoded = base64.b64decode(content)
+    # the file is XORed with 'key'; do it all at once rather than a byte at a time
+    key = (b"key" * (len(decoded) // 3 + 1))[:len(decoded)]
+    arr = (int.from_bytes(decoded) ^ int.from_bytes(key)).to_bytes(len(decoded))
+    j = json.loads(arr)
+    if "basemod:mod_saves" not in j: # make sure this key exists
+        j["basemod:mod_saves"] = {}
+    return j
+
+@sync_section("save")
+async def update_save(character: str, savefile: str | None = None, delta: str | None = None, has_run: str = "false", base: str | None = None) -> dict[str, str]:
     in_run = _savefile.in_game
-    _savefile.update_data(j, name, req.query["has_run"])
+    if delta is not None:
+        # only what changed since the data we acknowledged last
+        try:
+            _savefile.apply_delta(json.loads(delta), character, base)
+        except ValueError:
+            raise HTTPConflict(reason="Savefile is out of sync, send the whole file")
+    else:
+        j = None
+        if savefile:
+            j = _decode_savefile(savefile)
+        _savefile.update_data(j, character, has_run)
     if in_run and not _savefile.in_game:
         run = get_latest_run(None, None)
         await invoke("run_end", run)
-    with open(os.path.join("data", "spire-save.json"), "w") as f:
-        if j:
-            json.dump(j, f, indent=config.server.json_indent)
-        else:
-            f.write("{}")
+    _save_file.mark()
+
+    # this lets the client send only what changed next time
+    return {"revision": _savefile.sync_token}
+
+@router.post("/sync/save")
+async def receive_save(req: Request):
+    content, name, delta = await get_req_data(req, "savefile", "character", "delta")
+    result = await update_save(name, content, delta, req.query.get("has_run", "false"), req.query.get("base"))
     logger.debug(f"Updated data. Final transaction time: {time.time() - float(req.query['start'])}s")
 
-    return Response()
+    return Response(text=json.dumps(result), content_type="application/json")
+
+@sync_section("save-2")
+async def update_save2(savefile: str | None = None):
+    j = None
+    if savefile:
+        j = json.loads(savefile)
+    _save2.update_data(j)
 
 @router.post("/sync/save-2")
 async def receive_save2(req: Request):
     content = (await get_req_data(req, "savefile"))[0]
-
-    j = None
-    if content:
-        j = json.loads(content)
-    _save2.update_data(j)
+    await update_save2(content)
 
     return Response()
 
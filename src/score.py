@@ -81,7 +81,10 @@ def get_champions_bonus(save: Savefile) -> Score:
 
 def get_bosses_slain_bonus(save: Savefile) -> Score:
     """Get 25 points for each boss killed."""
-    boss_nodes = sum(1 for node in save.path if node.room_type == "Boss")
+    if (series := save.floor_series) is not None:
+        boss_nodes = series.bosses
+    else:
+        boss_nodes = sum(1 for node in save.path if node.room_type == "Boss")
     match boss_nodes:
         case 0:
             score = 0
@@ -65,6 +65,8 @@ from src.monster import query as mt_query, get_savefile as get_mt_save, MonsterS
 from src.twitch import TwitchCommand
 from src.logger import logger
 from src.events import add_listener
+from src.persist import persister
+from src.sync import sync_section
 from src.config import config, __botname__, __version__, __github__, __author__
 from src.slice import get_runs, CurrentRun
 from src.utils import (
@@ -78,7 +80,7 @@ from src.utils import (
 
 from src.disc import DiscordCommand
 from src.save import get_savefile, Savefile
-from src.runs import get_latest_run, RunParser
+from src.runs import get_latest_run, get_run_analytics, get_run_items, RunParser
 from src.gamedata import RelicData, Treasure, Event
 
 from src.typehints import ContextType, CommandType, SaveType
@@ -312,10 +314,10 @@ def load(loop: asyncio.AbstractEventLoop):
                 q.is_quote = False
             _quotes.append(q)
 
+_quotes_file = persister("quotes.json", lambda: [x.to_json() for x in _quotes])
+
 def _update_quotes():
-    q = [x.to_json() for x in _quotes]
-    with getfile("quotes.json", "w") as f:
-        json.dump(q, f, indent=config.server.json_indent)
+    _quotes_file.mark()
 
 
 async def _launch_timers(timers: list[Timer]):
@@ -324,15 +326,19 @@ async def _launch_timers(timers: list[Timer]):
         await asyncio.sleep(config.twitch.timers.stagger_interval)
 
 
-def _update_timers():
+def _timers_json() -> dict:
     final = {}
     for name, timer in _timers.items():
         d = {"interval": timer.interval, "commands": timer.commands}
         if not timer.running:
             d["enabled"] = False
         final[name] = d
-    with getfile("timers.json", "w") as f:
-        json.dump(final, f, indent=config.server.json_indent)
+    return final
+
+_timers_file = persister("timers.json", _timers_json)
+
+def _update_timers():
+    _timers_file.mark()
 
 
 # Adds non built-in commands to internal json structure
@@ -1389,10 +1395,10 @@ def _get_quote(i: int):
     return f'Quote #{i}: "{q.line}"{author}{added_by}'
 
 
+_clips_file = persister("clips.json", lambda: [x.to_json() for x in _clips])
+
 def _update_clips():
-    c = [x.to_json() for x in _clips]
-    with getfile("clips.json", "w") as f:
-        json.dump(c, f, indent=config.server.json_indent)
+    _clips_file.mark()
 
 
 async def setup_clips():
@@ -1662,6 +1668,9 @@ async def stream_uptime(ctx: ContextType):
         await ctx.reply("Stream is offline (if this is wrong, the Twitch API broke).")
 
 
+_offsets: dict[str, float] = {}
+_offsets_file = persister("offsets.json", lambda: _offsets)
+
 @add_listener("run_end")
 async def fetch_run_offset(run: RunParser):
     """Fetch and store the run start offset."""
@@ -1676,16 +1685,15 @@ async def fetch_run_offset(run: RunParser):
 
         offset = run_start - started
 
-        try:
-            with getfile("offsets.json", "r") as f:
-                j = json.load(f)
-        except FileNotFoundError:
-            j = {}
-
-        j[run.name] = offset.total_seconds()
+        if not _offsets:
+            try:
+                with getfile("offsets.json", "r") as f:
+                    _offsets.update(json.load(f))
+            except FileNotFoundError:
+                pass
 
-        with getfile("offsets.json", "w") as f:
-            json.dump(j, f, indent=config.server.json_indent)
+        _offsets[run.name] = offset.total_seconds()
+        _offsets_file.mark()
 
 
 # DO NOT MERGE INTO MAIN UNTIL THE FOLLOWING IS COMPLETELY DONE
@@ -1885,20 +1893,26 @@ async def now_playing(ctx: ContextType):
         await ctx.reply("We are not currently listening to anything.")
 
 
-@router.get("/playing")
-async def now_playing_client(req: Request):
-    await get_req_data(req)  # just checking if key is OK
-
+@sync_section("playing")
+async def now_playing_data() -> dict:
     if TConn is None:  # no Twitch, no Spotify
         raise HTTPServiceUnavailable(reason="Need Twitch connection for Spotify")
 
     data = await TConn.spotify_call()
 
     if data:
-        return Response(text=json.dumps(data), content_type="application/json")
+        return data
     raise HTTPServiceUnavailable(reason="Could not connect to the Spotify API")
 
 
+@router.get("/playing")
+async def now_playing_client(req: Request):
+    await get_req_data(req)  # just checking if key is OK
+
+    data = await now_playing_data()
+    return Response(text=json.dumps(data), content_type="application/json")
+
+
 _ongoing_giveaway = {
     "running": False,
     "count": 0,
@@ -2993,6 +3007,94 @@ async def calculate_winrate_cmd(ctx: ContextType, date_string: Optional[str] = N
     )
 
 
+def _item_stats_line(stats, item: Base, wins: int) -> str:
+    msg = []
+    if stats.offered:
+        msg.append(f"picked {stats.picked}/{stats.offered} times offered ({stats.pick_rate:.2%})")
+    msg.append(f"held at the end of {stats.runs} runs, {stats.wins} of them wins ({stats.win_rate:.2%} win rate, {stats.wins / wins if wins else 0:.2%} of all wins)")
+    if (floor := stats.common_floor) is not None:
+        msg.append(f"most often obtained on floor {floor}")
+    return f"{item.name}: {', '.join(msg)}."
+
+
+@command("pickrate", "cardstats")
+async def card_stats_cmd(ctx: ContextType, *line: str):
+    """Display how often a card was picked, and the win rate of runs with it."""
+    line = " ".join(line)
+    card = query(line)
+    analytics = get_run_analytics()
+    if card is None or analytics is None:
+        await ctx.reply(f"Could not find card {line!r}")
+        return
+    stats = analytics.get()
+    await ctx.reply(_item_stats_line(stats.card(card.internal), card, stats.wins))
+
+
+@command("relicstats", "relicrate")
+async def relic_stats_cmd(ctx: ContextType, *line: str):
+    """Display the win rate of runs with a relic, and when it was usually obtained."""
+    line = " ".join(line)
+    relic = query(line)
+    analytics = get_run_analytics()
+    if relic is None or analytics is None:
+        await ctx.reply(f"Could not find relic {line!r}")
+        return
+    stats = analytics.get()
+    await ctx.reply(_item_stats_line(stats.relic(relic.internal), relic, stats.wins))
+
+
+@command("runswith", "with")
+async def runs_with_cmd(ctx: ContextType, *line: str):
+    """Display how many runs ended with a card or relic, and their win rate."""
+    line = " ".join(line)
+    item = query(line)
+    items = get_run_items()
+    if item is None or items is None:
+        await ctx.reply(f"Could not find card or relic {line!r}")
+        return
+    postings = items.get(item.internal)
+    if not postings:
+        await ctx.reply(f"No run ended with {item.name}.")
+        return
+    msg = f"{len(postings)} runs ended with {item.name}, {postings.wins} of them wins ({postings.win_rate:.2%} win rate)."
+    if (run := items.last_with(item.internal)) is not None:
+        msg += f" The last one can be viewed at {config.server.url}/runs/{run.name}"
+    await ctx.reply(msg)
+
+
+@command("lastwith")
+async def last_with_cmd(ctx: ContextType, *line: str):
+    """Get the last run which ended with a card or relic."""
+    line = " ".join(line)
+    item = query(line)
+    items = get_run_items()
+    if item is None or items is None:
+        await ctx.reply(f"Could not find card or relic {line!r}")
+        return
+    run = items.last_with(item.internal)
+    if run is None:
+        await ctx.reply(f"No run ended with {item.name}.")
+        return
+    await ctx.reply(f"The last run with {item.name} ({run.character} {run.verb}) can be viewed at {config.server.url}/runs/{run.name}")
+
+
+@command("killedby", "killers")
+async def killed_by_cmd(ctx: ContextType, character: Optional[str] = None):
+    """Display what most often ended the runs, overall or for one character."""
+    analytics = get_run_analytics()
+    if analytics is None:
+        await ctx.reply("No runs found.")
+        return
+    if character is not None:
+        character = character.capitalize()
+    stats = analytics.get(character)
+    if not stats.killed_by:
+        await ctx.reply("No losses found.")
+        return
+    top = " - ".join(f"{name}: {count}" for name, count in stats.killed_by.most_common(5))
+    await ctx.reply(f"Most common causes of death ({character or 'all characters'}, {stats.runs - stats.wins} losses) | {top}")
+
+
 @with_savefile("unmastered", optional_save=True)
 async def unmastered(ctx: ContextType, save: SaveType):
     if save is not None and "unmastered" in save._cache:
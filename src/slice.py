@@ -73,15 +73,21 @@ try:
     from src.webpage import router
     from src.events import add_listener
     from src.utils import get_req_data
+    from src.sync import sync_section
 except ModuleNotFoundError: # running as stand-alone module
     pass
 else:
+    @sync_section("slice")
+    async def update_slice_data(data: str):
+        with open(os.path.join("data", "slice-data"), "w") as f:
+            f.write(data)
+        populate(os.path.join("data", "slice-data"))
+        # This will return the curses, once we can get them (see below)
+
     @router.post("/sync/slice")
     async def receive_slice(req: Request):
         data = await get_req_data(req, "data")
-        with open(os.path.join("data", "slice-data"), "w") as f:
-            f.write(data[0])
-        populate(os.path.join("data", "slice-data"))
+        await update_slice_data(data[0])
         # This is to allow the client to display curses
         # We don't have easy access to the actual content currently
         # So it's disabled for the time being
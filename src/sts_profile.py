@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Generator, TYPE_CHECKING
+from typing import Iterator, TYPE_CHECKING
 
 import zipfile
 import math
@@ -10,16 +10,17 @@ import os
 import io
 
 from aiohttp.web import Request, Response, HTTPForbidden, HTTPNotFound
-from itertools import islice
 from datetime import datetime
 
 import aiohttp_jinja2
 
 from src.nameinternal import get
+from src.cache.run_index import ProfileIndex, get_index
 from src.webpage import router
 from src.logger import logger
 from src.events import add_listener
 from src.utils import get_req_data
+from src.sync import sync_section
 
 if TYPE_CHECKING: # circular imports otherwise
     from src.runs import RunParser
@@ -91,26 +92,34 @@ class Profile:
         return name
 
     @property
-    def runs(self) -> Generator[RunParser, None, None]:
+    def run_index(self) -> ProfileIndex:
+        """The run history index for this profile's folder."""
+        if self.index < 10: # spire 1
+            return get_index(1, self.index)
+        return get_index(2, self.index - 10)
+
+    @property
+    def runs(self) -> Iterator[RunParser]:
         """Return all runs from the matching profile, newest first."""
-        from src.runs import _ts_cache
-        l = list(_ts_cache)
-        l.sort()
-        l.reverse()
-        for ts in l:
-            if _ts_cache[ts].profile is self:
-                yield _ts_cache[ts]
+        return reversed(self.run_index.runs)
+
+    def runs_between(self, start: int | float, end: int | float) -> list[RunParser]:
+        """Return the runs which ended in the [start, end] range, newest first."""
+        return self.run_index.between(start, end)[::-1]
 
     def paged_runs(self, page):
         page -= 1 # UI serves the page number one-indexed, we want zero-indexed
-        start = page * self.RUNS_PER_PAGE
-        end = start + self.RUNS_PER_PAGE
-        print(page, start, end)
-        return islice(self.runs, start, end)
+        runs = self.run_index.runs
+        # the runs are stored oldest first, so count from the end
+        end = len(runs) - page * self.RUNS_PER_PAGE
+        if end <= 0:
+            return []
+        start = max(end - self.RUNS_PER_PAGE, 0)
+        return runs[start:end][::-1]
 
     @property
     def pages(self):
-        return math.floor(sum(1 for _ in self.runs) / self.RUNS_PER_PAGE) + 1
+        return math.floor(len(self.run_index.runs) / self.RUNS_PER_PAGE) + 1
 
 @router.get("/profile/{profile}/runs")
 @router.get("/profile/{profile}/runs/{page}")
@@ -147,15 +156,8 @@ async def runs_by_timestamp(req: Request):
         end = int(end) if end else time.time()
     except ValueError:
         raise HTTPForbidden(reason="Timestamp must be integers if given.")
-    has_runs = False
-
-    runs = []
-    for run in profile.runs:
-        if start <= run.timestamp.timestamp() <= end:
-            runs.append(run)
-            has_runs = True
-
-    if not has_runs:
+    runs = profile.runs_between(start, end)
+    if not runs:
         raise HTTPForbidden(reason="No run file matches the given range.")
 
     return {
@@ -182,33 +184,32 @@ async def runs_as_zipfile(req: Request) -> Response:
             end = time.time()
     except ValueError:
         raise HTTPForbidden(reason="Timestamp must be integers if given.")
-    has_file = False
+    runs = profile.runs_between(start, end)
+    if not runs:
+        raise HTTPForbidden(reason="No run file matches the given range.")
 
     with io.BytesIO() as zfile:
         with zipfile.ZipFile(zfile, mode="w") as archive:
-            for run in profile.runs:
-                if start <= run.timestamp.timestamp() <= end:
-                    archive.write(f"data/runs/{profile.index}/{run.filename}")
-                    has_file = True
+            for run in runs:
+                archive.write(f"data/runs/{profile.index}/{run.filename}")
 
-        if not has_file:
-            raise HTTPForbidden(reason="No run file matches the given range.")
         return Response(body=zfile.getvalue(), content_type="application/zip")
 
-@router.post("/sync/profile")
-async def sync_profiles(req: Request) -> Response:
-    slots, *profiles = await get_req_data(req, "slots", "0", "1", "2", "11", "12", "13")
+_PROFILE_KEYS = ("0", "1", "2", "11", "12", "13") # all spire 2 profiles are mapped to be +10
 
+@sync_section("profile")
+async def update_profiles(slots: str | None = None, **profiles: str):
     if slots:
         _slots.clear()
         _slots.update(json.loads(slots))
         with open(os.path.join("data", "slots"), "w") as f:
             f.write(slots)
 
-    for i in range(3):
-        profile = profiles[i]
+    for key in _PROFILE_KEYS:
+        profile = profiles.get(key)
         if not profile:
             continue # either it doesn't exist, or it hasn't changed
+        i = int(key)
         with open(os.path.join("data", f"profile_{i}"), "w") as f:
             f.write(profile)
         profile = json.loads(profile)
@@ -217,18 +218,10 @@ async def sync_profiles(req: Request) -> Response:
         else:
             _profiles[i].data = profile
 
-    for i in range(3):
-        profile = profiles[i+3] # index
-        if not profile:
-            continue
-        i += 11 # map all spire 2 profiles to be +10
-        with open(os.path.join("data", f"profile_{i}"), "w") as f:
-            f.write(profile)
-        profile = json.loads(profile)
-        if i not in _profiles:
-            _profiles[i] = Profile(i, profile)
-        else:
-            _profiles[i].data = profile
+@router.post("/sync/profile")
+async def sync_profiles(req: Request) -> Response:
+    slots, *profiles = await get_req_data(req, "slots", *_PROFILE_KEYS)
+    await update_profiles(slots, **dict(zip(_PROFILE_KEYS, profiles)))
 
     logger.debug(f"Received profiles. Transaction time: {time.time() - float(req.query['start'])}s")
 
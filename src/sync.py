@@ -0,0 +1,144 @@
+"""Receive everything the client has to send in a single request.
+
+On every tick, the client may have a new savefile for either game, new
+profiles, new Monster Train or Slice & Dice data, and it wants to know
+which song is playing. Instead of a request for each of these (each one
+checking the API key and parsing a form), it can POST them all to /sync
+at once, as a (usually gzip-compressed) JSON envelope holding only the
+sections which changed::
+
+    {"sections": {"save": {"hash": "...", "data": {"character": "IRONCLAD", ...}}, "playing": {"data": {}}}}
+
+The data of each section has the same fields as the form of its own
+endpoint (e.g. /sync/save). Each section is handled in order by the
+function registered for it with :func:`sync_section`, and the response
+holds the outcome of each one, along with what it returned::
+
+    {"sections": {"save": {"status": 200, "hash": "...", "result": {"revision": "..."}}, "playing": {...}}}
+
+A section which fails doesn't stop the others; its status and the reason
+are in its own outcome instead.
+
+Every upload under /sync may be compressed. aiohttp decodes the body before
+the handlers read it, and each response lists the encodings it can decode
+in its Accept-Encoding header, so that the client can pick the best one.
+The size of the uploads to each endpoint, as received and once decoded,
+is counted and can be seen at /sync/stats.
+
+"""
+
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable
+
+import hashlib
+import json
+import time
+
+from aiohttp.web import Request, Response, HTTPBadRequest, HTTPException, middleware
+
+try:
+    from aiohttp.compression_utils import HAS_BROTLI, HAS_ZSTD
+except ImportError: # older aiohttp
+    HAS_BROTLI = HAS_ZSTD = False
+
+from src.webpage import router, webpage
+from src.logger import logger
+from src.config import config
+from src.utils import check_key
+
+__all__ = ["sync_section", "content_hash", "upload_stats"]
+
+_sections: dict[str, Callable[..., Awaitable[Any]]] = {}
+
+# most preferred first
+ACCEPT_ENCODING = ", ".join(["zstd"] * HAS_ZSTD + ["br"] * HAS_BROTLI + ["gzip", "deflate"])
+
+upload_stats: dict[str, dict[str, int]] = {}
+
+def sync_section(name: str):
+    """Register a function to handle a section of the /sync envelope.
+
+    It is called with the data of the section as keyword arguments, and
+    what it returns (which must be JSON-serializable) is sent back to the
+    client. It can raise an HTTP exception to fail its section."""
+
+    def inner(func: Callable[..., Awaitable[Any]]):
+        if name in _sections:
+            raise ValueError(f"Sync section {name!r} is already registered")
+        _sections[name] = func
+        return func
+    return inner
+
+def content_hash(data: dict[str, Any]) -> str:
+    """Return the hash of the data of a section, the same way the client does."""
+    text = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+async def _handle(name: str, section: dict[str, Any]) -> dict[str, Any]:
+    handler = _sections.get(name)
+    if handler is None:
+        return {"status": 404, "error": f"Unknown section {name!r}"}
+    data = section.get("data") or {}
+    digest = section.get("hash")
+    if digest is not None and digest != content_hash(data):
+        return {"status": 400, "error": "Content hash does not match"}
+
+    try:
+        result = await handler(**data)
+    except HTTPException as e:
+        return {"status": e.status, "hash": digest, "error": e.reason}
+    except Exception:
+        logger.exception(f"Could not handle the {name!r} sync section")
+        return {"status": 500, "hash": digest, "error": "Internal Server Error"}
+    return {"status": 200, "hash": digest, "result": result}
+
+@router.post("/sync")
+async def receive_sync(req: Request) -> Response:
+    check_key(req)
+    try:
+        sections: dict[str, dict[str, Any]] = json.loads(await req.read())["sections"]
+        items = list(sections.items())
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPBadRequest(reason="Invalid sync envelope")
+
+    results = {}
+    for name, section in items:
+        results[name] = await _handle(name, section)
+
+    logger.debug(f"Received sync sections {', '.join(results)}. Transaction time: {time.time() - float(req.query.get('start', time.time()))}s")
+
+    return Response(text=json.dumps({"sections": results}), content_type="application/json")
+
+def _count_upload(req: Request):
+    decoded = req.content.total_bytes
+    received = getattr(req.content, "total_compressed_bytes", None)
+    if received is None: # not compressed
+        received = decoded
+    stats = upload_stats.setdefault(req.path, {"requests": 0, "received": 0, "decoded": 0})
+    stats["requests"] += 1
+    stats["received"] += received
+    stats["decoded"] += decoded
+
+@middleware
+async def sync_encoding(req: Request, handler):
+    """Count the uploads to /sync endpoints, and tell the client how it may compress them."""
+    if not req.path.startswith("/sync"):
+        return await handler(req)
+    try:
+        resp = await handler(req)
+    except HTTPException as e:
+        e.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        raise
+    finally:
+        if req.method == "POST":
+            _count_upload(req)
+    resp.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    return resp
+
+webpage.middlewares.append(sync_encoding)
+
+@router.get("/sync/stats")
+async def sync_stats(req: Request) -> Response:
+    check_key(req)
+    return Response(text=json.dumps(upload_stats, indent=config.server.json_indent), content_type="application/json")
@@ -5,11 +5,12 @@ from aiohttp.web import Request, HTTPNotImplemented, HTTPForbidden, HTTPUnauthor
 from twitchio import models, client, http as _http
 
 import os
-import json
 
 from src.config import config
+from src.persist import persister
 
 __all__ = [
+    "check_key",
     "get_req_data",
     "post_prediction",
     "getfile",
@@ -20,7 +21,7 @@ __all__ = [
     "parse_date_range",
 ]
 
-async def get_req_data(req: Request, *keys: str) -> list[str]:
+def check_key(req: Request):
     pw = req.query.get("key")
     if pw is None:
         raise HTTPUnauthorized(reason="No API key provided")
@@ -29,6 +30,10 @@ async def get_req_data(req: Request, *keys: str) -> list[str]:
     if pw != config.server.secret:
         raise HTTPForbidden(reason="Invalid API key provided")
 
+async def get_req_data(req: Request, *keys: str) -> list[str]:
+    check_key(req)
+
+    # the client may compress the form; aiohttp decodes it (per Content-Encoding) as it's read
     post = await req.post()
 
     res = []
@@ -61,10 +66,14 @@ async def post_prediction(app: client.Client, broadcaster_id: int, title: str, o
 def getfile(x: str, mode: str):
     return open(os.path.join("data", x), mode)
 
-def update_db():
+def _get_cmds() -> dict:
     from src.server import _cmds
-    with getfile("data.json", "w") as f:
-        json.dump(_cmds, f, indent=config.server.json_indent)
+    return _cmds
+
+_db = persister("data.json", _get_cmds)
+
+def update_db():
+    _db.mark()
 
 def convert_class_to_obj(obj: Any) -> dict[str, Any]:
     return vars(obj)
@@ -0,0 +1,69 @@
+from unittest import TestCase, IsolatedAsyncioTestCase, mock
+
+import tempfile
+import json
+import os
+
+from client import FileHashes, Syncer, SyncResult
+
+class TestFileHashes(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "last_hashes.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_unchanged(self):
+        hashes = FileHashes(self.path)
+        digest = hashes.changed("save", "content")
+        self.assertIsNotNone(digest)
+        self.assertEqual(hashes.changed("save", "content"), digest) # not acknowledged yet
+        hashes.update({"save": digest})
+        self.assertIsNone(hashes.changed("save", "content"))
+        self.assertIsNotNone(hashes.changed("save", "other content"))
+        self.assertIsNotNone(hashes.changed("save-2", "content"))
+
+    def test_forget(self):
+        hashes = FileHashes(self.path)
+        hashes.update({"save": hashes.changed("save", "content")})
+        hashes.update({"save": None, "slice": None})
+        self.assertIsNotNone(hashes.changed("save", "content"))
+        self.assertEqual(hashes.hashes, {})
+
+    def test_persist(self):
+        hashes = FileHashes(self.path)
+        self.assertEqual(hashes.hashes, {})
+        digest = hashes.changed("profile-DEFECT", "content")
+        hashes.update({"profile-DEFECT": digest})
+        self.assertFalse(os.path.exists(f"{self.path}.tmp"))
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), {"profile-DEFECT": digest})
+        self.assertIsNone(FileHashes(self.path).changed("profile-DEFECT", "content"))
+
+    def test_corrupt(self):
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        self.assertEqual(FileHashes(self.path).hashes, {})
+
+class TestSyncerAck(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.syncer = Syncer(None)
+        self.syncer.hashes = FileHashes(os.path.join(self.tmp.name, "last_hashes.json"))
+
+    async def asyncTearDown(self):
+        self.tmp.cleanup()
+
+    async def test_send(self):
+        hashes = self.syncer.hashes
+        save = hashes.changed("save", "save content")
+        slice = hashes.changed("slice", "slice content")
+        self.syncer.add("save", {"save": save}, savefile="save content")
+        self.syncer.add("slice", {"slice": slice}, slice="slice content")
+        results = {"save": SyncResult(200), "slice": SyncResult(500, error="Internal Server Error")}
+        with mock.patch.object(self.syncer, "_send", mock.AsyncMock(return_value=results)):
+            self.assertIs(await self.syncer.send(0.0), results)
+        self.assertIsNone(hashes.changed("save", "save content"))
+        self.assertEqual(hashes.changed("slice", "slice content"), slice) # sent again next time
+        self.assertEqual(self.syncer.sections, {})
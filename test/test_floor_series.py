@@ -0,0 +1,59 @@
+from unittest import TestCase, skipIf
+
+from src.floor_series import FloorSeries, PackedSeries, average, np
+
+class _Node:
+    def __init__(self, floor: int, hp: int, room_type: str = "Enemy", end_of_act: bool = False):
+        self.floor = floor
+        self.room_type = room_type
+        self.end_of_act = end_of_act
+        self.current_hp = hp
+        self.max_hp = 80
+        self.gold = floor * 10
+        self.floor_time = 30
+        self.card_count = 10 + floor
+        self.relic_count = 1
+        self.potion_count = 0
+        self.fights_count = floor
+        self.turns_count = floor * 3
+
+class _Parser:
+    def __init__(self, path: list[_Node]):
+        self.path = tuple(path)
+        self.neow_bonus = _Node(0, 80)
+
+@skipIf(np is None, "numpy is not installed")
+class TestFloorSeries(TestCase):
+    def setUp(self):
+        self.series = FloorSeries(_Parser([
+            _Node(1, 70),
+            _Node(2, 60, "Boss"),
+            _Node(3, 75, "Boss Chest", end_of_act=True),
+            _Node(5, 50), # floor 4 was skipped
+        ]))
+
+    def test_columns(self):
+        self.assertEqual(len(self.series), 5)
+        self.assertEqual(self.series.floor.tolist(), [0, 1, 2, 3, 5])
+        self.assertEqual(self.series["current_hp"].tolist(), [80, 70, 60, 75, 50])
+        self.assertEqual(self.series.gold.tolist(), [0, 10, 20, 30, 50])
+        self.assertEqual(self.series.act_ends.tolist(), [3])
+        self.assertEqual(self.series.bosses, 1)
+        self.assertEqual(self.series.hp_lost().tolist(), [10, 10, -15, 25])
+        with self.assertRaises(KeyError):
+            self.series["_data"]
+
+    def test_average(self):
+        other = FloorSeries(_Parser([_Node(1, 40), _Node(2, 20), _Node(3, 10), _Node(4, 0)]))
+        hp = average([self.series, other], "current_hp")
+        self.assertEqual(hp, [80.0, 55.0, 40.0, 42.5, 0.0, 50.0])
+        self.assertEqual(average([other], "gold")[-1], 40.0)
+        self.assertEqual(average([], "gold"), [])
+
+    def test_packed(self):
+        packed = PackedSeries(self.series.pack())
+        self.assertEqual(packed.floor.tolist(), [0, 1, 2, 3, 5])
+        self.assertEqual(packed["current_hp"].tolist(), [80, 70, 60, 75, 50])
+        self.assertEqual(average([packed], "gold"), average([self.series], "gold"))
+        with self.assertRaises(KeyError):
+            packed["floor_time"]
@@ -0,0 +1,109 @@
+from unittest import IsolatedAsyncioTestCase, mock
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import tempfile
+import asyncio
+import signal
+import os
+
+from src import graphs
+from src.graphs import GraphCache
+
+def _render(value):
+    return value
+
+def _crash():
+    os._exit(1)
+
+class TestGraphCache(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = GraphCache(0, self.tmp.name)
+        self.cache.load_disk()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def test_coalesce(self):
+        values = await asyncio.gather(*[self.cache.fetch("a", _render, lambda: ("x",)) for _ in range(4)])
+        self.assertEqual(values, ["x"] * 4)
+        self.assertEqual(self.cache.renders, 1)
+        self.assertEqual(await self.cache.fetch("a", _render, lambda: ("y",)), "x")
+        self.assertEqual(self.cache.hits, 1)
+
+    async def test_cancel(self):
+        started = asyncio.Event()
+        release = asyncio.Event()
+        async def slow(value):
+            started.set()
+            await release.wait()
+            return value
+        with mock.patch.object(graphs, "_run", lambda func, *args: slow(func(*args))):
+            first = asyncio.create_task(self.cache.fetch("a", _render, lambda: ("x",)))
+            await started.wait()
+            second = asyncio.create_task(self.cache.fetch("a", _render, lambda: ("y",)))
+            await asyncio.sleep(0)
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            release.set()
+            self.assertEqual(await second, "x") # the cancellation isn't passed on
+        self.assertEqual(self.cache.renders, 1)
+        self.assertIn("a", self.cache)
+        self.assertEqual(self.cache._pending, {})
+
+    async def test_error(self):
+        def fail():
+            raise ValueError("bad data")
+        with self.assertRaises(ValueError):
+            await self.cache.fetch("a", _render, fail)
+        self.assertEqual(self.cache._pending, {})
+        self.assertEqual(await self.cache.fetch("a", _render, lambda: ("x",)), "x")
+
+    async def test_persist(self):
+        await self.cache.fetch(("run", "html"), _render, lambda: ("<p>",), persist=True)
+        await self.cache.fetch(("run", "png"), _render, lambda: (b"\x89PNG",), persist=True)
+        await self.cache.fetch("savefile", _render, lambda: (b"save",))
+
+        other = GraphCache(0, self.tmp.name)
+        other.load_disk()
+        self.assertEqual(await other.fetch(("run", "html"), _render, lambda: ("new",), persist=True), "<p>")
+        self.assertEqual(await other.fetch(("run", "png"), _render, lambda: (b"new",), persist=True), b"\x89PNG")
+        self.assertEqual(await other.fetch("savefile", _render, lambda: (b"new",)), b"new")
+        self.assertEqual(other.disk_hits, 2)
+        self.assertEqual(other.renders, 1)
+
+    async def test_disk_limit(self):
+        self.cache.max_disk_size = 10
+        for key in "abc":
+            await self.cache.fetch(key, _render, lambda: (b"123456",), persist=True)
+        self.assertLessEqual(self.cache.disk_size, 10)
+
+        other = GraphCache(0, self.tmp.name)
+        other.load_disk()
+        self.assertEqual(other.disk_size, 6)
+        self.assertEqual(await other.fetch("c", _render, lambda: (b"new",), persist=True), b"123456")
+
+class TestWorkers(IsolatedAsyncioTestCase):
+    def tearDown(self):
+        graphs.configure(0, 0)
+
+    async def test_broken_pool(self):
+        graphs.configure(1, 0)
+        self.assertEqual(await graphs._run(_render, "x"), "x")
+        for pid in list(graphs._pool._processes):
+            os.kill(pid, signal.SIGKILL)
+        await asyncio.sleep(0.2)
+        with self.assertRaises(BrokenProcessPool):
+            await graphs._run(_render, "y")
+        # no new processes get forked from the running server
+        self.assertIsInstance(graphs._pool, ThreadPoolExecutor)
+        self.assertEqual(await graphs._run(_render, "z"), "z")
+
+    async def test_crash(self):
+        graphs.configure(1, 0)
+        with self.assertRaises(BrokenProcessPool):
+            await graphs._run(_crash)
+        self.assertEqual(await graphs._run(_render, "x"), "x")
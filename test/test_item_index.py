@@ -0,0 +1,56 @@
+from unittest import TestCase
+
+from src.cache.item_index import ItemIndex, Postings
+from src.cache import run_index
+from src.cache.run_index import get_index
+from test.fakes import FakeRun
+
+class TestPostings(TestCase):
+    def test_sorted(self):
+        postings = Postings()
+        for epoch, won in ((10, True), (30, False), (20, True), (30, False)):
+            postings.add(epoch, won)
+        self.assertEqual(list(postings.epochs), [10, 20, 30])
+        self.assertEqual(postings.wins, 2)
+        self.assertAlmostEqual(postings.win_rate, 2 / 3)
+
+class TestItemIndex(TestCase):
+    def setUp(self):
+        self.runs = [
+            FakeRun(10, "Ironclad", True, ("Burning Blood", "Vajra"), ("Bash", "Strike_R+1", "Strike_R")),
+            FakeRun(20, "Ironclad", False, ("Burning Blood",), ("Bash", "Offering")),
+            FakeRun(30, "Ironclad", True, ("Burning Blood", "Vajra"), ("Bash+1", "Offering")),
+        ]
+        get_index(1, 99).relink(self.runs)
+        self.items = ItemIndex(1, 99)
+        for run in reversed(self.runs): # out of order on purpose
+            self.items.add(run)
+
+    def tearDown(self):
+        # the index is global, and would otherwise show up as the newest one
+        run_index._indexes.pop((1, 99), None)
+
+    def test_counts(self):
+        self.assertEqual(len(self.items.get("Bash")), 3)
+        self.assertEqual(len(self.items.get("Strike_R")), 1)
+        self.assertEqual(self.items.get("Vajra").wins, 2)
+        self.assertIsNone(self.items.get("Anchor"))
+
+    def test_runs_with(self):
+        a, b, c = self.runs
+        self.assertEqual(self.items.runs_with("Offering"), [b, c])
+        self.assertEqual(self.items.runs_with("Bash", 15, 25), [b])
+        self.assertEqual(self.items.runs_with("Anchor"), [])
+
+    def test_last_with(self):
+        a, b, c = self.runs
+        self.assertIs(self.items.last_with("Vajra"), c)
+        self.assertIs(self.items.last_with("Strike_R"), a)
+        self.assertIsNone(self.items.last_with("Anchor"))
+
+    def test_last_with_unlinked(self):
+        a, b, c = self.runs
+        get_index(1, 99).relink([a, b]) # c is gone from the index, but not from the postings
+        self.assertIs(self.items.last_with("Vajra"), a)
+        get_index(1, 99).relink([b])
+        self.assertIsNone(self.items.last_with("Vajra"))
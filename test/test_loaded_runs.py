@@ -0,0 +1,88 @@
+from unittest import TestCase
+
+import json
+import os
+
+from src import server # import everything in the right order
+from src.cache.loaded_runs import LoadedRuns, get_loaded_runs
+from src.cache.run_summary import RunSummary
+from src.config import config
+from src.runs import RunParser
+from test.fakes import FakeRun
+
+class TestLoadedRuns(TestCase):
+    def setUp(self):
+        self.limits = (config.server.cache.loaded_runs, config.server.cache.loaded_megabytes)
+        config.server.cache.loaded_runs = 0
+        config.server.cache.loaded_megabytes = 0
+        self.loaded = LoadedRuns()
+        self.runs = [FakeRun(i) for i in range(5)]
+
+    def tearDown(self):
+        config.server.cache.loaded_runs, config.server.cache.loaded_megabytes = self.limits
+
+    def test_count(self):
+        config.server.cache.loaded_runs = 3
+        a, b, c, d, e = self.runs
+        for run in (a, b, c):
+            self.loaded.add(run, 100)
+        self.loaded.hit(a) # b is now the coldest
+        self.loaded.add(d, 100)
+        self.assertFalse(b.loaded)
+        self.assertTrue(a.loaded and c.loaded and d.loaded)
+        self.assertEqual(len(self.loaded), 3)
+        self.assertEqual(self.loaded.size, 300)
+        self.assertEqual(self.loaded.evictions, 1)
+
+    def test_megabytes(self):
+        config.server.cache.loaded_megabytes = 1
+        a, b, c, d, e = self.runs
+        self.loaded.add(a, 400_000)
+        self.loaded.add(b, 400_000)
+        self.loaded.add(c, 400_000)
+        self.assertFalse(a.loaded)
+        self.assertEqual(self.loaded.size, 800_000)
+        # a run bigger than the whole budget still stays, on its own
+        self.loaded.add(d, 2_000_000)
+        self.assertEqual(len(self.loaded), 1)
+        self.assertTrue(d.loaded)
+        self.assertEqual(self.loaded.evictions, 3)
+
+    def test_counters(self):
+        a, b, c, d, e = self.runs
+        self.loaded.add(a, 10)
+        self.loaded.hit(a)
+        self.loaded.hit(a)
+        self.assertEqual(self.loaded.hits, 2)
+        self.assertEqual(self.loaded.misses, 0) # the runs count their own misses
+        self.loaded.add(a, 20) # loaded again, e.g. after the file changed
+        self.assertEqual((len(self.loaded), self.loaded.size), (1, 20))
+        self.loaded.discard(a)
+        self.loaded.discard(b)
+        self.assertEqual((len(self.loaded), self.loaded.size), (0, 0))
+        self.assertEqual(self.loaded.evictions, 0)
+
+    def test_stored_run(self):
+        summary = RunSummary(10, "Ironclad", True, 20, 50, 1000, None, "", 0, (), (), ())
+        run = RunParser("test-loaded.run", 0, summary=summary)
+        run._filepath = os.path.join("test", "static", "run_matched.json")
+        loaded = get_loaded_runs()
+        hits, misses = loaded.hits, loaded.misses
+        self.assertIn("master_deck", run._data)
+        run._data
+        self.assertEqual((loaded.hits - hits, loaded.misses - misses), (1, 1))
+        run.unload()
+        run._data
+        self.assertEqual(loaded.misses - misses, 2)
+        run.unload()
+
+    def test_not_on_disk(self):
+        with open(os.path.join("test", "static", "run_matched.json")) as f:
+            data = json.load(f)
+        loaded = get_loaded_runs()
+        count = len(loaded)
+        run = RunParser("test-not-on-disk.run", 0, data)
+        self.assertEqual(len(loaded), count) # can't be unloaded
+        self.assertEqual(run.epoch, data["timestamp"])
+        self.assertTrue(repr(run).startswith("Run<"))
+        self.assertIs(run._data, data)
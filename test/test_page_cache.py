@@ -0,0 +1,88 @@
+from unittest import IsolatedAsyncioTestCase
+
+import datetime
+import gzip
+
+from aiohttp.test_utils import make_mocked_request
+
+from src import server # import everything in the right order
+from src.cache.page_cache import PageCache
+from src.cache.run_index import ProfileIndex
+from src.runs import _page_state, _streak_info
+from test.fakes import FakeRun
+
+class TestPageCache(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = PageCache(0)
+        self.rendered = 0
+
+    def render(self) -> str:
+        self.rendered += 1
+        return f"<html>{'run ' * 100}{self.rendered}</html>"
+
+    def request(self, **headers):
+        return make_mocked_request("GET", "/runs/1", headers=headers)
+
+    async def test_encoding(self):
+        resp = await self.cache.respond(self.request(**{"Accept-Encoding": "gzip, deflate"}), "1", None, self.render)
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertTrue(gzip.decompress(resp.body).endswith(b"run 1</html>"))
+
+        resp = await self.cache.respond(self.request(), "1", None, self.render)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp = await self.cache.respond(self.request(**{"Accept-Encoding": "gzip;q=0"}), "1", None, self.render)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(self.cache.renders, 1)
+
+    async def test_not_modified(self):
+        resp = await self.cache.respond(self.request(**{"Accept-Encoding": "gzip"}), "1", None, self.render)
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag.endswith('-gzip"'))
+
+        resp = await self.cache.respond(self.request(**{"Accept-Encoding": "gzip", "If-None-Match": etag}), "1", None, self.render)
+        self.assertEqual(resp.status, 304)
+        # a different encoding is a different representation
+        resp = await self.cache.respond(self.request(**{"If-None-Match": etag}), "1", None, self.render)
+        self.assertEqual(resp.status, 200)
+
+    async def test_state(self):
+        first = await self.cache.respond(self.request(), "1", (None,), self.render)
+        second = await self.cache.respond(self.request(), "1", ("https://youtu.be/x",), self.render)
+        self.assertEqual(self.cache.renders, 2)
+        self.assertNotEqual(first.headers["ETag"], second.headers["ETag"])
+        self.assertEqual(len(self.cache), 1)
+
+class _Run(FakeRun):
+    @property
+    def character_streak(self):
+        return _streak_info(self._character_streak)
+
+    @property
+    def rotating_streak(self):
+        return _streak_info(self._rotating_streak)
+
+class TestRunPageState(IsolatedAsyncioTestCase):
+    async def test_streak(self):
+        cache = PageCache(0)
+        index = ProfileIndex(1, 0)
+        runs = [_Run(10, "Ironclad", False), _Run(20, "Ironclad", True), _Run(30, "Silent", False)]
+        index.extend(runs[:2])
+        run = runs[1]
+        render = lambda: f"<html>{run.character_streak.position} / {run.character_streak.streak}</html>"
+
+        await cache.respond(make_mocked_request("GET", "/runs/20"), run.name, _page_state(run), render)
+        await cache.respond(make_mocked_request("GET", "/runs/20"), run.name, _page_state(run), render)
+        self.assertEqual(cache.renders, 1)
+
+        # another win extends the streak; the neighbours of the run stay the same
+        runs[2] = _Run(30, "Ironclad", True)
+        index.extend(runs[2:])
+        run.matched.next = None # only the streak is different
+        resp = await cache.respond(make_mocked_request("GET", "/runs/20"), run.name, _page_state(run), render)
+        self.assertEqual(cache.renders, 2)
+        self.assertEqual(resp.text, "<html>1 / 2</html>")
+
+        run.timedelta = datetime.timedelta(days=4)
+        await cache.respond(make_mocked_request("GET", "/runs/20"), run.name, _page_state(run), render)
+        self.assertEqual(cache.renders, 3)
@@ -0,0 +1,45 @@
+from unittest import IsolatedAsyncioTestCase
+
+import tempfile
+import asyncio
+import json
+import os
+
+from src.persist import Persister
+
+class TestPersister(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data = {"count": 0}
+        self.file = Persister(os.path.join(self.tmp.name, "data.json"), lambda: self.data, 0.05)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self):
+        with open(self.file.path) as f:
+            return json.load(f)
+
+    async def test_coalesce(self):
+        for i in range(10):
+            self.data["count"] = i
+            self.file.mark()
+        self.assertFalse(os.path.exists(self.file.path))
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.read(), {"count": 9})
+        self.assertEqual(self.file.marks, 10)
+        self.assertEqual(self.file.writes, 1)
+        self.assertEqual(os.listdir(self.tmp.name), ["data.json"])
+
+    async def test_flush(self):
+        self.file.interval = 60
+        self.file.mark()
+        await self.file.flush()
+        self.assertEqual(self.read(), {"count": 0})
+        self.assertFalse(self.file.dirty)
+        await self.file.flush() # nothing changed
+        self.assertEqual(self.file.writes, 1)
+
+    def test_no_loop(self):
+        self.file.mark()
+        self.assertEqual(self.read(), {"count": 0})
@@ -0,0 +1,122 @@
+from unittest import TestCase, IsolatedAsyncioTestCase, mock
+
+import threading
+import asyncio
+import json
+import os
+
+from src.cache import run_analytics
+from src.cache.run_analytics import RunAnalytics
+from test.fakes import FakeRun
+
+class TestRunAnalytics(TestCase):
+    def setUp(self):
+        with open(os.path.join("test", "static", "run_matched.json")) as f:
+            data = json.load(f)
+        self.data = data
+        self.analytics = RunAnalytics(1, 0)
+        self.analytics.add(FakeRun.from_data("1.run", data, "Ironclad", True))
+        self.analytics.add(FakeRun.from_data("2.run", data, "Ironclad", False))
+        self.analytics.add(FakeRun.from_data("3.run", data, "Silent", False))
+
+    def test_counts(self):
+        stats = self.analytics.get()
+        self.assertEqual(stats.runs, 3)
+        self.assertEqual(stats.wins, 1)
+        self.assertEqual(stats.killed_by["Hexaghost"], 2)
+        self.assertEqual(self.analytics.get("Ironclad").runs, 2)
+        self.assertEqual(self.analytics.get("Watcher").runs, 0)
+
+    def test_cards(self):
+        stats = self.analytics.get("Ironclad")
+        card = stats.card("Feel No Pain")
+        self.assertEqual(card.offered, 2)
+        self.assertEqual(card.picked, 2)
+        self.assertEqual(card.floors[1], 2)
+        skipped = stats.card("Sword Boomerang")
+        self.assertEqual(skipped.picked, 0)
+        self.assertGreaterEqual(skipped.offered, 2)
+
+    def test_relics(self):
+        stats = self.analytics.get()
+        relic = stats.relic("Lizard Tail")
+        self.assertEqual(relic.runs, 3)
+        self.assertEqual(relic.wins, 1)
+        self.assertEqual(stats.relic("Mark of Pain").floors[17], 3)
+        self.assertEqual(stats.relic("Ornamental Fan").floors[3], 3)
+
+    def test_no_duplicates(self):
+        self.analytics.add(FakeRun.from_data("1.run", self.data, "Ironclad", True))
+        self.assertEqual(len(self.analytics), 3)
+        self.assertEqual(self.analytics.get().runs, 3)
+
+    def test_round_trip(self):
+        self.analytics.flush()
+        value = json.loads(json.dumps(self.analytics.to_json()))
+        other = RunAnalytics.from_json(1, 0, value)
+        self.assertEqual(len(other), 3)
+        self.assertEqual(other.get().card("Feel No Pain").floors, self.analytics.get().card("Feel No Pain").floors)
+        self.assertEqual(other.get().relic("Lizard Tail").wins, 1)
+
+    def test_serialize_only(self):
+        run = FakeRun.from_data("4.run", self.data, "Silent", True)
+        self.analytics.add(run)
+        self.assertEqual(len(self.analytics.to_json()["files"]), 0) # nothing counted yet
+        self.assertEqual(run.reads, 0)
+
+class TestCountInThread(IsolatedAsyncioTestCase):
+    async def test_flush_async(self):
+        with open(os.path.join("test", "static", "run_matched.json")) as f:
+            data = json.load(f)
+        analytics = RunAnalytics(1, 0)
+        analytics.add(FakeRun.from_data("1.run", data, "Ironclad", True))
+        analytics.add(FakeRun.from_data("2.run", data, "Silent", False))
+        await analytics.flush_async()
+        self.assertTrue(analytics.dirty)
+        self.assertEqual(analytics.get().runs, 2)
+        self.assertEqual(analytics.get("Ironclad").card("Feel No Pain").picked, 1)
+        analytics.add(FakeRun.from_data("2.run", data, "Silent", False))
+        await analytics.flush_async()
+        self.assertEqual(len(analytics), 2)
+
+class _SlowRun(FakeRun):
+    event: threading.Event
+
+    def read_data(self):
+        if threading.current_thread() is not threading.main_thread():
+            self.event.wait(5)
+        return super().read_data()
+
+class TestSaveInThread(IsolatedAsyncioTestCase):
+    def setUp(self):
+        with open(os.path.join("test", "static", "run_matched.json")) as f:
+            self.data = json.load(f)
+        self.analytics = RunAnalytics(1, 0)
+        self.event = threading.Event()
+        self.addCleanup(self.event.set)
+
+    async def test_get_while_counting(self):
+        for run in (_SlowRun.from_data("1.run", self.data, "Ironclad", True), _SlowRun.from_data("2.run", self.data, "Silent", False)):
+            run.event = self.event
+            self.analytics.add(run)
+        task = asyncio.create_task(self.analytics.flush_async())
+        while not self.analytics._counting:
+            await asyncio.sleep(0)
+        self.assertEqual(self.analytics.get().runs, 2) # not the partial counts
+        self.event.set()
+        await task
+        self.assertEqual(self.analytics.get().runs, 2) # and not counted twice
+        self.assertEqual(len(self.analytics), 2)
+
+    async def test_save(self):
+        run = FakeRun.from_data("1.run", self.data, "Ironclad", True)
+        self.analytics.add(run)
+        with mock.patch.object(run_analytics, "_analytics", {(1, 0): self.analytics}), mock.patch.object(run_analytics, "_file") as file:
+            run_analytics.save_analytics()
+            file.mark.assert_not_called() # not before the runs are counted
+            self.assertEqual(run.reads, 0)
+            await run_analytics._saving
+            file.mark.assert_called_once()
+            self.assertEqual(run.reads, 1)
+            self.assertEqual(run_analytics._to_json()["profiles"]["1:0"]["files"], ["1.run"])
+            self.assertFalse(self.analytics.dirty)
@@ -0,0 +1,64 @@
+from unittest import TestCase, skipIf
+
+from src.cache.run_columns import RunColumns, np
+from test.fakes import FakeRun
+
+@skipIf(np is None, "numpy is not installed")
+class TestRunColumns(TestCase):
+    def setUp(self):
+        self.columns = RunColumns()
+        self.runs = [
+            FakeRun(30, "Ironclad", True, ("Burning Blood", "Vajra"), ("Bash+1", "Offering"), score=900),
+            FakeRun(10, "Ironclad", False, ("Burning Blood",), ("Bash", "Strike_R")),
+            FakeRun(20, "Silent", True, ("Ring of the Snake", "Vajra"), ("Neutralize", "Offering"), score=700),
+            FakeRun(40, "Regent", False, ("Divine Right",), ("Strike",), score=None, game=2),
+        ]
+        for run in self.runs:
+            self.columns.add(run)
+
+    def rows(self, **filters) -> list[int]:
+        return [self.columns.runs[i].epoch for i in self.columns.select(**filters)]
+
+    def test_select(self):
+        self.assertEqual(len(self.columns), 4)
+        self.assertEqual(self.rows(), [40, 30, 20, 10])
+        self.assertEqual(self.rows(start=15, end=35), [30, 20])
+        self.assertEqual(self.rows(characters=["Ironclad"]), [30, 10])
+        self.assertEqual(self.rows(characters=["Watcher"]), [])
+        self.assertEqual(self.rows(won=False), [40, 10])
+        self.assertEqual(self.rows(min_score=800), [30])
+
+    def test_items(self):
+        self.assertEqual(self.rows(relics=["Vajra"]), [30, 20])
+        self.assertEqual(self.rows(relics=["Vajra", "Burning Blood"]), [30])
+        self.assertEqual(self.rows(cards=["Bash"]), [30, 10]) # upgrades count as the same card
+        self.assertEqual(self.rows(cards=["Offering"], characters=["Silent"]), [20])
+        self.assertEqual(self.rows(relics=["Anchor"]), [])
+
+    def test_queued_items(self):
+        self.columns.flush()
+        self.columns.add(FakeRun(50, "Defect", True, ("Cracked Core", "Vajra")))
+        self.assertNotIn("Cracked Core", self.columns.relics)
+        self.assertEqual(self.rows(relics=["Cracked Core"]), [50])
+        self.assertIn("Cracked Core", self.columns.relics)
+        self.columns.add(self.runs[0]) # already in
+        self.assertEqual(len(self.columns), 5)
+
+    def test_bits(self):
+        # enough runs to grow the arrays, with bits on both sides of byte boundaries
+        for epoch in range(100, 2100):
+            self.columns.add(FakeRun(epoch, "Watcher", epoch % 3 == 0, ("Pure Water", "Vajra") if epoch % 7 == 0 else ("Pure Water",)))
+        rows = self.columns.select(relics=["Vajra"], start=100)
+        self.assertEqual(sorted(self.columns.runs[i].epoch for i in rows), [x for x in range(100, 2100) if x % 7 == 0])
+        bits = self.columns.relics["Burning Blood"]
+        self.assertEqual(bits[0], 0b11000000) # rows 0 and 1
+        self.assertEqual(int(np.unpackbits(bits).sum()), 2)
+
+    def test_describe(self):
+        stats = self.columns.describe(self.columns.select())
+        self.assertEqual((stats["count"], stats["wins"], stats["losses"]), (4, 2, 2))
+        self.assertEqual(stats["winrate"], 0.5)
+        self.assertEqual(stats["average_score"], (900 + 100 + 700) / 3) # Spire 2 has no score
+        self.assertEqual(stats["characters"], [("Ironclad", 2, 1), ("Silent", 1, 1), ("Regent", 1, 0)])
+        empty = self.columns.describe(self.columns.select(characters=["Watcher"]))
+        self.assertEqual((empty["count"], empty["winrate"], empty["average_floor"]), (0, 0.0, 0.0))
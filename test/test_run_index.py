@@ -0,0 +1,115 @@
+from unittest import TestCase
+
+import tempfile
+import os
+
+from src.cache.run_index import ProfileIndex
+from test.fakes import FakeRun
+
+class TestProfileIndex(TestCase):
+    def setUp(self):
+        self.index = ProfileIndex(1, 0)
+        self.runs = [
+            FakeRun(10, "Ironclad", True),
+            FakeRun(20, "Silent", False),
+            FakeRun(30, "Ironclad", False),
+            FakeRun(40, "Silent", True),
+            FakeRun(50, "Ironclad", False),
+        ]
+        self.index.extend(self.runs)
+
+    def test_links(self):
+        a, b, c, d, e = self.runs
+        self.assertIs(e.matched.prev, d)
+        self.assertIs(c.matched.next, d)
+        self.assertIs(e.matched.prev_char, c)
+        self.assertIs(c.matched.prev_char, a)
+        self.assertIs(d.matched.prev_win, a)
+        self.assertIs(e.matched.prev_loss, c)
+        self.assertIsNone(a.matched.prev)
+
+    def test_latest(self):
+        a, b, c, d, e = self.runs
+        self.assertIs(self.index.latest(None, None), e)
+        self.assertIs(self.index.latest(None, True), d)
+        self.assertIs(self.index.latest(None, False), e)
+        self.assertIs(self.index.latest("Ironclad", None), e)
+        self.assertIs(self.index.latest("Ironclad", True), a)
+        self.assertIs(self.index.latest("Silent", False), b)
+        self.assertIsNone(self.index.latest("Defect", None))
+        self.assertIsNone(self.index.latest("Defect", True))
+
+    def test_append(self):
+        new = FakeRun(60, "Ironclad", True)
+        self.index.extend([new])
+        self.assertIs(new.matched.prev, self.runs[-1])
+        self.assertIs(self.index.latest("Ironclad", True), new)
+        self.assertIs(self.index.latest(None, True), new)
+        self.assertIs(self.index.latest("Ironclad", False), self.runs[-1])
+
+    def test_out_of_order(self):
+        old = FakeRun(35, "Defect", True)
+        self.index.extend([old])
+        self.assertEqual([x.epoch for x in self.index.runs], [10, 20, 30, 35, 40, 50])
+        self.assertIs(old.matched.prev, self.runs[2])
+        self.assertIs(old.matched.next, self.runs[3])
+        self.assertIs(self.runs[3].matched.prev_win, old)
+        self.assertIs(self.index.latest("Defect", True), old)
+        self.assertIs(self.index.latest(None, None), self.runs[-1])
+
+    def test_between(self):
+        self.assertEqual([x.epoch for x in self.index.between(20, 40)], [20, 30, 40])
+        self.assertEqual([x.epoch for x in self.index.between(21, 39)], [30])
+        self.assertEqual([x.epoch for x in self.index.between(0, 5)], [])
+        self.assertEqual([x.epoch for x in self.index.between(45, 1000)], [50])
+
+    def test_streaks(self):
+        def info(x):
+            if x is None:
+                return None
+            block, position = x
+            return (block.streak, position, block.is_ongoing)
+
+        a, b, c, d, e = self.runs
+        self.assertEqual(info(a._character_streak), (1, 1, False))
+        self.assertIsNone(e._character_streak)
+        self.assertEqual(info(d._rotating_streak), (1, 1, False))
+
+        f = FakeRun(60, "Silent", True)
+        g = FakeRun(70, "Silent", True)
+        h = FakeRun(80, "Ironclad", True)
+        self.index.extend([f, g, h])
+        self.assertEqual(info(d._character_streak), (3, 1, True))
+        self.assertEqual(info(g._character_streak), (3, 3, True))
+        self.assertEqual(info(h._character_streak), (1, 1, True))
+        # same character twice in a row doesn't count for rotating streaks
+        self.assertEqual(info(f._rotating_streak), (2, 1, True))
+        self.assertEqual(info(g._rotating_streak), (2, 1, True))
+        self.assertEqual(info(h._rotating_streak), (2, 2, True))
+
+        self.index.extend([FakeRun(90, "Silent", False)])
+        self.assertEqual(info(g._character_streak), (3, 3, False))
+        self.assertEqual(info(h._character_streak), (1, 1, True))
+        self.assertEqual(info(h._rotating_streak), (2, 2, False))
+
+    def test_extend_twice(self):
+        new = FakeRun(60, "Ironclad", True)
+        self.index.extend([new])
+        self.index.extend([new])
+        self.assertEqual([x.epoch for x in self.index.runs], [10, 20, 30, 40, 50, 60])
+        self.assertIs(new.matched.prev, self.runs[-1])
+        self.assertIsNone(new.matched.next)
+        # same thing, but through a relink
+        old = FakeRun(15, "Defect", True)
+        self.index.extend([old, self.runs[1], old])
+        self.assertEqual([x.epoch for x in self.index.runs], [10, 15, 20, 30, 40, 50, 60])
+        self.assertIs(old.matched.next, self.runs[1])
+        self.assertIs(self.runs[1].matched.prev, old)
+
+    def test_scan(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.index.path = tmp
+            for name in ("10.run", "60.run", "70.run", "80.run.tmp"):
+                open(os.path.join(tmp, name), "w").close()
+            self.index.incoming.add("70.run")
+            self.assertEqual(self.index.scan(), ["60.run"])
@@ -0,0 +1,84 @@
+from unittest import TestCase
+
+import tempfile
+import sqlite3
+import os
+
+from src.cache import run_summary
+from src.cache.run_summary import RunSummary, SummaryStore
+
+def _summary(epoch: int, **fields) -> RunSummary:
+    return RunSummary(epoch, "Ironclad", True, 20, 50, 1000, None, "SEED", 3600, ("Lethality",), ("Burning Blood",), ("Bash", "Strike_R+1"))._replace(**fields)
+
+class TestSummaryStore(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "index.sqlite3")
+        self.run = os.path.join(self.tmp.name, "1.run")
+        with open(self.run, "w") as f:
+            f.write("{}")
+        self.st = os.stat(self.run)
+        self.stores: list[SummaryStore] = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        self.tmp.cleanup()
+
+    def reopen(self) -> SummaryStore:
+        store = SummaryStore(self.path)
+        self.stores.append(store)
+        return store
+
+    def test_round_trip(self):
+        store = self.reopen()
+        summary = _summary(10, floor_values=b"\x01\x00\x00\x00")
+        store.put(self.run, self.st, summary)
+        self.assertEqual(store.get(self.run, self.st), summary)
+        store.commit()
+        self.assertEqual(self.reopen().get(self.run, self.st), summary)
+
+    def test_uncommitted(self):
+        store = self.reopen()
+        store.put(self.run, self.st, _summary(10))
+        self.assertIsNone(self.reopen().get(self.run, self.st))
+        store.commit()
+        store.put(self.run, self.st, _summary(10, won=False))
+        self.assertTrue(self.reopen().get(self.run, self.st).won)
+
+    def test_close(self):
+        store = self.reopen()
+        store.put(self.run, self.st, _summary(10))
+        store.close()
+        self.assertIsNone(store._conn)
+        store.close() # already closed
+        self.assertEqual(self.reopen().get(self.run, self.st), _summary(10)) # saved on close
+        store.put(self.run, self.st, _summary(10, won=False)) # and opened again
+        store.commit()
+        self.assertFalse(self.reopen().get(self.run, self.st).won)
+
+    def test_stale(self):
+        store = self.reopen()
+        store.put(self.run, self.st, _summary(10))
+        store.commit()
+        with open(self.run, "w") as f:
+            f.write("{} ")
+        self.assertIsNone(self.reopen().get(self.run, os.stat(self.run))) # size
+        os.utime(self.run, ns=(self.st.st_atime_ns, self.st.st_mtime_ns + 1_000_000_000))
+        st = os.stat(self.run)
+        self.assertIsNone(self.reopen().get(self.run, st)) # mtime
+        self.assertIsNone(self.reopen().get(os.path.join(self.tmp.name, "2.run"), st))
+
+    def test_schema_version(self):
+        store = self.reopen()
+        store.put(self.run, self.st, _summary(10))
+        store.commit()
+        conn = sqlite3.connect(self.path)
+        conn.execute(f"PRAGMA user_version = {run_summary._SCHEMA_VERSION - 1}")
+        conn.commit()
+        conn.close()
+        store = self.reopen()
+        self.assertIsNone(store.get(self.run, self.st))
+        store.put(self.run, self.st, _summary(10))
+        store.commit()
+        self.assertEqual(self.reopen().get(self.run, self.st), _summary(10))
@@ -0,0 +1,143 @@
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import patch
+from types import SimpleNamespace
+
+import tempfile
+import json
+import time
+import os
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from src import server # import everything in the right order
+from src import runs
+from src.cache import run_index, item_index, run_stats, mastered
+from src.cache.cache_helpers import RunStats, RunStatsByDate, MasteryStats
+from src.cache.loaded_runs import get_loaded_runs
+from src.cache.run_analytics import get_analytics
+from src.cache.run_columns import get_columns
+from src.cache.run_summary import RunSummary, SummaryStore
+from src.config import config
+
+class TestGetParser(TestCase):
+    def setUp(self):
+        self.parsers = []
+
+    def tearDown(self):
+        for parser in self.parsers:
+            runs._cache.pop(parser.filename, None)
+            runs._ts_cache.pop(parser.epoch, None)
+            runs._names.pop(parser.name, None)
+            if (columns := get_columns()) is not None and parser in columns._pending:
+                columns._pending.remove(parser)
+            get_analytics(1, 98)._pending.clear()
+        runs._missing.clear()
+
+    def ingest(self, name: str, epoch: int) -> runs.RunParser:
+        summary = RunSummary(epoch, "Ironclad", True, 20, 50, 1000, None, "", 0, (), (), ())
+        parser = runs.RunParser(f"{name}.run", 98, summary=summary)
+        self.parsers.append(parser)
+        runs._add_parser(parser)
+        return parser
+
+    def test_found_after_miss(self):
+        with patch.object(runs, "_update_cache") as update:
+            self.assertIsNone(runs.get_parser("test-later"))
+            self.assertIsNone(runs.get_parser("test-later"))
+            self.assertEqual(update.call_count, 1) # the second miss is remembered
+            parser = self.ingest("test-later", 1_000_000_001)
+            self.assertIs(runs.get_parser("test-later"), parser)
+            self.assertEqual(update.call_count, 1)
+
+    def test_expired(self):
+        with patch.object(runs, "_update_cache") as update:
+            self.assertIsNone(runs.get_parser("test-expired"))
+            runs._missing["test-expired"] = time.time() - 1
+            self.assertIsNone(runs.get_parser("test-expired"))
+            self.assertEqual(update.call_count, 2)
+
+    def test_cap(self):
+        now = time.time()
+        with patch.object(runs, "_update_cache"), patch.object(runs, "_MISSING_MAX", 4):
+            runs._missing.update({"a": now - 1, "b": now - 1, "c": now + 30, "d": now + 30})
+            runs.get_parser("e") # the expired ones make room
+            self.assertEqual(set(runs._missing), {"c", "d", "e"})
+            runs.get_parser("f")
+            runs.get_parser("g") # all still valid, so start over
+            self.assertEqual(set(runs._missing), {"g"})
+
+class TestReceiveRuns(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.cwd = os.getcwd()
+        with open(os.path.join("test", "static", "run_matched.json")) as f:
+            self.content = f.read()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        os.makedirs(os.path.join("data", "runs", "97"))
+        self.store = SummaryStore(os.path.join(self.tmp.name, "run-index.sqlite3"))
+        profile = SimpleNamespace(run_index=run_index.get_index(1, 97))
+        self.stats = RunStats()
+        self.mastery = MasteryStats()
+        for patcher in (
+            patch.object(runs, "get_store", lambda: self.store),
+            patch.object(runs, "save_analytics"),
+            patch.object(runs, "update_streak_collections"),
+            patch.object(run_stats, "get_profile", lambda x, v: profile),
+            patch.object(run_stats, "_all_run_stats", self.stats),
+            patch.object(run_stats, "_run_stats_by_date", RunStatsByDate()),
+            patch.object(mastered, "get_profile", lambda x, v: profile),
+            patch.object(mastered, "_mastery_stats", self.mastery),
+            patch.object(config.server, "secret", "test"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        app = web.Application()
+        app.router.add_post("/sync/runs", runs.receive_runs)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        for parser in run_index.get_index(1, 97).runs:
+            runs._cache.pop(parser.filename, None)
+            runs._ts_cache.pop(parser.epoch, None)
+            runs._names.pop(parser.name, None)
+            if (columns := get_columns()) is not None and parser in columns._pending:
+                columns._pending.remove(parser)
+            get_loaded_runs().discard(parser)
+        get_analytics(1, 97)._pending.clear()
+        run_index._indexes.pop((1, 97), None)
+        item_index._indexes.pop((1, 97), None)
+        self.store.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    async def upload(self, *epochs: int):
+        lines = []
+        for epoch in epochs:
+            data = json.loads(self.content)
+            data["timestamp"] = epoch
+            lines.append(json.dumps({"run": json.dumps(data), "name": f"{epoch}.run", "profile": 97, "version": 1}))
+        resp = await self.client.post("/sync/runs", data="\n".join(lines), params={"key": "test", "start": time.time()})
+        self.assertEqual((await resp.json())["count"], len(epochs))
+
+    async def test_stats(self):
+        await self.upload(1749579185)
+        self.assertEqual(self.stats.all_wins.all_character_count, 1)
+        await self.upload(1749579285, 1749579385) # both of these are counted, not just the newest
+        self.assertEqual(self.stats.all_wins.all_character_count, 3)
+        self.assertEqual(self.stats.last_timestamp, run_index.get_index(1, 97).last.timestamp)
+        self.assertEqual(self.mastery.last_run_timestamp, self.stats.last_timestamp)
+        self.assertEqual(runs._uncommitted, [])
+
+class TestCompareQuery(TestCase):
+    def test_outcome(self):
+        self.assertIsNone(runs._outcome({}))
+        self.assertIsNone(runs._outcome({"victory": "1", "loss": "1"}))
+        self.assertTrue(runs._outcome({"loss": "0"}))
+        self.assertTrue(runs._outcome({"victory": "1", "loss": "false"}))
+        self.assertFalse(runs._outcome({"loss": "1", "victory": "0"}))
+        self.assertFalse(runs._outcome({"victory": "no"}))
+        self.assertIsNone(runs._outcome({"victory": "0", "loss": "0"}))
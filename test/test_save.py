@@ -0,0 +1,132 @@
+from unittest import TestCase, mock
+
+import base64
+import json
+import os
+
+from src import server # import everything in the right order
+from src.save import Savefile, _changed_sections, _decode_savefile, _depends
+
+class _Counted:
+    def __init__(self):
+        self._sections = {"relics": 0, "stats": 0, "cards": 0}
+        self._derived = {}
+        self.calls = 0
+
+    @_depends("relics", "stats")
+    def price(self) -> int:
+        self.calls += 1
+        return 75
+
+class TestSavefileSections(TestCase):
+    def setUp(self):
+        with open(os.path.join("test", "static", "save_matched.json")) as f:
+            self.data = json.load(f)
+
+    def copy(self) -> dict:
+        return json.loads(json.dumps(self.data))
+
+    def test_changed_sections(self):
+        self.assertEqual(_changed_sections(self.data, self.copy()), set())
+        new = self.copy()
+        new["gold"] += 10
+        new["metric_playtime"] += 1
+        self.assertEqual(_changed_sections(self.data, new), {"stats", "path"})
+        new = self.copy()
+        new["relics"].append("Anchor")
+        del new["seed"]
+        self.assertEqual(_changed_sections(self.data, new), {"relics", "other"})
+
+    def test_revision(self):
+        save = Savefile(_debug=True)
+        save.update_data(self.copy(), "IRONCLAD", "false")
+        revision = save.revision
+        save.update_data(self.copy(), "IRONCLAD", "false")
+        self.assertEqual(save.revision, revision)
+
+        new = self.copy()
+        new["gold"] += 10
+        save.update_data(new, "IRONCLAD", "false")
+        self.assertEqual(save.revision, revision + 1)
+        self.assertEqual(save._sections["stats"], 2)
+        self.assertEqual(save._sections["cards"], 1)
+
+        save.update_data(None, "", "false")
+        self.assertEqual(save.revision, revision + 2)
+
+    def test_depends(self):
+        obj = _Counted()
+        self.assertEqual(obj.price, 75)
+        obj.price
+        obj._sections["cards"] += 1
+        obj.price
+        self.assertEqual(obj.calls, 1)
+        obj._sections["stats"] += 1
+        obj.price
+        self.assertEqual(obj.calls, 2)
+
+    def test_recompute(self):
+        save = Savefile(_debug=True)
+        save.update_data(self.copy(), "IRONCLAD", "false")
+        calls = dict.fromkeys(("current_purge", "potion_chance", "bottles", "_available_rare_relics"), 0)
+        def counted(name):
+            func = Savefile.__dict__[name].func
+            def inner(instance):
+                calls[name] += 1
+                return func(instance)
+            return mock.patch.object(Savefile.__dict__[name], "func", inner)
+        def compute():
+            for name in calls:
+                getattr(save, name)
+
+        patches = [counted(name) for name in calls]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        compute()
+        compute()
+        self.assertEqual(calls, dict.fromkeys(calls, 1))
+
+        new = self.copy()
+        new["gold"] += 10 # stats
+        save.update_data(new, "IRONCLAD", "false")
+        compute()
+        self.assertEqual(calls, {"current_purge": 2, "potion_chance": 2, "bottles": 1, "_available_rare_relics": 1})
+
+        new = json.loads(json.dumps(new))
+        new["bottled_flame"] = "Bash" # cards
+        new["bottled_flame_upgrade"] = 0
+        save.update_data(new, "IRONCLAD", "false")
+        compute()
+        self.assertEqual(calls, {"current_purge": 2, "potion_chance": 2, "bottles": 2, "_available_rare_relics": 1})
+
+        new = json.loads(json.dumps(new))
+        new["relics"].append("Anchor") # relics
+        save.update_data(new, "IRONCLAD", "false")
+        compute()
+        self.assertEqual(calls, {"current_purge": 3, "potion_chance": 3, "bottles": 2, "_available_rare_relics": 2})
+
+    def test_decode(self):
+        raw = json.dumps(self.data).encode("utf-8")
+        content = base64.b64encode(bytes(c ^ b"key"[i % 3] for i, c in enumerate(raw)))
+        self.assertEqual(_decode_savefile(content.decode()), self.data)
+
+    def test_delta(self):
+        save = Savefile(_debug=True)
+        with self.assertRaises(ValueError):
+            save.apply_delta({"set": {}, "delete": []}, "IRONCLAD", None)
+        save.update_data(self.copy(), "IRONCLAD", "false")
+        token = save.sync_token
+
+        save.apply_delta({"set": {"gold": 1000}, "delete": ["seed"]}, "IRONCLAD", token)
+        self.assertEqual(save.current_gold, 1000)
+        self.assertNotIn("seed", save._data)
+        self.assertEqual(save._sections["stats"], 2)
+        self.assertEqual(save._sections["cards"], 1)
+        self.assertNotEqual(save.sync_token, token)
+
+        with self.assertRaises(ValueError): # already applied
+            save.apply_delta({"set": {"gold": 5}, "delete": []}, "IRONCLAD", token)
+        with self.assertRaises(ValueError):
+            save.apply_delta({"set": {"gold": 5}, "delete": []}, "THE_SILENT", save.sync_token)
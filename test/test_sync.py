@@ -0,0 +1,84 @@
+from unittest import IsolatedAsyncioTestCase
+
+import gzip
+import json
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from src import server # import everything in the right order
+from src.config import config
+from src.runs import _ndjson_lines
+from src.sync import sync_section, content_hash, receive_sync, sync_encoding, upload_stats
+from src.utils import get_req_data
+
+@sync_section("test-echo")
+async def _echo(value: str, fail: str = ""):
+    if fail:
+        raise web.HTTPConflict(reason=fail)
+    return {"echo": value}
+
+async def _form(req: web.Request) -> web.Response:
+    value, = await get_req_data(req, "value")
+    return web.Response(text=value)
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+class TestBulkRuns(IsolatedAsyncioTestCase):
+    async def test_lines(self):
+        chunks = _chunks(b'{"a": 1}\n{"b"', b': 2}\n\n', b'{"c": ', b'3}')
+        self.assertEqual([x async for x in _ndjson_lines(chunks)], [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}'])
+        self.assertEqual([x async for x in _ndjson_lines(_chunks(b"", b"\n"))], [])
+
+class TestSyncEnvelope(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.secret = config.server.secret
+        config.server.secret = "test"
+        app = web.Application(middlewares=[sync_encoding])
+        app.router.add_post("/sync", receive_sync)
+        app.router.add_post("/sync/test-form", _form)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        config.server.secret = self.secret
+
+    async def sync(self, sections: dict, key: str = "test") -> web.Response:
+        body = gzip.compress(json.dumps({"sections": sections}).encode("utf-8"))
+        return await self.client.post("/sync", data=body, params={"key": key}, headers={"Content-Encoding": "gzip"})
+
+    async def test_sections(self):
+        data = {"value": "x"}
+        resp = await self.sync({
+            "test-echo": {"hash": content_hash(data), "data": data},
+            "unknown": {"data": {}},
+        })
+        self.assertEqual(resp.status, 200)
+        results = (await resp.json())["sections"]
+        self.assertEqual(results["test-echo"], {"status": 200, "hash": content_hash(data), "result": {"echo": "x"}})
+        self.assertEqual(results["unknown"]["status"], 404)
+
+    async def test_errors(self):
+        resp = await self.sync({
+            "test-echo": {"data": {"value": "x", "fail": "Out of sync"}},
+        })
+        self.assertEqual((await resp.json())["sections"]["test-echo"]["status"], 409)
+        resp = await self.sync({"test-echo": {"hash": "0" * 32, "data": {"value": "x"}}})
+        self.assertEqual((await resp.json())["sections"]["test-echo"]["status"], 400)
+        self.assertEqual((await self.sync({}, key="wrong")).status, 403)
+
+    async def test_compression(self):
+        upload_stats.clear()
+        resp = await self.sync({})
+        self.assertIn("gzip", resp.headers["Accept-Encoding"])
+        value = "é" + "x" * 5000
+        body = gzip.compress(f"value={value}".encode("utf-8"))
+        resp = await self.client.post("/sync/test-form", data=body, params={"key": "test"},
+            headers={"Content-Encoding": "gzip", "Content-Type": "application/x-www-form-urlencoded"})
+        self.assertEqual(await resp.text(), value)
+        stats = upload_stats["/sync/test-form"]
+        self.assertEqual(stats, {"requests": 1, "received": len(body), "decoded": len(value.encode("utf-8")) + 6})
+        self.assertEqual(upload_stats["/sync"]["requests"], 1)